@@ -19,13 +19,16 @@ def main():
     # Проверяем есть ли сохраненный пользователь
     settings = QSettings("TheatreApp", "TEAC_Auth")
     saved_username = settings.value("username", "")
+    saved_token = settings.value("token", "")
     print(f"Сохраненный пользователь: {saved_username}")
 
-    if saved_username:
-        # Проверяем существует ли пользователь
+    if saved_username and saved_token:
+        # Проверяем, что сессия еще действует
         try:
             client = SimpleTheatreClient()
-            user_data = client.get_current_user()
+            client.set_session_token(saved_token)
+            # Один запрос заполняет данные для всех страниц главного окна
+            user_data = client.bootstrap()
             print(user_data)
             if user_data and user_data['username'] == saved_username:
                 # Открываем главное окно
@@ -41,9 +44,11 @@ def main():
                 app_windows['main'].show()
                 print("Главное окно открыто")
             else:
-                # Пользователь удален из БД, показываем окно авторизации
+                # Сессия истекла или пользователь удален, показываем окно авторизации
                 print("Пользователь не найден через API")
+                client.set_session_token(None)
                 settings.remove("username")  # очищаем настройки
+                settings.remove("token")
                 show_auth_window()
 
         except Exception as e:
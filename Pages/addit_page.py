@@ -4,7 +4,7 @@ import sys
 from datetime import datetime
 
 from PyQt6 import QtWidgets
-from PyQt6.QtCore import Qt, pyqtSignal
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from PyQt6.QtGui import QStandardItemModel, QStandardItem
 from PyQt6.QtWidgets import (QFileDialog,
                              QMessageBox, QAbstractItemView)
@@ -12,6 +12,68 @@ from PyQt6.QtWidgets import (QFileDialog,
 from .base_page import BasePage
 from simple_api_client import SimpleTheatreClient
 
+# Хеш содержимого на сервере (None - файл пока есть только на этом компьютере) и имя файла
+CONTENT_HASH_ROLE = Qt.ItemDataRole.UserRole.value + 1
+FILE_NAME_ROLE = Qt.ItemDataRole.UserRole.value + 2
+
+
+class MaterialUploader(QThread):
+    """Загрузка файлов на сервер и сохранение записей о них в фоновом потоке"""
+    progress = pyqtSignal(str, int, int)   # путь, отправлено байт, всего байт
+    uploaded = pyqtSignal(str, str)        # путь, хеш содержимого (запись о файле уже сохранена)
+    failed = pyqtSignal(str, str)          # путь, сообщение об ошибке
+
+    def __init__(self, files, parent=None):
+        super().__init__(parent)
+        # Свой клиент: соединения страницы остаются GUI-потоку
+        self.client = SimpleTheatreClient()
+        self.files = files
+
+    def run(self):
+        batch = self.client.batch()
+        stored = []
+        for file in self.files:
+            file_path, file_name = file['file_path'], file['file_name']
+            uploaded = self.client.upload_material(
+                file_path, progress=lambda sent, total, path=file_path: self.progress.emit(path, sent, total)
+            )
+            if not uploaded:
+                self.failed.emit(file_path, f"Не удалось загрузить файл {file_name} на сервер")
+                continue
+
+            batch.create_additional_file(
+                file_name, file_path, file['file_size'], file['file_extension'], file['last_modified'],
+                uploaded['content_hash']
+            )
+            stored.append((file_path, file_name, uploaded['content_hash']))
+
+        # Файл считается сохраненным, только когда запись о нем создана
+        for (file_path, file_name, content_hash), result in zip(stored, batch.flush()):
+            if (result.get('body') or {}).get('success'):
+                self.uploaded.emit(file_path, content_hash)
+            else:
+                self.failed.emit(file_path, f"Не удалось сохранить файл {file_name} через API")
+
+
+class MaterialDownloader(QThread):
+    """Скачивание материала в локальный кэш в фоновом потоке"""
+    progress = pyqtSignal(str, int, int)   # хеш содержимого, получено байт, всего байт
+    downloaded = pyqtSignal(str, str)      # хеш содержимого, путь к копии ('' - не удалось)
+
+    def __init__(self, content_hash, file_name, parent=None):
+        super().__init__(parent)
+        self.client = SimpleTheatreClient()
+        self.content_hash = content_hash
+        self.file_name = file_name
+
+    def run(self):
+        file_path = self.client.fetch_material(
+            self.content_hash, self.file_name,
+            progress=lambda received, total: self.progress.emit(self.content_hash, received, total)
+        )
+        self.downloaded.emit(self.content_hash, file_path or '')
+
+
 class AdditPage(BasePage):
     navigate_to = pyqtSignal(str)
 
@@ -21,6 +83,11 @@ class AdditPage(BasePage):
         self.client = SimpleTheatreClient()
 
         self.current_user = None
+        # Фоновая загрузка файлов; добавленные во время нее уходят следующей
+        self.uploader = None
+        self.upload_again = False
+        # Скачивания материалов: хеш содержимого -> (поток, исходный текст строки)
+        self.downloads = {}
 
         self.setup_export()
         self.init_db()
@@ -54,27 +121,43 @@ class AdditPage(BasePage):
     def load_files_from_api(self):
         """Загрузка списка файлов через API"""
         try:
-            files = self.client.get_additional_files()
-            for file_data in files:
-                file_name = file_data['file_name']
-                file_path = file_data['file_path']
-                file_size = file_data['file_size']
-                file_extension = file_data['file_extension']
-
-                # Проверяем, существует ли файл
-                if os.path.exists(file_path):
-                    item = QStandardItem(f"{file_name} ({file_size})")
-                    item.setData(file_path, Qt.ItemDataRole.UserRole)
-                    item.setToolTip(
-                        f"Путь: {file_path}\nРазмер: {file_size}\nРасширение: {file_extension}")
-                    self.model.appendRow(item)
-                else:
-                    # Файл не существует, удаляем через API
-                    self.client.delete_additional_file(file_path)
-
+            self.render_files(self.client.get_additional_files())
         except Exception as e:
             print(f"Ошибка загрузки файлов: {e}")
 
+    def render_files(self, files):
+        """Заполнение списка файлов"""
+        for file_data in files:
+            file_name = file_data['file_name']
+            file_path = file_data['file_path']
+            file_size = file_data['file_size']
+            file_extension = file_data['file_extension']
+            content_hash = file_data.get('content_hash')
+
+            # Загруженное на сервер видно всем; старые записи без содержимого -
+            # только на компьютере, где лежит файл (чужие записи не удаляем)
+            if content_hash or os.path.exists(file_path):
+                item = QStandardItem(f"{file_name} ({file_size})")
+                item.setData(file_path, Qt.ItemDataRole.UserRole)
+                item.setData(content_hash, CONTENT_HASH_ROLE)
+                item.setData(file_name, FILE_NAME_ROLE)
+                item.setToolTip(
+                    f"Путь: {file_path}\nРазмер: {file_size}\nРасширение: {file_extension}")
+                self.model.appendRow(item)
+
+    def reload_files(self, files=None):
+        """Перезагрузка списка файлов (после изменений на сервере); files - уже полученный список"""
+        # Файлы, которые еще ждут загрузки на сервер, в списке остаются
+        pending = [self.model.item(i).data(Qt.ItemDataRole.UserRole) for i in range(self.model.rowCount())
+                   if not self.model.item(i).data(CONTENT_HASH_ROLE)]
+        self.model.clear()
+        if files is None:
+            self.load_files_from_api()
+        else:
+            self.render_files(files)
+        for file_path in pending:
+            self.add_file_to_list(file_path)
+
     def setup_ui_enhancements(self):
         """Дополнительные улучшения интерфейса"""
 
@@ -108,21 +191,69 @@ class AdditPage(BasePage):
             self.save_files_to_api()
 
     def save_files_to_api(self):
-        """Сохранение всех файлов из списка через API"""
+        """Загрузка новых файлов на сервер и сохранение записей о них (в фоновом потоке)"""
+        if self.uploader is not None:
+            self.upload_again = True
+            return
+
+        files = []
         for i in range(self.model.rowCount()):
             item = self.model.item(i)
             file_path = item.data(Qt.ItemDataRole.UserRole)
-            if file_path and os.path.exists(file_path):
-                file_name = os.path.basename(file_path)
-                file_size = self.get_file_size(file_path)
-                file_extension = os.path.splitext(file_path)[1]
-                last_modified = datetime.fromtimestamp(os.path.getmtime(file_path))
-
-                success = self.client.create_additional_file(
-                    file_name, file_path, file_size, file_extension, last_modified.isoformat()
-                )
-                if not success:
-                    print(f"Не удалось сохранить файл {file_name} через API")
+            # Файлы с содержимым на сервере уже сохранены
+            if file_path and not item.data(CONTENT_HASH_ROLE) and os.path.exists(file_path):
+                files.append({
+                    "file_path": file_path,
+                    "file_name": os.path.basename(file_path),
+                    "file_size": self.get_file_size(file_path),
+                    "file_extension": os.path.splitext(file_path)[1],
+                    "last_modified": datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat(),
+                })
+        if not files:
+            return
+
+        self.uploader = MaterialUploader(files, self)
+        self.uploader.progress.connect(self.on_upload_progress)
+        self.uploader.uploaded.connect(self.on_file_uploaded)
+        self.uploader.failed.connect(self.on_upload_failed)
+        self.uploader.finished.connect(self.on_upload_finished)
+        self.uploader.start()
+
+    def find_file_item(self, file_path):
+        """Строка списка с файлом или None (ее могли удалить во время загрузки)"""
+        for i in range(self.model.rowCount()):
+            item = self.model.item(i)
+            if item.data(Qt.ItemDataRole.UserRole) == file_path:
+                return item
+        return None
+
+    def on_upload_progress(self, file_path, sent, total):
+        """Процент загрузки в строке файла"""
+        item = self.find_file_item(file_path)
+        if item is not None:
+            percent = sent * 100 // total if total else 100
+            item.setText(f"{os.path.basename(file_path)} ({self.get_file_size(file_path)}) - {percent}%")
+
+    def on_file_uploaded(self, file_path, content_hash):
+        item = self.find_file_item(file_path)
+        if item is not None:
+            item.setText(f"{os.path.basename(file_path)} ({self.get_file_size(file_path)})")
+            item.setData(content_hash, CONTENT_HASH_ROLE)
+            item.setData(os.path.basename(file_path), FILE_NAME_ROLE)
+
+    def on_upload_failed(self, file_path, message):
+        """Строка остается незагруженной - при следующем сохранении файл уйдет снова"""
+        print(message)
+        item = self.find_file_item(file_path)
+        if item is not None:
+            item.setText(f"{os.path.basename(file_path)} ({self.get_file_size(file_path)})")
+
+    def on_upload_finished(self):
+        self.uploader.deleteLater()
+        self.uploader = None
+        if self.upload_again:
+            self.upload_again = False
+            self.save_files_to_api()
 
     def add_file_to_list(self, file_path):
         """Добавление файла в список"""
@@ -172,18 +303,63 @@ class AdditPage(BasePage):
     def open_file(self, index):
         """Открытие файла при двойном клике"""
         if index.isValid():
-            file_path = self.model.itemFromIndex(
-                index).data(Qt.ItemDataRole.UserRole)
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.startfile(file_path)
-                    
-                except Exception as e:
-                    QMessageBox.critical(
-                        self,
-                        "Ошибка",
-                        f"Не удалось открыть файл: {
-                            str(e)}")
+            item = self.model.itemFromIndex(index)
+            file_path = item.data(Qt.ItemDataRole.UserRole)
+            # Файла нет на этом компьютере - открываем копию, скачанную с сервера (в фоне)
+            content_hash = item.data(CONTENT_HASH_ROLE)
+            if not (file_path and os.path.exists(file_path)) and content_hash:
+                self.download_material(content_hash, item.data(FILE_NAME_ROLE))
+                return
+            self.open_local_file(file_path)
+
+    def open_local_file(self, file_path):
+        """Открытие файла программой по умолчанию"""
+        if file_path and os.path.exists(file_path):
+            try:
+                os.startfile(file_path)
+                
+            except Exception as e:
+                QMessageBox.critical(
+                    self,
+                    "Ошибка",
+                    f"Не удалось открыть файл: {
+                        str(e)}")
+
+    def download_material(self, content_hash, file_name):
+        """Запуск скачивания; файл откроется, когда оно завершится"""
+        if content_hash in self.downloads:
+            return
+        downloader = MaterialDownloader(content_hash, file_name, self)
+        downloader.progress.connect(self.on_download_progress)
+        downloader.downloaded.connect(self.on_material_downloaded)
+        self.downloads[content_hash] = (downloader, self.find_material_item(content_hash).text())
+        downloader.start()
+
+    def find_material_item(self, content_hash):
+        """Строка списка с материалом по хешу содержимого или None"""
+        for i in range(self.model.rowCount()):
+            item = self.model.item(i)
+            if item.data(CONTENT_HASH_ROLE) == content_hash:
+                return item
+        return None
+
+    def on_download_progress(self, content_hash, received, total):
+        """Процент скачивания в строке файла"""
+        item = self.find_material_item(content_hash)
+        if item is not None:
+            percent = received * 100 // total if total else 100
+            item.setText(f"{item.data(FILE_NAME_ROLE)} - скачивание {percent}%")
+
+    def on_material_downloaded(self, content_hash, file_path):
+        downloader, text = self.downloads.pop(content_hash)
+        downloader.deleteLater()
+        item = self.find_material_item(content_hash)
+        if item is not None:
+            item.setText(text)
+        if not file_path:
+            QMessageBox.warning(self, "Ошибка", "Не удалось скачать файл с сервера")
+            return
+        self.open_local_file(file_path)
 
     def show_context_menu(self, position):
         """Показ контекстного меню для списка файлов"""
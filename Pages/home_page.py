@@ -20,11 +20,36 @@ class HomePage(BasePage):
             super().showEvent(event)
 
         def setup_displays(self):
-            # Получаем информацию о ближайшем занятии через API
-            lessons = ""
-            lessons = self.client.get_lessons()
+            # Получаем ближайшее занятие через API (сервер выбирает его по индексу дат)
+            self.show_upcoming_lesson(self.client.get_upcoming_lessons(1))
+
+            self.listWidget.clear()
+
+            # Получаем организаторов через API
+            organizers = self.client.get_organizers()
+            for organizer in organizers:
+                name = organizer['username']
+                avatar_data = self.client.get_image(organizer.get('avatar_url'), size="60x60")
+                custom_item = CustomListItem(name, avatar_data)
+                item = QListWidgetItem()
+                item.setSizeHint(custom_item.sizeHint())
+                self.listWidget.addItem(item)
+                self.listWidget.setItemWidget(item, custom_item)
+
+            try:
+                participants = self.client.get_participants()
+                self.participantsList.clear()
+                
+                for participant in participants:
+                    item = f"{participant['username']}"
+                    self.participantsList.addItem(item)
+                        
+            except Exception as e:
+                print(f"Ошибка загрузки участников: {e}")
+
+        def show_upcoming_lesson(self, lessons):
+            """Ближайшее занятие в верхних блоках страницы"""
             if lessons:
-                # Берем первое занятие (предполагаем, что API возвращает отсортированный список)
                 lesson = lessons[0]
                 title = lesson['title']
                 time = lesson['time']
@@ -76,30 +101,6 @@ class HomePage(BasePage):
                     day=day, month=months[int(month) - 1], time=time))
                 self.lessonDisplay.setHtml(lesson_text.format(title=title))
 
-            self.listWidget.clear()
-
-            # Получаем организаторов через API
-            organizers = self.client.get_organizers()
-            for organizer in organizers:
-                name = organizer['username']
-                avatar_data = organizer.get('avatar')
-                custom_item = CustomListItem(name, avatar_data)
-                item = QListWidgetItem()
-                item.setSizeHint(custom_item.sizeHint())
-                self.listWidget.addItem(item)
-                self.listWidget.setItemWidget(item, custom_item)
-
-            try:
-                participants = self.client.get_participants()
-                self.participantsList.clear()
-                
-                for participant in participants:
-                    item = f"{participant['username']}"
-                    self.participantsList.addItem(item)
-                        
-            except Exception as e:
-                print(f"Ошибка загрузки участников: {e}")
-
         def setup_export(self):
             """Настройка экспорта"""
             self.exportButton.clicked.connect(self.export_to_csv)
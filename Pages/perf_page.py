@@ -6,6 +6,9 @@ from PyQt6.QtWidgets import QListWidgetItem, QMessageBox, QDialog, QVBoxLayout,
 from .base_page import BasePage
 from simple_api_client import SimpleTheatreClient  # Добавлен импорт
 
+# Таблицы журнала изменений, которые показывает страница
+PAGE_TABLES = ['performances', 'roles', 'role_applications']
+
 
 class PerfPage(BasePage):
     navigate_to = pyqtSignal(str)
@@ -17,6 +20,7 @@ class PerfPage(BasePage):
         self.current_performance = None
         self.current_role = None
         self.current_application = None
+        self.current_applicant = None
         self.current_user = None
         self.user_name = None
         self.init_db()
@@ -113,14 +117,18 @@ class PerfPage(BasePage):
 
     def load_data(self):
         """Загрузка всех данных через API"""
+        # Журнал изменений отсчитываем от момента загрузки списков
+        self.client.start_changes()
         self.load_performances()
         self.load_applications()
 
     def load_performances(self):
         """Загрузка списка спектаклей через API"""
-        self.performancesList.clear()
-        performances = self.client.get_performances()
+        self.render_performances(self.client.get_performances())
 
+    def render_performances(self, performances):
+        """Заполнение списка спектаклей"""
+        self.performancesList.clear()
         for perf in performances:
             perf_id = perf['id']
             title = perf['title']
@@ -131,9 +139,11 @@ class PerfPage(BasePage):
 
     def load_roles(self, performance_id):
         """Загрузка ролей для спектакля через API"""
-        self.rolesList.clear()
-        roles = self.client.get_roles(performance_id)
+        self.render_roles(self.client.get_roles(performance_id))
 
+    def render_roles(self, roles):
+        """Заполнение списка ролей"""
+        self.rolesList.clear()
         for role in roles:
             role_id = role['id']
             name = role['role_name']
@@ -180,9 +190,11 @@ class PerfPage(BasePage):
 
     def load_applications(self):
         """Загрузка заявок через API"""
-        self.applicationsList.clear()
-        applications = self.client.get_applications()
+        self.render_applications(self.client.get_applications())
 
+    def render_applications(self, applications):
+        """Заполнение списка заявок"""
+        self.applicationsList.clear()
         for app in applications:
             app_id = app['id']
             role = app['role_name']
@@ -192,6 +204,8 @@ class PerfPage(BasePage):
                 user = app['username']
                 date = app['applied_at']
                 item = QListWidgetItem(f"{role}\n{perf}\n{user}\n{date}")
+                # Заявителя нужно знать для одобрения; в заявках актера его нет
+                item.setData(Qt.ItemDataRole.UserRole + 1, user)
             else:
                 status = app['status']
                 date = app['applied_at']
@@ -201,6 +215,20 @@ class PerfPage(BasePage):
             item.setData(Qt.ItemDataRole.UserRole, app_id)
             self.applicationsList.addItem(item)
 
+    def refresh_from_changes(self):
+        """Перезагрузка только тех списков, чьи таблицы изменились по журналу"""
+        changed = self.client.sync_changes(PAGE_TABLES)
+        if changed is None:
+            # Журнал недоступен - перезагружаем списки целиком
+            changed = set(PAGE_TABLES)
+
+        if 'performances' in changed:
+            self.load_performances()
+        if self.current_performance and 'roles' in changed:
+            self.load_roles(self.current_performance)
+        if changed & set(PAGE_TABLES):
+            self.load_applications()
+
     def on_performance_selected(self, row):
         if row == -1:
             return
@@ -215,18 +243,17 @@ class PerfPage(BasePage):
             title = performance_data['title']
             desc = performance_data['description']
             date = performance_data['performance_date']
-            cover_image = performance_data.get('cover_image')
+            cover_image = self.client.get_image(performance_data.get('cover_url'), size="272x100")
 
             self.detailsTitle.setText(title)
             self.performanceDate.setText(f"{date}")
             self.performanceDescription.setText(f"{desc or 'Нет описания'}")
 
             if hasattr(self, 'coverLabel') and cover_image:
-                # Конвертируем base64 обратно в QPixmap
+                # Сервер отдает обложку сырыми байтами
                 from PyQt6.QtGui import QPixmap
-                from PyQt6.QtCore import QByteArray
                 pixmap = QPixmap()
-                pixmap.loadFromData(QByteArray.fromBase64(cover_image.encode()))
+                pixmap.loadFromData(cover_image)
                 pixmap = pixmap.scaled(
                     272,
                     100,
@@ -254,8 +281,9 @@ class PerfPage(BasePage):
 
         self.approveBtn.setEnabled(True)
         self.rejectBtn.setEnabled(True)
-        self.current_application = self.applicationsList.item(
-            row).data(Qt.ItemDataRole.UserRole)
+        item = self.applicationsList.item(row)
+        self.current_application = item.data(Qt.ItemDataRole.UserRole)
+        self.current_applicant = item.data(Qt.ItemDataRole.UserRole + 1)
 
     def apply_for_role(self):
         """Подача заявки на роль через API"""
@@ -265,7 +293,7 @@ class PerfPage(BasePage):
         success = self.client.apply_for_role(self.current_role)
         if success:
             QMessageBox.information(self, "Успех", "Заявка подана!")
-            self.load_applications()
+            self.refresh_from_changes()
         else:
             QMessageBox.warning(self, "Ошибка", "Не удалось подать заявку")
 
@@ -274,30 +302,17 @@ class PerfPage(BasePage):
         if not self.current_application:
             return
 
-        # Получаем информацию о заявке, чтобы узнать username заявителя
-        applications = self.client.get_applications()
-        current_app = next((app for app in applications if app['id'] == self.current_application), None)
-
-        if not current_app:
-            QMessageBox.warning(self, "Ошибка", "Заявка не найдена")
-            return
-
-        # Получаем username заявителя из заявки
-        applicant_username = current_app.get('username')  # для организатора
-        if not applicant_username:
-            # Если username нет в данных, используем поле из заявки
-            applicant_username = current_app.get('user') or current_app.get('applicant')
-
+        # Username заявителя сохранен в выбранной строке списка
+        applicant_username = self.current_applicant
         if not applicant_username:
-            QMessageBox.warning(self, "Ошибка", "Не удалось определить заявителя")
+            QMessageBox.warning(self, "Ошибка", "Заявка не найдена")
             return
 
         # Передаем username заявителя в метод approve
         success = self.client.approve_application(self.current_application, applicant_username)
         if success:
             QMessageBox.information(self, "Успех", "Заявка одобрена!")
-            self.load_roles(self.current_performance)
-            self.load_applications()
+            self.refresh_from_changes()
         else:
             QMessageBox.warning(self, "Ошибка", "Не удалось одобрить заявку")
 
@@ -309,7 +324,7 @@ class PerfPage(BasePage):
         success = self.client.reject_application(self.current_application)
         if success:
             QMessageBox.information(self, "Успех", "Заявка отклонена")
-            self.load_applications()
+            self.refresh_from_changes()
         else:
             QMessageBox.warning(self, "Ошибка", "Не удалось отклонить заявку")
 
@@ -325,7 +340,7 @@ class PerfPage(BasePage):
 
         dialog = AddDialog("роль", self.add_role)
         if dialog.exec():
-            self.load_roles(self.current_performance)
+            self.refresh_from_changes()
 
     def add_performance(self, title, description, date):
         """Добавление спектакля с обложкой через API"""
@@ -461,8 +476,7 @@ class PerfPage(BasePage):
                 self.current_role = None
 
                 # Обновляем интерфейс
-                self.load_roles(self.current_performance)
-                self.load_applications()
+                self.refresh_from_changes()
             else:
                 QMessageBox.critical(
                     self,
@@ -616,7 +630,7 @@ class AddDialog(QDialog):
 
         date = None
         if self.item_type == "спектакль" and hasattr(self, 'date_input'):
-            date = self.date_input.date().toString("yyyy-dd-MM")
+            date = self.date_input.date().toString("yyyy-MM-dd")
 
         self.add_callback(title, self.desc_input.toPlainText().strip(), date)
         self.accept()
@@ -326,28 +326,29 @@ class ShedPage(BasePage):
     def load_lessons_data(self):
         """Загружает данные о занятиях для календаря через API"""
         try:
-            lessons = self.client.get_lessons()
-
-            # Группируем занятия по датам
-            lessons_by_date = {}
-            for lesson in lessons:
-                date = lesson['date']
-                if date not in lessons_by_date:
-                    lessons_by_date[date] = []
-                lessons_by_date[date].append((
-                    lesson['id'],
-                    lesson['title'],
-                    lesson['description'],
-                    lesson['time'],
-                    lesson['location'],
-                    lesson['date']
-                ))
-
-            self.calendarWidget.set_lessons_data(lessons_by_date)
-
+            self.render_lessons(self.client.get_lessons())
         except Exception as e:
             print(f"Ошибка загрузки данных: {e}")
 
+    def render_lessons(self, lessons):
+        """Отметка занятий в календаре"""
+        # Группируем занятия по датам
+        lessons_by_date = {}
+        for lesson in lessons:
+            date = lesson['date']
+            if date not in lessons_by_date:
+                lessons_by_date[date] = []
+            lessons_by_date[date].append((
+                lesson['id'],
+                lesson['title'],
+                lesson['description'],
+                lesson['time'],
+                lesson['location'],
+                lesson['date']
+            ))
+
+        self.calendarWidget.set_lessons_data(lessons_by_date)
+
     def on_date_clicked(self, date):
         """Обработка клика по дате в календаре"""
         date_str = date.toString("dd-MM-yyyy")
@@ -79,8 +79,8 @@ class SimpleAuth(QWidget):
         else:
             print("Сохраненный пользователь не найден")
 
-    def save_user(self, username):
-        """Сохранение пользователя в настройках"""
+    def save_user(self, username, token=None):
+        """Сохранение пользователя (и токена сессии) в настройках"""
         print(f"Попытка сохранения пользователя: '{username}'")
         print(f"remember_check существует: {hasattr(self, 'remember_check')}")
 
@@ -93,6 +93,8 @@ class SimpleAuth(QWidget):
 
         if is_checked:
             self.settings.setValue("username", username)
+            if token:
+                self.settings.setValue("token", token)
             # Принудительно синхронизируем настройки
             self.settings.sync()
             print(f"Пользователь '{username}' сохранен. Статус синхронизации: {self.settings.status()}")
@@ -102,6 +104,7 @@ class SimpleAuth(QWidget):
             print(f"Проверка сохранения: '{saved_value}'")
         else:
             self.settings.remove("username")
+            self.settings.remove("token")
             self.settings.sync()
             print("Пользователь не сохранен (чекбокс снят)")
 
@@ -117,13 +120,16 @@ class SimpleAuth(QWidget):
         result = self.client.login(user, pwd)
 
         if result.get('success'):
-            # Сохраняем пользователя
-            self.save_user(user)
+            # Сохраняем пользователя и токен сессии
+            self.save_user(user, result.get('token'))
             print("сохранение прошло")
 
             QMessageBox.information(self, "Успех",
                                     self.INFORMATION_TEMPLATE.format(greet=user, message=self.SUCCESS_LOG))
 
+            # Стартовые данные всех страниц одним запросом
+            self.client.bootstrap()
+
             # Закрываем окно авторизации и открываем главное окно
             print("начало импорта")
             from main_window import MainWindow
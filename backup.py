@@ -0,0 +1,398 @@
+"""Горячие резервные копии theatre.db и восстановление из них.
+
+Копия снимается онлайн через backup API SQLite небольшими порциями страниц,
+пока сервер продолжает работать: в режиме WAL читатель не блокирует
+писателей. Порции читаются внутри одной транзакции чтения, поэтому копия -
+согласованный снимок на момент начала и не перезапускается от каждой
+записи сервера. Готовый снимок проверяется (quick_check), сжимается
+gzip и сохраняется как backups/theatre-<UTC-время>.db.gz вместе с
+манифестом (SHA-256, размер, версия схемы). Старые снимки удаляются по
+правилам хранения: последние N, по одному на день и по одному на неделю.
+
+Изображения и материалы в blobs/ адресуются хешем и не меняются после
+записи - их достаточно копировать обычной синхронизацией каталога.
+
+    python backup.py create                 # снимок + очистка по правилам хранения
+    python backup.py list
+    python backup.py verify latest
+    python backup.py restore --at 2026-10-18T09:00 --yes
+    python backup.py vacuum                 # разовый перевод в auto_vacuum=INCREMENTAL
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_DB_PATH = os.environ.get('THEATRE_DB_PATH', '/home/BariAlibasov/theatre/theatre.db')
+
+BACKUP_STEP_PAGES = 256             # Страниц за шаг backup API
+BACKUP_STEP_PAUSE = 0.005           # Пауза между шагами, секунды
+COMPRESS_LEVEL = 1                  # Быстрое сжатие: на ~15% крупнее уровня 6, но втрое дешевле по CPU
+COPY_CHUNK_BYTES = 1024 * 1024
+
+# Правила хранения по умолчанию
+KEEP_LAST = 12                      # Последние снимки - все
+KEEP_DAILY = 14                     # Плюс самый поздний за каждый из последних дней
+KEEP_WEEKLY = 8                     # Плюс самый поздний за каждую из последних недель
+
+SNAPSHOT_PREFIX = 'theatre-'
+SNAPSHOT_SUFFIX = '.db.gz'
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%SZ'
+
+
+def default_backup_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'backups')
+
+
+def _manifest_path(snapshot_path):
+    return snapshot_path[:-len(SNAPSHOT_SUFFIX)] + '.json'
+
+
+def read_manifest(snapshot_path):
+    with open(_manifest_path(snapshot_path), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _snapshot_time(snapshot_path):
+    """Время снимка из имени файла (UTC) или None для чужих файлов"""
+    name = os.path.basename(snapshot_path)
+    if not (name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)):
+        return None
+    try:
+        stamp = name[len(SNAPSHOT_PREFIX):-len(SNAPSHOT_SUFFIX)]
+        return datetime.strptime(stamp, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _check_database(path, thorough=True):
+    """Проверка файла БД и внешних ключей; список проблем (пустой - все в порядке).
+
+    thorough=False - quick_check без сверки индексов с таблицами: на порядок
+    быстрее, достаточно для только что снятой копии.
+    """
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        check = 'integrity_check' if thorough else 'quick_check'
+        problems = [row[0] for row in conn.execute(f'PRAGMA {check}') if row[0] != 'ok']
+        violations = conn.execute('PRAGMA foreign_key_check').fetchall()
+        if violations:
+            problems.append(f'{len(violations)} foreign key violations')
+        return problems
+    finally:
+        conn.close()
+
+
+def _schema_version(conn):
+    try:
+        return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+    except sqlite3.Error:
+        return None
+
+
+# ==================== СНИМКИ ====================
+
+def copy_database(db_path, target_path, pages=BACKUP_STEP_PAGES, pause=BACKUP_STEP_PAUSE):
+    """Онлайн-копия БД в target_path через backup API. Возвращает версию схемы копии.
+
+    Источник держит одну транзакцию чтения на все шаги: копия соответствует
+    ее началу, а записи сервера (в WAL) между шагами не заставляют backup
+    начинаться заново и сами не ждут окончания копирования.
+    """
+    source = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    try:
+        source.execute('BEGIN')
+        version = _schema_version(source)  # Первое чтение фиксирует снимок
+        source.backup(target, pages=pages, sleep=pause)
+        source.execute('COMMIT')
+        # Копия - самостоятельный файл без WAL рядом
+        target.execute('PRAGMA journal_mode = DELETE')
+        return version
+    finally:
+        target.close()
+        source.close()
+
+
+def create_backup(db_path=DEFAULT_DB_PATH, backup_dir=None, pages=BACKUP_STEP_PAGES, pause=BACKUP_STEP_PAUSE):
+    """Проверенный сжатый снимок БД; возвращает манифест (путь снимка - в 'path')"""
+    backup_dir = backup_dir or default_backup_dir(db_path)
+    os.makedirs(backup_dir, exist_ok=True)
+    created = datetime.now(timezone.utc).replace(microsecond=0)
+    snapshot_path = os.path.join(backup_dir, f'{SNAPSHOT_PREFIX}{created.strftime(TIMESTAMP_FORMAT)}{SNAPSHOT_SUFFIX}')
+    if os.path.exists(snapshot_path):
+        raise FileExistsError(f'{snapshot_path} already exists')
+
+    started = time.perf_counter()
+    fd, raw_path = tempfile.mkstemp(dir=backup_dir, suffix='.db.partial')
+    os.close(fd)
+    compressed_path = snapshot_path + '.partial'
+    try:
+        version = copy_database(db_path, raw_path, pages, pause)
+        copy_seconds = time.perf_counter() - started
+
+        problems = _check_database(raw_path, thorough=False)
+        if problems:
+            raise RuntimeError(f'Backup copy failed verification: {problems[:5]}')
+
+        raw_size = os.path.getsize(raw_path)
+        raw_sha256 = _file_sha256(raw_path)
+        with open(raw_path, 'rb') as raw, gzip.open(compressed_path, 'wb', compresslevel=COMPRESS_LEVEL) as packed:
+            shutil.copyfileobj(raw, packed, COPY_CHUNK_BYTES)
+        os.replace(compressed_path, snapshot_path)
+    finally:
+        for path in (raw_path, compressed_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    manifest = {
+        "created": created.isoformat(),
+        "source": os.path.abspath(db_path),
+        "schema_version": version,
+        "size": raw_size,
+        "sha256": raw_sha256,
+        "compressed_size": os.path.getsize(snapshot_path),
+        "copy_seconds": round(copy_seconds, 3),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    with open(_manifest_path(snapshot_path), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return dict(manifest, path=snapshot_path)
+
+
+def list_backups(backup_dir):
+    """Снимки каталога от старых к новым: [(время UTC, путь)]"""
+    if not os.path.isdir(backup_dir):
+        return []
+    snapshots = []
+    for name in os.listdir(backup_dir):
+        path = os.path.join(backup_dir, name)
+        created = _snapshot_time(path)
+        if created:
+            snapshots.append((created, path))
+    return sorted(snapshots)
+
+
+def find_backup(backup_dir, name=None, at=None):
+    """Снимок по имени/пути, 'latest' или последний не позже момента at (UTC)"""
+    snapshots = list_backups(backup_dir)
+    if name and name != 'latest':
+        path = name if os.path.exists(name) else os.path.join(backup_dir, name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'Snapshot {name} not found')
+        return path
+    if at is not None:
+        snapshots = [(created, path) for created, path in snapshots if created <= at]
+    if not snapshots:
+        raise FileNotFoundError('No matching snapshots')
+    return snapshots[-1][1]
+
+
+def prune_backups(backup_dir, keep_last=KEEP_LAST, keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY, now=None):
+    """Удаление снимков вне правил хранения; возвращает удаленные пути"""
+    snapshots = list_backups(backup_dir)
+    now = now or datetime.now(timezone.utc)
+    keep = {path for _, path in snapshots[-keep_last:]} if keep_last else set()
+
+    # Идем от новых к старым: первый встреченный снимок дня/недели - самый поздний в ней
+    days, weeks = set(), set()
+    for created, path in reversed(snapshots):
+        day = created.date()
+        week = day.isocalendar()[:2]
+        if day not in days and now - created < timedelta(days=keep_daily):
+            days.add(day)
+            keep.add(path)
+        if week not in weeks and now - created < timedelta(weeks=keep_weekly):
+            weeks.add(week)
+            keep.add(path)
+
+    removed = []
+    for _, path in snapshots:
+        if path not in keep:
+            os.remove(path)
+            if os.path.exists(_manifest_path(path)):
+                os.remove(_manifest_path(path))
+            removed.append(path)
+    return removed
+
+
+# ==================== ПРОВЕРКА И ВОССТАНОВЛЕНИЕ ====================
+
+def _unpack(snapshot_path, directory):
+    """Распаковка снимка во временный файл рядом с directory"""
+    fd, raw_path = tempfile.mkstemp(dir=directory, suffix='.db.restore')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.open(snapshot_path, 'rb') as packed:
+            shutil.copyfileobj(packed, raw, COPY_CHUNK_BYTES)
+    except BaseException:
+        os.remove(raw_path)
+        raise
+    return raw_path
+
+
+def _verify_unpacked(snapshot_path, raw_path):
+    """Сверка распакованного снимка с манифестом и проверка целостности; список проблем"""
+    problems = []
+    manifest_path = _manifest_path(snapshot_path)
+    if os.path.exists(manifest_path):
+        if _file_sha256(raw_path) != read_manifest(snapshot_path)['sha256']:
+            problems.append('SHA-256 does not match the manifest')
+    else:
+        problems.append('manifest is missing')
+    return problems + _check_database(raw_path)
+
+
+def verify_backup(snapshot_path):
+    """Полная проверка снимка: распаковка, SHA-256 по манифесту, integrity_check"""
+    try:
+        raw_path = _unpack(snapshot_path, os.path.dirname(os.path.abspath(snapshot_path)))
+    except (OSError, EOFError) as e:
+        return [f'{type(e).__name__}: {e}']
+    try:
+        return _verify_unpacked(snapshot_path, raw_path)
+    except sqlite3.Error as e:
+        return [f'{type(e).__name__}: {e}']
+    finally:
+        os.remove(raw_path)
+
+
+def restore_backup(snapshot_path, db_path=DEFAULT_DB_PATH, backup_dir=None):
+    """Восстановление БД из снимка с проверкой до и после.
+
+    Снимок сначала распаковывается и проверяется; текущая база перед
+    заменой сама сохраняется снимком. Содержимое переносится в рабочий
+    файл через backup API под блокировкой записи, поэтому запущенный
+    сервер не увидит наполовину замененный файл и продолжит работать уже
+    с восстановленными данными.
+    """
+    directory = os.path.dirname(os.path.abspath(db_path))
+    raw_path = _unpack(snapshot_path, directory)
+    try:
+        problems = _verify_unpacked(snapshot_path, raw_path)
+        if problems:
+            raise RuntimeError(f'Snapshot failed verification: {problems[:5]}')
+
+        safety = create_backup(db_path, backup_dir) if os.path.exists(db_path) else None
+
+        source = sqlite3.connect(f'file:{raw_path}?mode=ro', uri=True)
+        target = sqlite3.connect(db_path, timeout=30)
+        try:
+            source.backup(target)  # Одним шагом: читатели увидят либо старую базу, либо новую
+        finally:
+            target.close()
+            source.close()
+    finally:
+        os.remove(raw_path)
+
+    problems = _check_database(db_path)
+    if problems:
+        raise RuntimeError(f'Restored database failed verification: {problems[:5]}')
+    return {"restored_from": snapshot_path, "safety_snapshot": safety and safety['path']}
+
+
+# ==================== ОБСЛУЖИВАНИЕ ====================
+
+def enable_incremental_vacuum(db_path=DEFAULT_DB_PATH, timeout=30):
+    """Перевод БД в auto_vacuum=INCREMENTAL разовым VACUUM; None, если уже переведена.
+
+    VACUUM переписывает весь файл и на это время блокирует запись сервера,
+    поэтому запускается вручную, когда сервер простаивает. Дальше свободные
+    страницы возвращает фоновое обслуживание сервера (incremental_vacuum).
+    """
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return None
+        size = os.path.getsize(db_path)
+        started = time.perf_counter()
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        # В режиме WAL новая версия файла лежит в журнале - переносим, чтобы файл уменьшился сразу
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return {"size": size, "vacuumed_size": os.path.getsize(db_path),
+                "seconds": round(time.perf_counter() - started, 3)}
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Резервные копии базы театра')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='путь к theatre.db')
+    parser.add_argument('--dir', help='каталог снимков (по умолчанию backups/ рядом с базой)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    create = commands.add_parser('create', help='снять снимок и удалить лишние по правилам хранения')
+    prune = commands.add_parser('prune', help='только удалить лишние снимки')
+    for command in (create, prune):
+        command.add_argument('--keep-last', type=int, default=KEEP_LAST)
+        command.add_argument('--keep-daily', type=int, default=KEEP_DAILY, help='дней с ежедневным снимком')
+        command.add_argument('--keep-weekly', type=int, default=KEEP_WEEKLY, help='недель с еженедельным снимком')
+    create.add_argument('--no-prune', action='store_true')
+
+    commands.add_parser('list', help='список снимков')
+    commands.add_parser('vacuum', help='перевести базу в auto_vacuum=INCREMENTAL (разовый VACUUM, блокирует запись)')
+
+    for name, help_text in (('verify', 'проверить снимок'), ('restore', 'восстановить базу из снимка')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('snapshot', nargs='?', default='latest', help="имя, путь или 'latest'")
+        command.add_argument('--at', help='последний снимок не позже момента (ISO, UTC)')
+    commands.choices['restore'].add_argument('--yes', action='store_true', help='не спрашивать подтверждение')
+
+    args = parser.parse_args()
+    backup_dir = args.dir or default_backup_dir(args.db)
+
+    if args.command == 'create':
+        manifest = create_backup(args.db, backup_dir)
+        print(f"Created {manifest['path']}: {manifest['size']} -> {manifest['compressed_size']} bytes "
+              f"in {manifest['seconds']}s (copy {manifest['copy_seconds']}s)")
+    if args.command in ('create', 'prune') and not getattr(args, 'no_prune', False):
+        for path in prune_backups(backup_dir, args.keep_last, args.keep_daily, args.keep_weekly):
+            print(f"Removed {path}")
+    elif args.command == 'vacuum':
+        try:
+            result = enable_incremental_vacuum(args.db)
+        except sqlite3.OperationalError as e:
+            sys.exit(f"Vacuum failed: {e}")
+        if result is None:
+            print(f"{args.db} is already in auto_vacuum=INCREMENTAL mode")
+        else:
+            print(f"Vacuumed {args.db}: {result['size']} -> {result['vacuumed_size']} bytes in {result['seconds']}s")
+    elif args.command == 'list':
+        for created, path in list_backups(backup_dir):
+            print(f"{created.isoformat()}  {os.path.getsize(path):>12}  {path}")
+    elif args.command in ('verify', 'restore'):
+        at = datetime.fromisoformat(args.at).replace(tzinfo=timezone.utc) if args.at else None
+        try:
+            snapshot = find_backup(backup_dir, None if at else args.snapshot, at)
+        except FileNotFoundError as e:
+            sys.exit(str(e))
+        if args.command == 'verify':
+            problems = verify_backup(snapshot)
+            print(f"{snapshot}: {'OK' if not problems else '; '.join(problems)}")
+            sys.exit(1 if problems else 0)
+        if not args.yes and input(f"Restore {args.db} from {snapshot}? [y/N] ").strip().lower() != 'y':
+            sys.exit(1)
+        try:
+            result = restore_backup(snapshot, args.db, backup_dir)
+        except (RuntimeError, OSError, EOFError) as e:
+            sys.exit(f"Restore failed: {e}")
+        print(f"Restored from {result['restored_from']} (previous state saved to {result['safety_snapshot']})")
+
+
+if __name__ == '__main__':
+    main()
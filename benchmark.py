@@ -0,0 +1,430 @@
+"""Нагрузочный тест API сервера на синтетических данных.
+
+Поднимает server.py на временной базе, заполненной fixtures.py данными
+нужного масштаба, гоняет маршруты заданной смесью в несколько потоков и пишет
+задержки p50/p95/p99 и запросы в секунду по маршрутам в JSON. С --baseline
+сравнивает результат с сохраненным прогоном.
+
+    python benchmark.py --scale 0.1 --mix read --concurrency 8 --duration 30 \\
+        --output bench.json --baseline baseline.json
+
+С --backup-interval во время замера в фоне снимаются горячие копии
+(backup.py): сравнение с прогоном без копий показывает их влияние на задержки.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+import backup
+import fixtures
+
+
+# ==================== ДАННЫЕ ====================
+
+def create_tokens(server, usernames):
+    """Сессии для потоков нагрузки без прохода через /api/login"""
+    conn = sqlite3.connect(server.DATABASE_PATH)
+    with conn:
+        tokens = {username: server.create_session(conn, username) for username in usernames}
+    conn.close()
+    return tokens
+
+
+# ==================== СМЕСИ ЗАПРОСОВ ====================
+
+class Workload:
+    """Общее состояние прогона: идентификаторы строк для запросов и удалений"""
+
+    def __init__(self, counts, users, seed):
+        self.counts = counts
+        self.users = users
+        rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # Строки, которые можно удалить/одобрить; каждая используется один раз
+        self.pools = {
+            table: collections.deque(rng.sample(range(1, counts[key] + 1), min(counts[key], 10000)))
+            for table, key in (
+                ('applications', 'applications'), ('roles', 'roles'), ('performances', 'performances'),
+                ('lessons', 'lessons'), ('files', 'files'), ('additional_files', 'additional_files'),
+            )
+        }
+        self.change_seq = 0
+
+    def take(self, table):
+        """Следующий идентификатор из пула (None, если пул исчерпан)"""
+        with self.lock:
+            pool = self.pools[table]
+            return pool.popleft() if pool else None
+
+    def performance_id(self, rng):
+        return rng.randint(1, self.counts['performances'])
+
+    def role_id(self, rng):
+        return rng.randint(1, self.counts['roles'])
+
+
+def _id_request(method, route, table, **kwargs):
+    """Операция над строкой из пула; без свободных строк берется несуществующий id"""
+    def operation(workload, rng, username):
+        row_id = workload.take(table) or 0
+        return method, route.replace('<id>', str(row_id)), kwargs.get('json')
+    return operation
+
+
+# Операция: (workload, rng, username) -> (метод, путь, тело JSON или None).
+# Ключ - метка маршрута в отчете.
+OPERATIONS = {
+    'GET /': lambda w, r, u: ('GET', '/', None),
+    'GET /api/performances': lambda w, r, u: ('GET', '/api/performances?limit=50', None),
+    'GET /api/performances?upcoming': lambda w, r, u: ('GET', '/api/performances?upcoming=1&limit=50', None),
+    'GET /api/performances/<id>': lambda w, r, u: ('GET', f'/api/performances/{w.performance_id(r)}', None),
+    'GET /api/performances/<id>/roles': lambda w, r, u: ('GET', f'/api/performances/{w.performance_id(r)}/roles', None),
+    'GET /api/applications (actor)': lambda w, r, u: ('GET', f'/api/applications?username={u}&limit=50', None),
+    'GET /api/applications (organizer)': lambda w, r, u: ('GET', '/api/applications?role=organizer&limit=100', None),
+    'GET /api/lessons': lambda w, r, u: ('GET', f'/api/lessons?from={2020 + r.randrange(8)}-01-01&limit=100', None),
+    'GET /api/files': lambda w, r, u: ('GET', '/api/files?limit=100', None),
+    'GET /api/additional-files': lambda w, r, u: ('GET', '/api/additional-files?limit=100', None),
+    'GET /api/user/participants': lambda w, r, u: ('GET', '/api/user/participants', None),
+    'GET /api/user/organizers': lambda w, r, u: ('GET', '/api/user/organizers', None),
+    'GET /api/user/participation': lambda w, r, u: ('GET', '/api/user/participation', None),
+    'GET /api/user/avatar': lambda w, r, u: ('GET', f'/api/user/avatar?username={u}', None),
+    'GET /api/auth/me': lambda w, r, u: ('GET', '/api/auth/me', None),
+    'GET /api/bootstrap': lambda w, r, u: ('GET', '/api/bootstrap', None),
+    'GET /api/changes': lambda w, r, u: ('GET', f'/api/changes?since={w.change_seq}&limit=500', None),
+    'GET /api/cache/stats': lambda w, r, u: ('GET', '/api/cache/stats', None),
+    'GET /api/metrics': lambda w, r, u: ('GET', '/api/metrics', None),
+    'GET /api/search': lambda w, r, u: (
+        'GET', f"/api/search?q={r.choice(('спект', 'роль', 'репетиция', 'актовый зал', 'фоно', 'эскиз'))}", None
+    ),
+    'POST /api/login': lambda w, r, u: ('POST', '/api/login', {"username": u, "password": fixtures.PASSWORD}),
+    'POST /api/auth/register': lambda w, r, u: (
+        'POST', '/api/auth/register', {"username": f'new{r.getrandbits(48)}', "password": fixtures.PASSWORD}
+    ),
+    'POST /api/apply': lambda w, r, u: ('POST', '/api/apply', {"role_id": w.role_id(r), "username": u}),
+    'POST /api/applications/<id>/approve': lambda w, r, u: (
+        'POST', f'/api/applications/{w.take("applications") or 0}/approve', {"username": u}
+    ),
+    'POST /api/applications/<id>/reject': _id_request('POST', '/api/applications/<id>/reject', 'applications'),
+    'POST /api/roles': lambda w, r, u: (
+        'POST', '/api/roles', {"performance_id": w.performance_id(r), "role_name": f'Роль {r.getrandbits(32)}'}
+    ),
+    'DELETE /api/roles/<id>': _id_request('DELETE', '/api/roles/<id>', 'roles'),
+    'POST /api/performances': lambda w, r, u: (
+        'POST', '/api/performances', {"title": f'Премьера {r.getrandbits(32)}', "performance_date": '2030-01-15'}
+    ),
+    'DELETE /api/performances/<id>': _id_request('DELETE', '/api/performances/<id>', 'performances'),
+    'POST /api/lessons': lambda w, r, u: (
+        'POST', '/api/lessons', {"title": 'Репетиция', "date": f'{1 + r.randrange(28):02d}-05-2030', "time": '18:00'}
+    ),
+    'DELETE /api/lessons/<id>': _id_request('DELETE', '/api/lessons/<id>', 'lessons'),
+    'POST /api/files': lambda w, r, u: ('POST', '/api/files', {"file_name": f'bench{r.getrandbits(32)}.pdf'}),
+    'DELETE /api/files/<id>': _id_request('DELETE', '/api/files/<id>', 'files'),
+    'POST /api/additional-files': lambda w, r, u: (
+        'POST', '/api/additional-files', {"file_name": 'extra.docx', "file_path": f'C:/bench/{r.getrandbits(32)}.docx'}
+    ),
+    'POST /api/user/participation': lambda w, r, u: (
+        'POST', '/api/user/participation', {"isPart": r.choice(('Yes', 'No'))}
+    ),
+    'POST /api/batch': lambda w, r, u: ('POST', '/api/batch', {"operations": [
+        {"method": 'POST', "path": '/api/apply', "body": {"role_id": w.role_id(r), "username": u}}
+        for _ in range(5)
+    ]}),
+}
+
+# Веса операций в смесях; отсутствующие операции не выполняются
+MIXES = {
+    # Обычный день: в основном чтение, изредка запись
+    'read': {
+        'GET /api/performances': 15, 'GET /api/performances?upcoming': 5,
+        'GET /api/performances/<id>': 10, 'GET /api/performances/<id>/roles': 15,
+        'GET /api/applications (actor)': 10, 'GET /api/applications (organizer)': 3,
+        'GET /api/lessons': 10, 'GET /api/files': 4, 'GET /api/additional-files': 4,
+        'GET /api/user/participants': 2, 'GET /api/user/organizers': 2,
+        'GET /api/user/participation': 3, 'GET /api/user/avatar': 2, 'GET /api/auth/me': 3,
+        'GET /api/bootstrap': 3, 'GET /api/changes': 5, 'GET /api/search': 3, 'GET /': 1,
+        'POST /api/apply': 1, 'POST /api/lessons': 1,
+    },
+    # Вечер кастинга: поток заявок и решений организатора поверх чтения ролей
+    'casting': {
+        'GET /api/performances/<id>/roles': 20, 'GET /api/applications (actor)': 10,
+        'GET /api/applications (organizer)': 10, 'GET /api/changes': 5,
+        'POST /api/apply': 30, 'POST /api/batch': 3,
+        'POST /api/applications/<id>/approve': 8, 'POST /api/applications/<id>/reject': 8,
+        'POST /api/roles': 3, 'DELETE /api/roles/<id>': 1,
+        'POST /api/login': 2,
+    },
+    # Все маршруты поровну
+    'all': {name: 1 for name in OPERATIONS},
+}
+
+
+# ==================== СЕРВЕР ====================
+
+def serve(port):
+    """Режим дочернего процесса: server.py на threaded-сервере werkzeug"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'  # keep-alive, как за прокси в продакшене
+    make_server('127.0.0.1', port, server.app, threaded=True).serve_forever()
+
+
+def start_server(db_path, verbose):
+    """Сервер в отдельном процессе - потоки нагрузки не делят с ним GIL"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    output = None if verbose else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', str(port)],
+        env=dict(os.environ, THEATRE_DB_PATH=db_path), stdout=output, stderr=output
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        try:
+            requests.get(base_url + '/', timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Benchmark server did not start')
+
+
+# ==================== ПРОГОН ====================
+
+def run_worker(base_url, workload, mix, token, username, seed, deadline, results):
+    """Поток нагрузки: случайные операции смеси до истечения времени"""
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    session = requests.Session()
+    session.headers['Authorization'] = f'Bearer {token}'
+    samples = collections.defaultdict(list)
+    statuses = collections.defaultdict(collections.Counter)
+
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        method, path, body = OPERATIONS[name](workload, rng, username)
+        started = time.perf_counter()
+        try:
+            response = session.request(method, base_url + path, json=body, timeout=30)
+            response.content  # Тело читается целиком - входит в задержку
+            status = response.status_code
+        except requests.RequestException:
+            status = 'error'
+        samples[name].append(time.perf_counter() - started)
+        statuses[name][status] += 1
+
+    results.append((samples, statuses))
+
+
+BACKUP_NICE = 10    # Приоритет процесса копий ниже сервера и нагрузки
+
+
+def run_backups(db_path, backup_dir, interval, deadline, backups):
+    """Фоновые горячие копии базы во время нагрузки, не чаще раза в interval секунд.
+
+    Копия снимается отдельным процессом с пониженным приоритетом - так, как
+    ее запускает cron, - чтобы не делить GIL с потоками нагрузки.
+    """
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup.py'),
+               '--db', db_path, '--dir', backup_dir, 'create', '--keep-last', '2', '--keep-daily', '0',
+               '--keep-weekly', '0']
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, preexec_fn=lambda: os.nice(BACKUP_NICE))
+        backups.append(backup.read_manifest(backup.list_backups(backup_dir)[-1][1]))
+        # Имя снимка - с точностью до секунды
+        time.sleep(max(interval - (time.perf_counter() - started), 1.0))
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(results, elapsed):
+    """Сводка по маршрутам: задержки в мс, запросы в секунду, коды ответов"""
+    samples = collections.defaultdict(list)
+    statuses = collections.defaultdict(collections.Counter)
+    for worker_samples, worker_statuses in results:
+        for name, values in worker_samples.items():
+            samples[name].extend(values)
+        for name, counter in worker_statuses.items():
+            statuses[name].update(counter)
+
+    def stats(values, status_counts):
+        values = sorted(values)
+        return {
+            "requests": len(values),
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+            "errors": sum(count for status, count in status_counts.items() if status == 'error' or status >= 500),
+            "statuses": {str(status): count for status, count in sorted(status_counts.items(), key=str)},
+        }
+
+    routes = {name: stats(samples[name], statuses[name]) for name in sorted(samples)}
+    total = stats([value for values in samples.values() for value in values], sum(statuses.values(), collections.Counter()))
+    return routes, total
+
+
+def compare(report, baseline, tolerance):
+    """Сравнение с базовым прогоном; список регрессий p95/rps сверх допуска (в долях)"""
+    regressions = []
+    print(f"\n{'route':45} {'p95 ms':>10} {'base':>10} {'Δ%':>7} {'rps':>9} {'base':>9} {'Δ%':>7}")
+    for name, current in report['routes'].items():
+        base = baseline.get('routes', {}).get(name)
+        if not base:
+            print(f"{name:45} {current['p95_ms']:>10} {'-':>10} {'':>7} {current['rps']:>9} {'-':>9}")
+            continue
+
+        p95_change = (current['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0
+        rps_change = (current['rps'] - base['rps']) / base['rps'] if base['rps'] else 0.0
+        print(f"{name:45} {current['p95_ms']:>10} {base['p95_ms']:>10} {p95_change * 100:>+7.1f} "
+              f"{current['rps']:>9} {base['rps']:>9} {rps_change * 100:>+7.1f}")
+
+        if p95_change > tolerance:
+            regressions.append(f"{name}: p95 {base['p95_ms']} -> {current['p95_ms']} ms")
+        if rps_change < -tolerance:
+            regressions.append(f"{name}: rps {base['rps']} -> {current['rps']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест API театра')
+    parser.add_argument('--scale', type=float, default=0.1, help='доля полного объема fixtures.py (1 = 1M заявок)')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='read')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0, help='секунды нагрузки')
+    parser.add_argument('--warmup', type=float, default=2.0, help='секунды прогрева без учета')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='допустимое ухудшение (0.15 = 15%%)')
+    parser.add_argument('--verbose', action='store_true', help='показывать вывод сервера')
+    parser.add_argument('--backup-interval', type=float, metavar='SECONDS',
+                        help='снимать резервные копии в фоне во время замера')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='theatre-bench-')
+    fixture = fixtures.generate(os.path.join(workdir, 'theatre.db'), args.scale, args.seed)
+    print(f"Built {fixture['rows']} in {fixture['seconds']}s ({workdir})")
+    import server  # Уже импортирован генератором с путем временной базы
+
+    counts, users = fixture['rows'], fixture['users']
+    # Первый поток - организатор, остальные - актеры
+    actors = users[len(fixture['organizers']):]
+    workers = [fixture['organizers'][0]] + [actors[i % len(actors)] for i in range(args.concurrency - 1)]
+    tokens = create_tokens(server, set(workers))
+
+    process, base_url = start_server(server.DATABASE_PATH, args.verbose)
+
+    workload = Workload(counts, users, args.seed)
+    # Генератор оставляет журнал изменений пустым, а since=0 - это полный снимок.
+    # Одна запись дает журналу голову, от которой /api/changes отдает дельту
+    requests.post(base_url + '/api/lessons', json={"title": 'Разогрев', "date": '01-01-2030'}, timeout=30)
+
+    mix = MIXES[args.mix]
+    backups = []
+    for phase, duration in (('warmup', args.warmup), ('measure', args.duration)):
+        conn = sqlite3.connect(server.DATABASE_PATH)
+        workload.change_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+        conn.close()
+
+        results = []
+        deadline = time.perf_counter() + duration
+        threads = [
+            threading.Thread(
+                target=run_worker,
+                args=(base_url, workload, mix, tokens[username], username, args.seed * 1000 + i, deadline, results)
+            )
+            for i, username in enumerate(workers)
+        ]
+        if phase == 'measure' and args.backup_interval:
+            threads.append(threading.Thread(
+                target=run_backups,
+                args=(server.DATABASE_PATH, os.path.join(workdir, 'backups'), args.backup_interval, deadline, backups)
+            ))
+        phase_started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - phase_started
+
+    process.terminate()
+    process.wait()
+    routes, total = summarize(results, elapsed)
+    report = {
+        "mix": args.mix,
+        "scale": args.scale,
+        "rows": counts,
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 2),
+        "seed": args.seed,
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "total": total,
+        "routes": routes,
+    }
+    if args.backup_interval:
+        report["backups"] = {
+            "interval_s": args.backup_interval,
+            "runs": len(backups),
+            "seconds": [manifest['seconds'] for manifest in backups],
+            "copy_seconds": [manifest['copy_seconds'] for manifest in backups],
+        }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'route':45} {'req':>7} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'err':>5}")
+    for name, stats in list(routes.items()) + [('TOTAL', total)]:
+        print(f"{name:45} {stats['requests']:>7} {stats['rps']:>9} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['errors']:>5}")
+    if backups:
+        print(f"\nBackups during measure: {len(backups)}, copy "
+              f"{max(manifest['copy_seconds'] for manifest in backups)}s max, "
+              f"total {max(manifest['seconds'] for manifest in backups)}s max")
+    print(f"\nReport written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print('\nRegressions:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
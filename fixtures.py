@@ -0,0 +1,336 @@
+"""Генератор базы театра production-масштаба.
+
+Из seed и масштаба детерминированно строит theatre.db: пользователи с
+аватарами, спектакли с обложками, роли с неравномерным числом заявок,
+расписание занятий на несколько лет и записи материалов. Схему создает
+init_database() из server.py; данные пишутся одной транзакцией через
+executemany, индексы и триггеры пересоздаются после загрузки.
+
+    python fixtures.py /tmp/theatre.db --scale 1 --seed 42
+"""
+import argparse
+import math
+import os
+import random
+import sqlite3
+import struct
+import time
+import zlib
+from datetime import date, datetime, timedelta, timezone
+
+# Объем данных при scale=1
+FULL_SCALE = {
+    'users': 20000,
+    'performances': 10000,
+    'roles': 100000,
+    'applications': 1000000,
+    'lessons': 50000,
+    'files': 5000,
+    'additional_files': 5000,
+}
+
+ORGANIZERS = 5                  # Первые пользователи - организаторы
+PASSWORD = 'bench'              # Пароль всех сгенерированных пользователей
+AVATAR_SHARE = 0.3              # Доля пользователей с аватаром
+COVER_SHARE = 0.7               # Доля спектаклей с обложкой
+IMAGE_VARIANTS = 256            # Различных изображений (дедуплицируются хранилищем)
+APPLICATION_SKEW = 1.1          # Показатель Ципфа: главные роли собирают большую часть заявок
+START_YEAR = 2019
+
+LOCATIONS = ['Большой зал', 'Малый зал', 'Репетиционная 1', 'Репетиционная 2', 'Актовый зал']
+LESSON_TITLES = ['Репетиция', 'Сценическая речь', 'Актерское мастерство', 'Пластика', 'Вокал']
+LESSON_SLOTS = [(1, '18:00'), (3, '18:30'), (5, '12:00'), (5, '15:00')]  # (день недели, время)
+MATERIAL_TYPES = [('.pdf', 'Сценарий'), ('.docx', 'Заметки'), ('.mp3', 'Фонограмма'), ('.mp4', 'Запись'), ('.png', 'Эскиз')]
+
+
+def scaled_counts(scale):
+    """Количество строк каждой таблицы для масштаба"""
+    counts = {table: max(1, int(count * scale)) for table, count in FULL_SCALE.items()}
+    # Организаторы плюс хотя бы несколько актеров
+    counts['users'] = max(counts['users'], ORGANIZERS + 45)
+    return counts
+
+
+def usernames(counts):
+    """Имена пользователей в порядке вставки: организаторы, затем актеры"""
+    return [f'organizer{i}' for i in range(ORGANIZERS)] + \
+           [f'actor{i}' for i in range(counts['users'] - ORGANIZERS)]
+
+
+def _png(width, height, rgb):
+    """Одноцветный PNG без Pillow"""
+    def chunk(kind, payload):
+        return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload))
+
+    row = b'\x00' + bytes(rgb) * width
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(row * height, 1))
+        + chunk(b'IEND', b'')
+    )
+
+
+def _images(server, rng, width, height):
+    """Набор изображений в хранилище: [(hash, size)]"""
+    images = []
+    for _ in range(IMAGE_VARIANTS):
+        rgb = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        images.append(server.store_blob(_png(width, height, rgb)))
+    return images
+
+
+def _format_size(size):
+    """Размер файла в формате клиента (см. AdditPage.get_file_size)"""
+    if size < 1024:
+        return f"{size} B"
+    elif size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    elif size < 1024 * 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / (1024 * 1024 * 1024):.1f} GB"
+
+
+def _application_counts(rng, role_count, total, user_count):
+    """Заявок на каждую роль: распределение Ципфа по случайному порядку ролей"""
+    weights = [1 / (rank ** APPLICATION_SKEW) for rank in range(1, role_count + 1)]
+    rng.shuffle(weights)
+    scale = total / sum(weights)
+    counts = [min(user_count, int(weight * scale)) for weight in weights]
+
+    # Остаток от округления и ограничения - по кругу тем, у кого есть место
+    missing = total - sum(counts)
+    index = 0
+    while missing > 0 and index < role_count * 2:
+        role = index % role_count
+        if counts[role] < user_count:
+            step = min(missing, user_count - counts[role], 1 + missing // role_count)
+            counts[role] += step
+            missing -= step
+        index += 1
+    return counts
+
+
+class Moments:
+    """Случайные моменты (секунды Unix) в пределах days дней от start.
+
+    Вставляются через datetime(?, 'unixepoch') - форматирование в SQLite
+    в разы быстрее strftime на миллионе строк.
+    """
+
+    def __init__(self, rng, start, days):
+        self.base = int(datetime.combine(start, datetime.min.time(), timezone.utc).timestamp())
+        self.span = days * 86400
+        self.random = rng.random
+
+    def __next__(self):
+        return self.base + int(self.random() * self.span)
+
+
+def _coprime_step(rng, modulus):
+    """Шаг, взаимно простой с modulus: прогрессия обходит все остатки без повторов"""
+    while True:
+        step = rng.randrange(1, modulus) if modulus > 1 else 1
+        if math.gcd(step, modulus) == 1:
+            return step
+
+
+def _deferred_objects(conn):
+    """Индексы и триггеры схемы (кроме автоматических) - строятся после загрузки"""
+    return conn.execute(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE type IN ('index', 'trigger') AND sql IS NOT NULL ORDER BY type, name"
+    ).fetchall()
+
+
+def generate(db_path, scale=0.1, seed=1):
+    """Построение базы в db_path (файл должен отсутствовать). Возвращает сводку"""
+    if os.path.exists(db_path):
+        raise FileExistsError(f'{db_path} already exists')
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+    # server.py читает путь к базе при импорте и сразу вызывает init_database()
+    os.environ['THEATRE_DB_PATH'] = os.path.abspath(db_path)
+    import server
+    if server.DATABASE_PATH != os.path.abspath(db_path):
+        raise RuntimeError('server is already imported with another database')
+
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    counts = scaled_counts(scale)
+    users = usernames(counts)
+    actors = users[ORGANIZERS:]
+    today = date(START_YEAR + 6, 9, 1)  # Фиксированная "сегодняшняя" дата - без зависимости от часов
+    history_days = (today - date(START_YEAR, 1, 1)).days
+    moments = Moments(rng, date(START_YEAR, 1, 1), history_days)
+
+    avatars = _images(server, rng, 120, 120)
+    covers = _images(server, rng, 544, 200)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+
+    deferred = _deferred_objects(conn)
+    conn.execute('BEGIN')
+    for kind, name, _ in deferred:
+        conn.execute(f'DROP {kind.upper()} {name}')
+
+    # Пользователи
+    user_rows = []
+    for index, username in enumerate(users):
+        avatar = rng.choice(avatars) if rng.random() < AVATAR_SHARE else (None, None)
+        user_rows.append((
+            username, PASSWORD, 'organizer' if index < ORGANIZERS else 'actor',
+            'Yes' if rng.random() < 0.6 else 'No',
+            avatar[0], avatar[1], 'image/png' if avatar[0] else None,
+        ))
+    conn.executemany(
+        'INSERT INTO user (username, password, role, isPart, avatar_hash, avatar_size, avatar_mime) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        user_rows
+    )
+
+    # Спектакли: даты по всей истории и на год вперед
+    performance_rows = []
+    for index in range(counts['performances']):
+        day = date(START_YEAR, 1, 1) + timedelta(days=rng.randrange(history_days + 365))
+        cover = rng.choice(covers) if rng.random() < COVER_SHARE else (None, None)
+        performance_rows.append((
+            f'Спектакль {index + 1}', f'Постановка №{index + 1}', day.isoformat(), day.isoformat(),
+            cover[0], cover[1], 'image/png' if cover[0] else None,
+        ))
+    conn.executemany(
+        'INSERT INTO performances (title, description, performance_date, performance_on, '
+        'cover_hash, cover_size, cover_mime) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        performance_rows
+    )
+
+    # Роли: у каждого спектакля хотя бы одна, остальные распределены случайно
+    role_performances = list(range(1, counts['performances'] + 1))[:counts['roles']]
+    role_performances += [rng.randint(1, counts['performances']) for _ in range(counts['roles'] - len(role_performances))]
+    role_performances.sort()
+    role_rows = []
+    for index, performance_id in enumerate(role_performances):
+        assigned = rng.choice(actors) if rng.random() < 0.2 else None
+        role_rows.append((
+            performance_id, f'Роль {index + 1}', '', 'assigned' if assigned else 'open', assigned,
+        ))
+    conn.executemany(
+        'INSERT INTO roles (performance_id, role_name, description, status, assigned_user) VALUES (?, ?, ?, ?, ?)',
+        role_rows
+    )
+
+    # Заявки: неравномерно по ролям. Строки размножает SQLite: актеры роли -
+    # арифметическая прогрессия по модулю числа актеров с взаимно простым шагом,
+    # поэтому внутри роли они различны, а миллион строк не проходит через Python
+    per_role = _application_counts(rng, counts['roles'], counts['applications'], len(actors))
+    conn.execute('CREATE TEMP TABLE application_plan (role_id INTEGER, amount INTEGER, first INTEGER, step INTEGER)')
+    conn.executemany(
+        'INSERT INTO application_plan VALUES (?, ?, ?, ?)',
+        (
+            (role_id, amount, rng.randrange(len(actors)), _coprime_step(rng, len(actors)))
+            for role_id, amount in enumerate(per_role, start=1) if amount
+        )
+    )
+    conn.execute('CREATE TEMP TABLE numbers (i INTEGER PRIMARY KEY)')
+    conn.executemany('INSERT INTO numbers VALUES (?)', ((i,) for i in range(max(per_role))))
+    conn.execute(
+        """INSERT INTO role_applications (role_id, username, applied_at)
+           SELECT p.role_id,
+                  'actor' || ((p.first + n.i * p.step) % :actors),
+                  datetime(:base + (p.role_id * 2654435761 + n.i * 40503) % :span, 'unixepoch')
+           FROM application_plan p JOIN numbers n ON n.i < p.amount
+           ORDER BY p.role_id, n.i""",
+        {"actors": len(actors), "base": moments.base, "span": moments.span}
+    )
+    conn.execute('DROP TABLE application_plan')
+    conn.execute('DROP TABLE numbers')
+
+    # Занятия: еженедельное расписание по слотам, неделя за неделей
+    lesson_rows = []
+    week_start = date(START_YEAR, 1, 7)
+    while len(lesson_rows) < counts['lessons']:
+        for weekday, start_time in LESSON_SLOTS:
+            if len(lesson_rows) == counts['lessons']:
+                break
+            day = (week_start + timedelta(days=weekday)).strftime('%d-%m-%Y')
+            lesson_rows.append((
+                rng.choice(LESSON_TITLES), day, start_time, '', rng.choice(LOCATIONS),
+                rng.choice(users[:ORGANIZERS]), server.normalize_lesson_start(day, start_time),
+            ))
+        week_start += timedelta(days=7)
+    conn.executemany(
+        'INSERT INTO lessons (title, date, time, description, location, created_by, starts_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        lesson_rows
+    )
+
+    # Материалы
+    file_rows = []
+    for index in range(counts['files']):
+        extension, kind = rng.choice(MATERIAL_TYPES)
+        size = int(rng.lognormvariate(13, 1.5))
+        file_rows.append((
+            f'{kind} {index + 1}{extension}', f'/materials/{index + 1}{extension}', _format_size(size),
+            extension, rng.choice(users[:ORGANIZERS]), next(moments),
+        ))
+    conn.executemany(
+        'INSERT INTO files (file_name, file_path, file_size, file_extension, uploaded_by, uploaded_at) '
+        "VALUES (?, ?, ?, ?, ?, datetime(?, 'unixepoch'))",
+        file_rows
+    )
+
+    additional_rows = []
+    for index in range(counts['additional_files']):
+        extension, kind = rng.choice(MATERIAL_TYPES)
+        modified = next(moments)
+        additional_rows.append((
+            f'{kind} {index + 1}{extension}', f'C:/Theatre/{kind}/{index + 1}{extension}',
+            _format_size(int(rng.lognormvariate(11, 2))), extension, modified, modified,
+        ))
+    # last_modified клиент пишет через isoformat(), created_date - CURRENT_TIMESTAMP
+    conn.executemany(
+        'INSERT INTO additional_files (file_name, file_path, file_size, file_extension, last_modified, created_date) '
+        "VALUES (?, ?, ?, ?, strftime('%Y-%m-%dT%H:%M:%S', ?, 'unixepoch'), datetime(?, 'unixepoch'))",
+        additional_rows
+    )
+
+    # Индексы строятся сортировкой по готовым данным, триггеры - без записи в журнал каждой строки
+    for _, _, sql in deferred:
+        conn.execute(sql)
+    # Индекс поиска заполняется триггерами - строки загрузки вносим одним проходом
+    server.rebuild_search_index(conn)
+    conn.execute('UPDATE table_versions SET version = version + 1')
+    conn.execute('COMMIT')
+
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+
+    return {
+        "path": os.path.abspath(db_path),
+        "seed": seed,
+        "scale": scale,
+        "rows": counts,
+        "users": users,
+        "organizers": users[:ORGANIZERS],
+        "password": PASSWORD,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генерация базы театра заданного масштаба')
+    parser.add_argument('path', help='путь к новой theatre.db')
+    parser.add_argument('--scale', type=float, default=0.1, help='доля полного объема (1 = 1M заявок)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    summary = generate(args.path, args.scale, args.seed)
+    print(f"Built {summary['path']} in {summary['seconds']}s: {summary['rows']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,51 @@
+import html
+import threading
 from os import path
 
 from PIL.ImageQt import QPixmap
-from PyQt6.QtCore import Qt, QSize, QSettings
+from PyQt6.QtCore import Qt, QSize, QSettings, QObject, QTimer, QDate, pyqtSignal
 from PyQt6.QtGui import QFontDatabase, QIcon, QPainter, QBrush
-from PyQt6.QtWidgets import QMainWindow, QMessageBox, QDialogButtonBox, QStyle
+from PyQt6.QtWidgets import (QMainWindow, QMessageBox, QDialogButtonBox, QStyle,
+                             QLineEdit, QListWidget, QListWidgetItem, QLabel)
 from PyQt6.uic import loadUi
 
 from pages.home_page import HomePage
 from pages.shed_page import ShedPage
-from pages.perf_page import PerfPage
+from pages.perf_page import PerfPage, PAGE_TABLES
 from pages.addit_page import AdditPage
 from simple_api_client import SimpleTheatreClient
 
 
+# Таблицы, по которым сервер присылает уведомления; reset - изменилось все
+SERVER_EVENT_TABLES = {'performances', 'roles', 'role_applications', 'lessons', 'files', 'additional_files'}
+# Пауза, за которую уведомления копятся в одну перезагрузку
+SERVER_CHANGES_DEBOUNCE_MS = 300
+
+
+# Поиск: пауза после ввода перед запросом и минимальная длина запроса
+SEARCH_DEBOUNCE_MS = 250
+SEARCH_MIN_LENGTH = 2
+SEARCH_TYPE_LABELS = {
+    'performances': 'Спектакль',
+    'roles': 'Роль',
+    'lessons': 'Занятие',
+    'files': 'Файл',
+    'additional_files': 'Материал',
+}
+
+
+class ServerEvents(QObject):
+    """Передача событий сервера из фонового потока слушателя в GUI-поток"""
+    changed = pyqtSignal(set)
+    # Данные изменившихся таблиц, загруженные в фоновом потоке
+    loaded = pyqtSignal(dict)
+
+
+class SearchEvents(QObject):
+    """Передача результатов поиска из фонового потока запроса в GUI-поток"""
+    results = pyqtSignal(str, object)
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -24,6 +57,8 @@ class MainWindow(QMainWindow):
         self.avatarLabel.mousePressEvent = lambda event: self.change_avatar()
         self.logoutButton.clicked.connect(self.logout)
         self.setup_pages()
+        self.setup_search()
+        self.start_event_listener()
         self.init_local_db()
         self.setup_navigation()
         self.current_page = None
@@ -105,7 +140,7 @@ class MainWindow(QMainWindow):
             self.usernameLabel.setText(username)
             self.current_user = username
             # Загружаем аватар
-            avatar_data = self.client.get_user_avatar(username)
+            avatar_data = self.client.get_user_avatar(username, size="60x60")
             if avatar_data:
                 self.set_avatar_image(avatar_data)
             else:
@@ -163,9 +198,11 @@ class MainWindow(QMainWindow):
         """Выход из аккаунта через API"""
         from PyQt6.QtCore import QSettings
 
-        # Удаляем сохраненного пользователя
+        # Завершаем сессию на сервере и удаляем сохраненного пользователя
+        self.client.logout()
         settings = QSettings("TheatreApp", "TEAC_Auth")
         settings.remove("username")
+        settings.remove("token")
 
         # Закрываем главное окно
         self.close()
@@ -181,8 +218,207 @@ class MainWindow(QMainWindow):
         """Закрытие БД при выходе"""
         if hasattr(self, 'conn'):
             self.conn.close()
+        self.event_listener.stop()
+        if self.search_request is not None:
+            self.search_request.cancel()
         event.accept()
 
+    def start_event_listener(self):
+        """Подписка на push-уведомления сервера об изменениях"""
+        self.server_events = ServerEvents()
+        self.server_events.changed.connect(self.on_server_changes)
+        self.server_events.loaded.connect(self.show_server_changes)
+
+        # Серия уведомлений дает одну перезагрузку; запросы идут вне GUI-потока
+        # через свой клиент, чтобы не делить соединения со страницами
+        self.pending_tables = set()
+        self.reload_running = False
+        self.reload_client = SimpleTheatreClient()
+        self.changes_timer = QTimer(self)
+        self.changes_timer.setSingleShot(True)
+        self.changes_timer.setInterval(SERVER_CHANGES_DEBOUNCE_MS)
+        self.changes_timer.timeout.connect(self.reload_server_changes)
+
+        self.event_listener = self.client.listen_events(self.on_server_event)
+
+    def on_server_event(self, event, data):
+        """Событие из фонового потока - пересылаем в GUI-поток сигналом"""
+        if event == 'reset':
+            self.server_events.changed.emit(set(SERVER_EVENT_TABLES))
+        elif event == 'changes':
+            self.server_events.changed.emit(set(data.get('tables', {})))
+
+    def on_server_changes(self, tables):
+        """Изменения копятся и перезагружаются одной пачкой после паузы"""
+        self.pending_tables |= tables
+        self.changes_timer.start()
+
+    def reload_server_changes(self):
+        """Запуск фоновой загрузки накопленных таблиц (не больше одной одновременно)"""
+        if self.reload_running or not self.pending_tables:
+            return
+        tables, self.pending_tables = self.pending_tables, set()
+        self.reload_running = True
+        # Выбранный спектакль читаем здесь: виджеты доступны только из GUI-потока
+        performance_id = self.perf_page.current_performance
+        threading.Thread(target=self.fetch_server_changes, args=(tables, performance_id), daemon=True).start()
+
+    def fetch_server_changes(self, tables, performance_id):
+        """Запросы к серверу в фоновом потоке; результат уходит в GUI-поток сигналом"""
+        client = self.reload_client
+        data = {}
+        try:
+            if 'performances' in tables:
+                data['performances'] = client.get_performances()
+            if performance_id and 'roles' in tables:
+                data['roles'] = (performance_id, client.get_roles(performance_id))
+            if tables & set(PAGE_TABLES):
+                if not client.current_user:
+                    client.get_current_user()
+                data['applications'] = client.get_applications()
+            if 'lessons' in tables:
+                data['lessons'] = client.get_lessons()
+                data['upcoming'] = client.get_upcoming_lessons(1)
+            if 'additional_files' in tables:
+                data['additional_files'] = client.get_additional_files()
+        except Exception as e:
+            print(f"Ошибка загрузки изменений: {e}")
+        finally:
+            self.server_events.loaded.emit(data)
+
+    def show_server_changes(self, data):
+        """Обновление только тех страниц, чьи данные изменились"""
+        self.reload_running = False
+        if 'performances' in data:
+            self.perf_page.render_performances(data['performances'])
+        if 'roles' in data and data['roles'][0] == self.perf_page.current_performance:
+            self.perf_page.render_roles(data['roles'][1])
+        if 'applications' in data:
+            self.perf_page.render_applications(data['applications'])
+        if 'lessons' in data:
+            self.shed_page.render_lessons(data['lessons'])
+            self.home_page.show_upcoming_lesson(data['upcoming'])
+        if 'additional_files' in data:
+            self.addit_page.reload_files(data['additional_files'])
+
+        # Пришедшее за время загрузки - следующей пачкой
+        if self.pending_tables:
+            self.changes_timer.start()
+
+    def setup_search(self):
+        """Поле поиска в боковой панели и список результатов поверх страниц"""
+        self.searchEdit = QLineEdit(self)
+        self.searchEdit.setPlaceholderText("Поиск")
+        self.searchEdit.setClearButtonEnabled(True)
+        self.verticalLayout.insertWidget(2, self.searchEdit)
+
+        self.searchResults = QListWidget(self)
+        self.searchResults.setWordWrap(True)
+        self.searchResults.hide()
+        self.searchResults.itemActivated.connect(self.open_search_result)
+        self.searchResults.itemClicked.connect(self.open_search_result)
+
+        # Запрос уходит после паузы в наборе; каждое новое нажатие откладывает его
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.run_search)
+        self.searchEdit.textChanged.connect(lambda: self.search_timer.start())
+        self.searchEdit.returnPressed.connect(self.open_first_search_result)
+
+        self.search_request = None
+        self.search_events = SearchEvents()
+        self.search_events.results.connect(self.show_search_results)
+
+    def run_search(self):
+        """Запрос поиска по тексту поля; незавершенный прошлый запрос отменяется"""
+        if self.search_request is not None:
+            self.search_request.cancel()
+            self.search_request = None
+
+        query = self.searchEdit.text().strip()
+        if len(query) < SEARCH_MIN_LENGTH:
+            self.searchResults.hide()
+            return
+        self.search_request = self.client.search_async(query, self.search_events.results.emit)
+
+    def show_search_results(self, query, data):
+        """Отрисовка результатов, если запрос еще соответствует тексту поля"""
+        if query != self.searchEdit.text().strip():
+            return
+        self.search_request = None
+        self.searchResults.clear()
+
+        items = data.get('items', []) if data else []
+        if not items:
+            text = "Ничего не найдено" if data is not None else "Поиск недоступен"
+            self.searchResults.addItem(QListWidgetItem(text))
+        for result in items:
+            details = result.get('date') or result.get('performance_date') or ''
+            text = f"<small>{SEARCH_TYPE_LABELS.get(result['type'], '')} {html.escape(details)}</small><br>{result['title']}"
+            if result.get('snippet'):
+                text += f"<br><small>{result['snippet']}</small>"
+
+            # Заголовок и фрагмент приходят HTML с подсветкой совпадений
+            label = QLabel(text)
+            label.setTextFormat(Qt.TextFormat.RichText)
+            label.setWordWrap(True)
+            item = QListWidgetItem()
+            item.setData(Qt.ItemDataRole.UserRole, result)
+            item.setSizeHint(label.sizeHint())
+            self.searchResults.addItem(item)
+            self.searchResults.setItemWidget(item, label)
+
+        # Список - под полем поиска, поверх текущей страницы (боковая панель справа)
+        bottom_right = self.searchEdit.mapTo(self, self.searchEdit.rect().bottomRight())
+        width = max(self.searchEdit.width(), 320)
+        self.searchResults.setGeometry(
+            max(0, bottom_right.x() - width), bottom_right.y(), width, min(400, self.height() - bottom_right.y())
+        )
+        self.searchResults.raise_()
+        self.searchResults.show()
+
+    def open_first_search_result(self):
+        if self.searchResults.isVisible() and self.searchResults.count():
+            self.open_search_result(self.searchResults.item(0))
+
+    def open_search_result(self, item):
+        """Переход к найденной строке на ее странице"""
+        result = item.data(Qt.ItemDataRole.UserRole)
+        if not result:
+            return
+        self.searchResults.hide()
+
+        kind = result['type']
+        if kind in ('performances', 'roles'):
+            self.switch_page("perf")
+            perf_id = result['id'] if kind == 'performances' else result.get('performance_id')
+            self.select_list_item(self.perf_page.performancesList, perf_id)
+            if kind == 'roles':
+                self.select_list_item(self.perf_page.rolesList, result['id'])
+        elif kind == 'lessons':
+            self.switch_page("shed")
+            date = QDate.fromString(result.get('date') or '', "dd-MM-yyyy")
+            if date.isValid():
+                self.shed_page.calendarWidget.setSelectedDate(date)
+                self.shed_page.on_date_clicked(date)
+        else:
+            self.switch_page("addit")
+            model = self.addit_page.model
+            for row in range(model.rowCount()):
+                if model.item(row).data(Qt.ItemDataRole.UserRole) == result.get('file_path'):
+                    self.addit_page.listView.setCurrentIndex(model.index(row, 0))
+                    break
+
+    @staticmethod
+    def select_list_item(list_widget, item_id):
+        """Выбор строки списка по id в UserRole"""
+        for row in range(list_widget.count()):
+            if list_widget.item(row).data(Qt.ItemDataRole.UserRole) == item_id:
+                list_widget.setCurrentRow(row)
+                list_widget.scrollToItem(list_widget.item(row))
+                return
+
     def setup_pages(self):
         """Инициализация всех страниц"""
         # Создаем страницы
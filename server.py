@@ -1,24 +1,937 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g, has_request_context, stream_with_context
 from flask_cors import CORS
 import sqlite3
 import os
 import base64
 import json
+import queue
+import hashlib
+import html
+import mimetypes
+import binascii
+import tempfile
+import threading
+import io
+import functools
+import collections
+import re
+import secrets
+import shutil
+import time
+import zlib
+from datetime import date as date_cls, datetime
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Без Pillow отдаем только оригиналы
+    Image = None
+
+try:
+    import orjson
+except ImportError:  # Без orjson потоковые ответы кодирует стандартный json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Без msgpack формат application/msgpack не предлагается
+    msgpack = None
 
 app = Flask(__name__)
 CORS(app)  # Разрешаем CORS для всех доменов
 
-# Абсолютный путь к базе данных для PythonAnywhere
-DATABASE_PATH = '/home/BariAlibasov/theatre/theatre.db'
+# Абсолютный путь к базе данных для PythonAnywhere (THEATRE_DB_PATH - для бенчмарков и локального запуска)
+DATABASE_PATH = os.environ.get('THEATRE_DB_PATH', '/home/BariAlibasov/theatre/theatre.db')
 
+# Хранилище изображений (обложки, аватары) рядом с БД, файлы адресуются по SHA-256
+BLOB_STORE_PATH = os.path.join(os.path.dirname(DATABASE_PATH), 'blobs')
 
-def get_db_connection():
-    """Создание соединения с БД"""
-    conn = sqlite3.connect(DATABASE_PATH)
+# Куски незавершенных загрузок материалов: uploads/<id сессии>/<номер>.part
+UPLOAD_STAGING_PATH = os.path.join(os.path.dirname(DATABASE_PATH), 'uploads')
+
+
+# Настройки пула соединений и SQLite
+DB_POOL_SIZE = 8                    # Сколько простаивающих соединений держим на процесс
+DB_BUSY_TIMEOUT = 5.0               # Секунды ожидания блокировки писателя
+DB_STATEMENT_CACHE = 256            # Размер кэша подготовленных выражений
+DB_CACHE_SIZE_KB = 16 * 1024        # Кэш страниц на соединение
+DB_MMAP_SIZE = 128 * 1024 * 1024    # Отображение файла БД в память
+
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_db_pool_pid = os.getpid()
+
+# Будит потоки /api/events после каждой фиксации транзакции в этом процессе
+_commit_condition = threading.Condition()
+
+
+CURSOR_ITER_BATCH = 256            # Строк за один замер при обходе курсора в цикле
+
+
+def _timed_cursor_method(method, starts_statement=False):
+    """Метод курсора, добавляющий свое время к query_time соединения и к статистике выражения.
+
+    Замер - один на вызов: выполнение выражения или выборку пачки строк.
+    """
+    perf_counter = time.perf_counter
+
+    def wrapper(self, *args):
+        started = perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            elapsed = perf_counter() - started
+            self.connection.query_time += elapsed
+            if starts_statement:
+                self.statement = args[0]
+                self.statement_shape = statement_shape(args[0])
+                self.parameters = args[1] if len(args) > 1 else ()
+                self.statement_time = 0.0
+                self.slow_entry = None
+            if self.statement is not None:
+                record_statement_time(self, elapsed, starts_statement)
+    return wrapper
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, учитывающий время SQLite: выполнение выражения и выборку его строк"""
+    statement = None
+    statement_shape = None
+    parameters = ()
+    statement_time = 0.0    # Время текущего выражения вместе с выборкой
+    slow_entry = None       # Запись журнала медленных запросов, если выражение туда попало
+
+    execute = _timed_cursor_method(sqlite3.Cursor.execute, starts_statement=True)
+    executemany = _timed_cursor_method(sqlite3.Cursor.executemany, starts_statement=True)
+    fetchone = _timed_cursor_method(sqlite3.Cursor.fetchone)
+    fetchmany = _timed_cursor_method(sqlite3.Cursor.fetchmany)
+    fetchall = _timed_cursor_method(sqlite3.Cursor.fetchall)
+
+    def __iter__(self):
+        # Обход в цикле выбирает строки пачками: замер и учет - на пачку, а не на строку
+        while True:
+            rows = self.fetchmany(CURSOR_ITER_BATCH)
+            yield from rows
+            if len(rows) < CURSOR_ITER_BATCH:
+                return
+
+
+class ServerConnection(sqlite3.Connection):
+    """Соединение сервера: внутри пакетного запроса commit откладывается до конца пакета"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commit_deferred = False
+        self.query_time = 0.0   # Секунды в SQLite с начала текущего запроса
+
+    def cursor(self, factory=TimedCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    # Connection.execute вызывает метод курсора из C в обход переопределений - идем через cursor()
+    def execute(self, *args):
+        return TimedCursor.execute(sqlite3.Connection.cursor(self, TimedCursor), *args)
+
+    def executemany(self, *args):
+        return TimedCursor.executemany(sqlite3.Connection.cursor(self, TimedCursor), *args)
+
+    def commit(self):
+        if not self.commit_deferred:
+            super().commit()
+            with _commit_condition:
+                _commit_condition.notify_all()
+
+
+def _open_db_connection():
+    """Открытие нового соединения в режиме WAL с настроенными PRAGMA"""
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        timeout=DB_BUSY_TIMEOUT,
+        cached_statements=DB_STATEMENT_CACHE,
+        check_same_thread=False,  # Соединение переходит между потоками через пул
+        factory=ServerConnection
+    )
     conn.row_factory = sqlite3.Row
+    # Действует только на новый файл (до WAL и первой таблицы); существующий переводит python backup.py vacuum
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA foreign_keys = ON')
     return conn
 
 
+def _acquire_db_connection():
+    """Получение соединения из пула или открытие нового"""
+    global _db_pool, _db_pool_pid
+
+    # После fork соединения родительского процесса использовать нельзя
+    if _db_pool_pid != os.getpid():
+        _db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        _db_pool_pid = os.getpid()
+
+    try:
+        return _db_pool.get_nowait()
+    except queue.Empty:
+        return _open_db_connection()
+
+
+def _release_db_connection(conn):
+    """Возврат соединения в пул (незавершенная транзакция откатывается)"""
+    try:
+        conn.commit_deferred = False
+        if conn.in_transaction:
+            conn.rollback()
+        _db_pool.put_nowait(conn)
+    except (sqlite3.Error, queue.Full):
+        conn.close()
+
+
+def get_db_connection():
+    """Соединение с БД, закрепленное за текущим запросом"""
+    if 'db' not in g:
+        g.db = _acquire_db_connection()
+        g.db.query_time = 0.0
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    """Возврат соединения в пул по завершении запроса"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        _release_db_connection(conn)
+
+
+# ==================== МЕТРИКИ ====================
+
+# Границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_route_metrics = {}
+_route_metrics_lock = threading.Lock()
+
+
+def _new_route_metrics():
+    return {
+        "count": 0, "errors": 0, "streamed": 0, "latency_sum": 0.0, "bytes_sum": 0, "sqlite_sum": 0.0,
+        # Последняя корзина - больше максимальной границы (+Inf)
+        "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+    }
+
+
+@app.before_request
+def start_request_timer():
+    # Операции /api/batch идут в том же контексте приложения (общий g) -
+    # их время и запросы к SQLite входят в метрики самого пакета
+    if g.get('batch_operation'):
+        return
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Учет запроса в метриках маршрута: число, ошибки, задержка, байты, время SQLite"""
+    started = g.get('request_started')
+    if started is None or g.get('batch_operation'):
+        return response
+
+    latency = time.perf_counter() - started
+    conn = g.get('db')
+    sqlite_time = conn.query_time if conn is not None else 0.0
+    size = response.content_length
+    streamed = size is None and response.is_streamed
+    if size is None:
+        size = 0 if streamed else response.calculate_content_length() or 0
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound), len(LATENCY_BUCKETS))
+
+    with _route_metrics_lock:
+        metrics = _route_metrics.get((request.method, route))
+        if metrics is None:
+            metrics = _route_metrics[(request.method, route)] = _new_route_metrics()
+        metrics["count"] += 1
+        metrics["streamed"] += streamed
+        metrics["errors"] += response.status_code >= 500
+        metrics["latency_sum"] += latency
+        metrics["bytes_sum"] += size
+        metrics["sqlite_sum"] += sqlite_time
+        metrics["buckets"][bucket] += 1
+
+    if streamed:
+        # Длина потокового ответа (списки, SSE) известна только после отправки
+        response.response = _counted_stream(response.response, metrics)
+    return response
+
+
+def _counted_stream(chunks, metrics):
+    """Пересылка кусков ответа с добавлением их размера к bytes_sum после отправки"""
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            yield chunk
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+        with _route_metrics_lock:
+            metrics["bytes_sum"] += sent
+
+
+def _metrics_snapshot():
+    with _route_metrics_lock:
+        return {key: dict(metrics, buckets=list(metrics["buckets"])) for key, metrics in _route_metrics.items()}
+
+
+def _latency_quantile(buckets, count, quantile):
+    """Оценка квантиля по гистограмме (верхняя граница корзины)"""
+    rank = quantile * count
+    seen = 0
+    for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+        seen += bucket_count
+        if seen >= rank:
+            return bound
+    return None  # Больше максимальной границы
+
+
+def _prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_prometheus():
+    """Метрики процесса в текстовом формате Prometheus"""
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    snapshot = sorted(_metrics_snapshot().items())
+    labels = {key: f'method="{key[0]}",route="{_prometheus_label(key[1])}"' for key, _ in snapshot}
+
+    family('theatre_http_requests_total', 'counter', 'Requests handled, by route')
+    lines += [f'theatre_http_requests_total{{{labels[key]}}} {m["count"]}' for key, m in snapshot]
+    family('theatre_http_errors_total', 'counter', 'Responses with status >= 500, by route')
+    lines += [f'theatre_http_errors_total{{{labels[key]}}} {m["errors"]}' for key, m in snapshot]
+    family('theatre_http_streamed_responses_total', 'counter', 'Streamed responses (bytes counted after sending), by route')
+    lines += [f'theatre_http_streamed_responses_total{{{labels[key]}}} {m["streamed"]}' for key, m in snapshot]
+
+    family('theatre_http_request_duration_seconds', 'histogram', 'Request latency, by route')
+    for key, m in snapshot:
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + ('+Inf',), m["buckets"]):
+            cumulative += bucket_count
+            lines.append(f'theatre_http_request_duration_seconds_bucket{{{labels[key]},le="{bound}"}} {cumulative}')
+        lines.append(f'theatre_http_request_duration_seconds_sum{{{labels[key]}}} {m["latency_sum"]:.6f}')
+        lines.append(f'theatre_http_request_duration_seconds_count{{{labels[key]}}} {m["count"]}')
+
+    family('theatre_http_response_bytes_total', 'counter', 'Response body bytes, by route')
+    lines += [f'theatre_http_response_bytes_total{{{labels[key]}}} {m["bytes_sum"]}' for key, m in snapshot]
+    family('theatre_sqlite_seconds_total', 'counter', 'Time spent in SQLite, by route')
+    lines += [f'theatre_sqlite_seconds_total{{{labels[key]}}} {m["sqlite_sum"]:.6f}' for key, m in snapshot]
+
+    with _response_cache_lock:
+        cache_stats = dict(response_cache_stats, size=len(_response_cache))
+    for name, value in sorted(cache_stats.items()):
+        kind = 'gauge' if name == 'size' else 'counter'
+        metric = f'theatre_response_cache_{name}' + ('' if kind == 'gauge' else '_total')
+        family(metric, kind, f'Response cache {name}')
+        lines.append(f'{metric} {value}')
+
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_summary():
+    """Сводка метрик по маршрутам в JSON (медленные маршруты - первыми)"""
+    routes = []
+    for (method, route), m in _metrics_snapshot().items():
+        count = m["count"]
+        routes.append({
+            "method": method,
+            "route": route,
+            "count": count,
+            "errors": m["errors"],
+            "streamed": m["streamed"],
+            "avg_ms": round(m["latency_sum"] / count * 1000, 3),
+            "p50_ms": _quantile_ms(m, 0.5),
+            "p95_ms": _quantile_ms(m, 0.95),
+            "p99_ms": _quantile_ms(m, 0.99),
+            "avg_bytes": round(m["bytes_sum"] / count),
+            "avg_sqlite_ms": round(m["sqlite_sum"] / count * 1000, 3),
+        })
+    routes.sort(key=lambda item: item["avg_ms"] * item["count"], reverse=True)
+    return jsonify({"pid": os.getpid(), "buckets": LATENCY_BUCKETS, "routes": routes})
+
+
+def _quantile_ms(metrics, quantile):
+    bound = _latency_quantile(metrics["buckets"], metrics["count"], quantile)
+    return bound * 1000 if bound is not None else None
+
+
+# ==================== МЕДЛЕННЫЕ ЗАПРОСЫ ====================
+
+# Порог медленного выражения, секунды (переопределяется переменной окружения)
+SLOW_QUERY_THRESHOLD = float(os.environ.get('THEATRE_SLOW_QUERY_MS', '50')) / 1000
+SLOW_QUERY_LOG_SIZE = 200           # Последних медленных выражений в памяти
+STATEMENT_SHAPES_MAX = 1000         # Предел различных форм выражений в статистике
+
+_slow_queries = collections.deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_statement_stats = {}
+_statement_stats_lock = threading.Lock()
+
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_shape(sql):
+    """Форма выражения: литералы и списки параметров свернуты, пробелы нормализованы"""
+    shape = re.sub(r"'(?:[^']|'')*'", "'?'", sql)
+    shape = re.sub(r'\b\d+(?:\.\d+)?\b', 'N', shape)
+    shape = re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', shape)
+    return ' '.join(shape.split())
+
+
+def redact_parameters(parameters):
+    """Параметры для журнала: числа как есть, строки и BLOB - только тип и длина"""
+    def redact(value):
+        if value is None or isinstance(value, (int, float)):
+            return value
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return f'<blob {len(value)} bytes>'
+        return f'<{type(value).__name__} {len(str(value))} chars>'
+
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            # executemany - первый набор параметров и число наборов
+            return {"first": redact_parameters(parameters[0]), "rows": len(parameters)}
+        return [redact(value) for value in parameters]
+    return '<iterator>'  # executemany с генератором - параметры уже прочитаны
+
+
+def record_statement_time(cursor, elapsed, new_statement):
+    """Учет времени выражения; при превышении порога - запись в журнал с планом"""
+    shape = cursor.statement_shape
+    cursor.statement_time += elapsed
+
+    with _statement_stats_lock:
+        stats = _statement_stats.get(shape)
+        if stats is None and len(_statement_stats) < STATEMENT_SHAPES_MAX:
+            stats = _statement_stats[shape] = {"calls": 0, "total": 0.0, "max": 0.0, "slow": 0}
+        if stats is not None:
+            stats["calls"] += new_statement
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], cursor.statement_time)
+
+    if cursor.statement_time < SLOW_QUERY_THRESHOLD:
+        return
+    if cursor.slow_entry is not None:
+        # Выражение уже в журнале - дописываем время выборки
+        cursor.slow_entry["ms"] = round(cursor.statement_time * 1000, 3)
+        return
+
+    cursor.slow_entry = {
+        "at": datetime.now().isoformat(timespec='seconds'),
+        "ms": round(cursor.statement_time * 1000, 3),
+        "sql": ' '.join(cursor.statement.split()),
+        "parameters": redact_parameters(cursor.parameters),
+        "plan": explain_query_plan(cursor.connection, cursor.statement, cursor.parameters),
+        "route": request.url_rule.rule if has_request_context() and request.url_rule else None,
+    }
+    _slow_queries.append(cursor.slow_entry)
+    with _statement_stats_lock:
+        if stats is not None:
+            stats["slow"] += 1
+    print(f"Slow query {cursor.slow_entry['ms']} ms: {cursor.slow_entry['sql']} "
+          f"plan={cursor.slow_entry['plan']}")
+
+
+def explain_query_plan(conn, sql, parameters):
+    """Строки EXPLAIN QUERY PLAN для выражения (None, если план не получить)"""
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    if not isinstance(parameters, (list, tuple, dict)):
+        return None
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (list, tuple, dict)):
+        parameters = parameters[0]  # executemany - плана первого набора достаточно
+    try:
+        # Обычный курсор sqlite3 - сам EXPLAIN в статистику не попадает
+        rows = sqlite3.Cursor(conn).execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f'EXPLAIN failed: {e}']
+    return [row[3] for row in rows]
+
+
+@app.route('/api/admin/slow-queries', methods=['GET'])
+def slow_queries():
+    """Самые затратные формы выражений и последние медленные выражения (только организатор)"""
+    user = session_user()
+    if not user:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+    if user['role'] != 'organizer':
+        return jsonify({"success": False, "error": "Organizer role required"}), 403
+
+    try:
+        limit = min(int(request.args.get('limit', 20)), STATEMENT_SHAPES_MAX)
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be an integer"}), 400
+    sort = request.args.get('sort', 'total')
+    if sort not in ('total', 'max', 'avg', 'calls'):
+        return jsonify({"success": False, "error": "sort must be one of total, max, avg, calls"}), 400
+
+    with _statement_stats_lock:
+        shapes = [
+            {
+                "statement": shape,
+                "calls": stats["calls"],
+                "slow": stats["slow"],
+                "total_ms": round(stats["total"] * 1000, 3),
+                "max_ms": round(stats["max"] * 1000, 3),
+                "avg_ms": round(stats["total"] / stats["calls"] * 1000, 3) if stats["calls"] else 0.0,
+            }
+            for shape, stats in _statement_stats.items()
+        ]
+    sort_key = {'total': 'total_ms', 'max': 'max_ms', 'avg': 'avg_ms', 'calls': 'calls'}[sort]
+    shapes.sort(key=lambda item: item[sort_key], reverse=True)
+
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "threshold_ms": SLOW_QUERY_THRESHOLD * 1000,
+        "statements": shapes[:limit],
+        "recent_slow": list(_slow_queries)[-limit:][::-1],
+    })
+
+
+# ==================== ХРАНИЛИЩЕ ИЗОБРАЖЕНИЙ ====================
+
+# Сигнатуры поддерживаемых форматов изображений
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+]
+
+
+def detect_image_mime(data):
+    """Определение MIME-типа изображения по сигнатуре (None - не изображение)"""
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mime in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    return None
+
+
+def decode_image_payload(value):
+    """Приведение изображения из БД или JSON к байтам.
+
+    Исторически в БД лежат и сырые байты, и base64-строки (в том числе
+    сохраненные как BLOB), поэтому сначала проверяем сигнатуру.
+    """
+    if not value:
+        return None
+
+    is_text = isinstance(value, str)
+    if is_text:
+        value = value.encode('ascii', errors='ignore')
+    elif not isinstance(value, bytes):
+        return None
+
+    if detect_image_mime(value):
+        return value
+
+    try:
+        decoded = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return None if is_text else value
+
+    # Строка - всегда base64; BLOB считаем base64 только если внутри изображение
+    return decoded if is_text or detect_image_mime(decoded) else value
+
+
+def _blob_path(blob_hash):
+    """Путь к файлу в хранилище: blobs/ab/abcdef..."""
+    return os.path.join(BLOB_STORE_PATH, blob_hash[:2], blob_hash)
+
+
+def _write_file_atomically(path, data):
+    """Запись во временный файл рядом с целевым и атомарное переименование"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_blob(data):
+    """Сохранение байтов в хранилище, возвращает (hash, size)"""
+    blob_hash = hashlib.sha256(data).hexdigest()
+    path = _blob_path(blob_hash)
+
+    if not os.path.exists(path):
+        _write_file_atomically(path, data)
+
+    return blob_hash, len(data)
+
+
+def is_blob_hash(value):
+    """Похоже ли значение на адрес в хранилище (SHA-256 в hex)"""
+    return isinstance(value, str) and len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+def image_url(blob_hash):
+    """Ссылка на изображение для JSON-ответов (None если изображения нет)"""
+    return f'/api/images/{blob_hash}' if blob_hash else None
+
+
+# ==================== ЗАГРУЗКА ИЗОБРАЖЕНИЙ ====================
+
+# Обложки и аватары принимаются потоком (multipart/form-data или сырое тело),
+# а не base64 в JSON: в памяти держится только текущий кусок, остальное - во
+# временном файле хранилища, хеш считается по ходу приема
+IMAGE_UPLOAD_MAX_BYTES = 10 * 1024 * 1024   # Предел размера одного изображения
+UPLOAD_CHUNK_BYTES = 64 * 1024              # Размер куска при чтении сырого тела
+UPLOAD_FORM_MEMORY = 64 * 1024              # Предел текстовых полей формы
+UPLOAD_FORM_OVERHEAD = 64 * 1024            # Запас на поля и границы multipart
+UPLOAD_SNIFF_BYTES = 12                     # Сколько байт нужно для проверки сигнатуры
+
+
+class UploadRejected(Exception):
+    """Загрузка отклонена до окончания приема (размер, тип, формат тела)"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class UploadSpool:
+    """Принимаемый файл: пишется кусками во временный файл рядом с хранилищем.
+
+    Размер и сигнатура (sniff=False - без нее, для произвольных файлов)
+    проверяются по мере записи, поэтому слишком большое или не графическое
+    тело отклоняется, не дочитываясь до конца.
+    """
+
+    def __init__(self, max_bytes=IMAGE_UPLOAD_MAX_BYTES, sniff=True):
+        os.makedirs(BLOB_STORE_PATH, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=BLOB_STORE_PATH, suffix='.upload')
+        self.file = os.fdopen(fd, 'w+b')
+        self.digest = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.head = b''
+        self.mime = None
+        self.sniff = sniff
+        # Незавершенные загрузки удаляются по окончании запроса
+        g.setdefault('uploads', []).append(self)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadRejected(413, f"Upload is too large (max {self.max_bytes} bytes)")
+        if self.sniff and self.mime is None and len(self.head) < UPLOAD_SNIFF_BYTES:
+            self.head += data[:UPLOAD_SNIFF_BYTES - len(self.head)]
+            if len(self.head) == UPLOAD_SNIFF_BYTES:
+                self._sniff()
+        self.digest.update(data)
+        self.file.write(data)
+
+    def _sniff(self):
+        self.mime = detect_image_mime(self.head)
+        if not self.mime:
+            raise UploadRejected(415, "Unsupported image format")
+
+    def finish(self):
+        """Прием окончен: проверка сигнатуры для файлов короче UPLOAD_SNIFF_BYTES"""
+        if self.sniff and self.size and self.mime is None:
+            self._sniff()
+        self.file.flush()
+
+    # Интерфейс файла, которого ждет парсер multipart
+    def seek(self, offset, whence=0):
+        return self.file.seek(offset, whence)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def close(self):
+        self.discard()
+
+    def move_to(self, path):
+        """Перенос принятого файла на место path (без копирования)"""
+        self.file.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.path, path)
+        self.path = None
+
+    def discard(self):
+        """Удаление временного файла (после store_blob_upload - ничего не делает)"""
+        if not self.file.closed:
+            self.file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+def _check_upload_type(content_type):
+    """Заявленный тип тела или части формы: изображение или произвольные байты"""
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    if mimetype and mimetype != 'application/octet-stream' and not mimetype.startswith('image/'):
+        raise UploadRejected(415, f"Unsupported upload type: {mimetype}")
+
+
+def receive_image_upload(field):
+    """Прием изображения из multipart-формы (часть field) или из сырого тела.
+
+    Возвращает (поля формы или параметры запроса, UploadSpool или None).
+    Лимиты проверяются до чтения тела (Content-Length) и по ходу приема.
+    """
+    if request.content_length and request.content_length > IMAGE_UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD:
+        raise UploadRejected(413, f"Image is too large (max {IMAGE_UPLOAD_MAX_BYTES} bytes)")
+
+    if request.mimetype == 'multipart/form-data':
+        def spool_factory(total_content_length, content_type, filename, content_length=None):
+            _check_upload_type(content_type)
+            return UploadSpool()
+
+        parser = FormDataParser(spool_factory, max_form_memory_size=UPLOAD_FORM_MEMORY, silent=False)
+        try:
+            _, form, files = parser.parse(
+                request.stream, request.mimetype, request.content_length, request.mimetype_params
+            )
+        except RequestEntityTooLarge:
+            raise UploadRejected(413, "Form fields are too large")
+        except ValueError as e:
+            raise UploadRejected(400, f"Malformed multipart body: {e}")
+
+        upload = files[field].stream if field in files else None
+    elif request.mimetype == 'application/x-www-form-urlencoded':
+        # Форма без файла (requests шлет так data= без files=) - только поля
+        return request.form, None
+    else:
+        _check_upload_type(request.content_type)
+        form = request.args
+        upload = UploadSpool()
+        for chunk in iter(lambda: request.stream.read(UPLOAD_CHUNK_BYTES), b''):
+            upload.write(chunk)
+
+    if upload is None or not upload.size:
+        return form, None
+    upload.finish()
+    return form, upload
+
+
+def store_blob_upload(upload):
+    """Перенос принятой загрузки в хранилище без чтения в память, возвращает (hash, size)"""
+    blob_hash = upload.digest.hexdigest()
+    path = _blob_path(blob_hash)
+    if os.path.exists(path):
+        upload.discard()
+    else:
+        upload.move_to(path)
+
+    return blob_hash, upload.size
+
+
+@app.teardown_appcontext
+def discard_uploads(exception=None):
+    """Удаление временных файлов загрузок, не попавших в хранилище"""
+    for upload in g.pop('uploads', []):
+        upload.discard()
+
+
+# ==================== ДАТЫ ====================
+
+def _parse_date(text, formats):
+    """Первая удачная попытка разбора даты по списку форматов"""
+    for fmt in formats:
+        try:
+            return datetime.strptime(text.strip(), fmt).date()
+        except (ValueError, AttributeError):
+            continue
+    return None
+
+
+def normalize_lesson_start(date_text, time_text):
+    """Начало занятия в ISO 8601: 'dd-MM-yyyy' + 'HH:MM' -> 'YYYY-MM-DDTHH:MM'.
+
+    Время вводится вручную; если оно не распознано - только дата.
+    Пустая строка - дата не распознана.
+    """
+    lesson_date = _parse_date(date_text, ('%d-%m-%Y', '%Y-%m-%d'))
+    if not lesson_date:
+        return ''
+
+    result = lesson_date.isoformat()
+    match = re.match(r'^\s*(\d{1,2})[:.](\d{2})', time_text or '')
+    if match:
+        hours, minutes = int(match.group(1)), int(match.group(2))
+        if hours < 24 and minutes < 60:
+            result += f'T{hours:02d}:{minutes:02d}'
+    return result
+
+
+def normalize_performance_date(text):
+    """Дата спектакля в ISO 8601 ('' если не распознана).
+
+    Старый клиент сохранял 'yyyy-dd-MM'. Если второе число не может быть
+    месяцем, значит дата уже записана как 'yyyy-MM-dd'.
+    """
+    match = re.match(r'^\s*(\d{4})-(\d{1,2})-(\d{1,2})\s*$', text or '')
+    if not match:
+        return ''
+
+    year, first, second = (int(part) for part in match.groups())
+    day, month = (second, first) if second > 12 else (first, second)
+    try:
+        return date_cls(year, month, day).isoformat()
+    except ValueError:
+        return ''
+
+
+def parse_iso_date_arg(name):
+    """Параметр запроса с датой ISO (None если не передан, ValueError если неверный)"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date_cls.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date (YYYY-MM-DD)")
+
+
+def request_today():
+    """Сегодняшняя дата, если ответ от нее зависит (upcoming=1), иначе None.
+
+    Входит в ETag и ключ кэша ответов: после полуночи тот же запрос дает
+    другой результат без всякой записи в таблицы.
+    """
+    return date_cls.today().isoformat() if request.args.get('upcoming') == '1' else None
+
+
+def date_range_filter(column):
+    """Условие по from/to (включительно) и upcoming=1 (с сегодняшнего дня) для ISO-колонки"""
+    conditions, params = [], []
+
+    date_from = parse_iso_date_arg('from')
+    date_to = parse_iso_date_arg('to')
+    today = request_today()
+    if today:
+        date_from = max(date_from or today, today)
+
+    if date_from:
+        conditions.append(f'{column} >= ?')
+        params.append(date_from)
+    if date_to:
+        # '' (дата не распознана) в диапазон не входит. Для datetime 'YYYY-MM-DDTHH:MM' > 'YYYY-MM-DD',
+        # поэтому верхняя граница - следующий за датой символ
+        conditions.append(f"{column} > '' AND {column} < ?")
+        params.append(date_to + '~')
+
+    return ' AND '.join(conditions), tuple(params)
+
+
+# ==================== МИНИАТЮРЫ ====================
+
+# Размеры уменьшенных копий, которые строятся сразу после загрузки
+IMAGE_RENDITIONS = {
+    'avatar': ['60x60', '120x120'],
+    'cover': ['272x100', '544x200'],
+}
+RENDITION_SIZES = {size for sizes in IMAGE_RENDITIONS.values() for size in sizes}
+
+if Image is not None and features.check('webp'):
+    RENDITION_FORMAT, RENDITION_EXT = 'WEBP', 'webp'
+else:
+    RENDITION_FORMAT, RENDITION_EXT = 'PNG', 'png'
+
+_rendition_queue = queue.Queue()
+_rendition_worker = None
+_rendition_lock = threading.Lock()
+
+
+def _rendition_path(blob_hash, size):
+    """Путь к уменьшенной копии: blobs/ab/<hash>.<WxH>.<ext>"""
+    return f'{_blob_path(blob_hash)}.{size}.{RENDITION_EXT}'
+
+
+def build_rendition(blob_hash, size):
+    """Построение уменьшенной копии изображения (True - если копия готова)"""
+    path = _rendition_path(blob_hash, size)
+    if os.path.exists(path):
+        return True
+    if Image is None:
+        return False
+
+    width, height = (int(side) for side in size.split('x'))
+    try:
+        with Image.open(_blob_path(blob_hash)) as image:
+            image = ImageOps.exif_transpose(image).convert('RGBA')
+            image = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            if RENDITION_FORMAT == 'WEBP':
+                image.save(buffer, format='WEBP', quality=85, method=4)
+            else:
+                image.save(buffer, format='PNG', optimize=True)
+    except (OSError, Image.DecompressionBombError) as e:
+        print(f"Rendition error for {blob_hash} ({size}): {e}")
+        return False
+
+    _write_file_atomically(path, buffer.getvalue())
+    return True
+
+
+def _rendition_worker_loop(tasks):
+    """Фоновый поток: строит миниатюры из очереди"""
+    while True:
+        blob_hash, size = tasks.get()
+        try:
+            build_rendition(blob_hash, size)
+        except Exception as e:
+            print(f"Rendition worker error: {e}")
+        finally:
+            tasks.task_done()
+
+
+def _enqueue_rendition(blob_hash, size):
+    """Постановка миниатюры в очередь фонового потока"""
+    global _rendition_queue, _rendition_worker
+
+    with _rendition_lock:
+        # Поток не переживает fork - запускаем заново в каждом воркере
+        if _rendition_worker is None or not _rendition_worker.is_alive():
+            _rendition_queue = queue.Queue()
+            _rendition_worker = threading.Thread(
+                target=_rendition_worker_loop, args=(_rendition_queue,),
+                name='rendition-worker', daemon=True
+            )
+            _rendition_worker.start()
+        _rendition_queue.put((blob_hash, size))
+
+
+def schedule_renditions(blob_hash, kind):
+    """Фоновое построение всех миниатюр для нового изображения"""
+    if not blob_hash or Image is None:
+        return
+    for size in IMAGE_RENDITIONS[kind]:
+        _enqueue_rendition(blob_hash, size)
+
+
 def init_database():
     """Инициализация базы данных"""
     conn = get_db_connection()
@@ -106,11 +1019,1173 @@ def init_database():
     ''')
 
     conn.commit()
-    conn.close()
+
+    run_migrations(conn)
+    prune_change_log(conn)
+    prune_sessions(conn)
+    prune_upload_sessions(conn)
+    check_incremental_vacuum(conn)
+
+
+# ==================== МИГРАЦИИ ====================
+
+def _migrate_secondary_indexes(conn):
+    """Вторичные индексы под WHERE/ORDER BY маршрутов и уникальность заявок"""
+    # Дубликаты заявок мешают построить уникальный индекс - оставляем самую раннюю
+    conn.execute('''
+        DELETE FROM role_applications
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM role_applications GROUP BY role_id, username
+        )
+    ''')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_roles_performance ON roles (performance_id, role_name)')
+    conn.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_role_applications_role_user '
+        'ON role_applications (role_id, username)'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_role_applications_user '
+        'ON role_applications (username, applied_at)'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_role_applications_applied '
+        'ON role_applications (applied_at, role_id)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_lessons_date ON lessons (date, time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_files_uploaded ON files (uploaded_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_additional_files_path ON additional_files (file_path)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_additional_files_created ON additional_files (created_date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_part_role ON user (isPart, role)')
+
+
+MIGRATION_BATCH_SIZE = 100
+
+
+def _move_images_to_blob_store(conn, table, image_column, prefix):
+    """Перенос изображений из колонки таблицы в хранилище пачками"""
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            f'SELECT id, {image_column} FROM {table} '
+            f'WHERE id > ? AND {image_column} IS NOT NULL ORDER BY id LIMIT ?',
+            (last_id, MIGRATION_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for row in rows:
+            value = row[image_column]
+            if not value:
+                updates.append((None, None, None, row['id']))
+                continue
+
+            data = decode_image_payload(value)
+            if not data:
+                # Не изображение и не base64 - сохраняем исходное значение как есть, чтобы не потерять
+                data = value if isinstance(value, bytes) else str(value).encode('utf-8')
+                print(f"{table}.{image_column} id={row['id']}: not an image, stored as application/octet-stream")
+            blob_hash, size = store_blob(data)
+            updates.append((blob_hash, size, detect_image_mime(data) or 'application/octet-stream', row['id']))
+
+        conn.executemany(
+            f'UPDATE {table} SET {prefix}_hash = ?, {prefix}_size = ?, {prefix}_mime = ?, '
+            f'{image_column} = NULL WHERE id = ?',
+            updates
+        )
+        last_id = rows[-1]['id']
+
+
+def _migrate_images_to_blob_store(conn):
+    """Обложки и аватары - в файловое хранилище, в таблицах только hash/size/mime"""
+    for table, prefix in (('performances', 'cover'), ('user', 'avatar')):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {prefix}_hash TEXT')
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {prefix}_size INTEGER')
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {prefix}_mime TEXT')
+
+    _move_images_to_blob_store(conn, 'performances', 'cover_image', 'cover')
+    _move_images_to_blob_store(conn, 'user', 'avatar', 'avatar')
+
+
+# Таблицы, изменения которых отслеживаются счетчиками версий
+VERSIONED_TABLES = [
+    'performances', 'roles', 'role_applications', 'lessons',
+    'files', 'additional_files', 'user',
+]
+
+
+def _migrate_table_versions(conn):
+    """Счетчики версий таблиц, увеличиваемые триггерами на любую запись"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+
+    for table in VERSIONED_TABLES:
+        conn.execute('INSERT OR IGNORE INTO table_versions (table_name, version) VALUES (?, 0)', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+                END
+            ''')
+
+
+def _migrate_iso_dates(conn):
+    """Индексируемые ISO-даты: lessons.starts_at и performances.performance_on"""
+    conn.execute("ALTER TABLE lessons ADD COLUMN starts_at TEXT NOT NULL DEFAULT ''")
+    conn.execute("ALTER TABLE performances ADD COLUMN performance_on TEXT NOT NULL DEFAULT ''")
+
+    lessons = conn.execute('SELECT id, date, time FROM lessons').fetchall()
+    conn.executemany(
+        'UPDATE lessons SET starts_at = ? WHERE id = ?',
+        [(normalize_lesson_start(row['date'], row['time']), row['id']) for row in lessons]
+    )
+    performances = conn.execute('SELECT id, performance_date FROM performances').fetchall()
+    conn.executemany(
+        'UPDATE performances SET performance_on = ? WHERE id = ?',
+        [(normalize_performance_date(row['performance_date']), row['id']) for row in performances]
+    )
+
+    # Сортировка по текстовой дате больше не используется
+    conn.execute('DROP INDEX IF EXISTS idx_lessons_date')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_lessons_starts_at ON lessons (starts_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_performances_on ON performances (performance_on)')
+
+
+# Таблицы, строки которых попадают в журнал изменений
+CHANGE_FEED_TABLES = [
+    'performances', 'roles', 'role_applications', 'lessons', 'files', 'additional_files',
+]
+
+
+def _migrate_change_log(conn):
+    """Журнал изменений строк для дельта-синхронизации, заполняемый триггерами"""
+    # AUTOINCREMENT - номера не переиспользуются после очистки старых записей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    for table in CHANGE_FEED_TABLES:
+        for event, row, op in (('INSERT', 'NEW', 'upsert'), ('UPDATE', 'NEW', 'upsert'), ('DELETE', 'OLD', 'delete')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_changes_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id, op) VALUES ('{table}', {row}.id, '{op}');
+                END
+            ''')
+
+
+CHANGE_LOG_RETENTION = 50000        # Сколько последних записей журнала хранить
+
+
+def prune_change_log(conn):
+    """Удаление старых записей журнала (отставшие клиенты получат полный снимок)"""
+    conn.execute(
+        'DELETE FROM change_log WHERE seq <= (SELECT MAX(seq) FROM change_log) - ?',
+        (CHANGE_LOG_RETENTION,)
+    )
+    conn.commit()
+
+
+def _migrate_sessions(conn):
+    """Сессии входа по токену вместо общего флага user.isCurrent"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            token_hash TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            last_seen INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_username ON sessions (username)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)')
+
+
+def prune_sessions(conn):
+    """Удаление истекших сессий"""
+    conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (int(time.time()),))
+    conn.commit()
+
+
+def _migrate_material_storage(conn):
+    """Содержимое файлов материалов на сервере и сессии загрузки по кускам"""
+    for table in ('files', 'additional_files'):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN content_hash TEXT')
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN content_size INTEGER')
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN content_mime TEXT')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            file_name TEXT,
+            content_hash TEXT,
+            size INTEGER NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_upload_sessions_content '
+        'ON upload_sessions (username, content_hash)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires ON upload_sessions (expires_at)')
+
+
+def prune_upload_sessions(conn):
+    """Удаление просроченных загрузок вместе с принятыми кусками"""
+    now = int(time.time())
+    expired = conn.execute('SELECT id FROM upload_sessions WHERE expires_at <= ?', (now,)).fetchall()
+    conn.execute('DELETE FROM upload_sessions WHERE expires_at <= ?', (now,))
+    conn.commit()
+    for row in expired:
+        shutil.rmtree(os.path.join(UPLOAD_STAGING_PATH, row['id']), ignore_errors=True)
+
+
+# Внешние ключи, которые получают ON DELETE CASCADE: таблица -> (колонка, родительская таблица).
+# Порядок важен: сначала родитель, потом потомок
+CASCADE_FOREIGN_KEYS = {
+    'roles': ('performance_id', 'performances'),
+    'role_applications': ('role_id', 'roles'),
+}
+
+
+def sweep_orphans(conn):
+    """Удаление ролей без спектакля и заявок без роли; возвращает {таблица: удалено}"""
+    removed = {}
+    for table, (column, parent) in CASCADE_FOREIGN_KEYS.items():
+        removed[table] = conn.execute(
+            f'DELETE FROM {table} WHERE {column} IS NOT NULL '
+            f'AND NOT EXISTS (SELECT 1 FROM {parent} WHERE {parent}.id = {table}.{column})'
+        ).rowcount
+    return removed
+
+
+def _rebuild_with_cascade(conn, table, column, parent):
+    """Перестройка таблицы с ON DELETE CASCADE: ALTER TABLE не меняет внешние ключи.
+
+    Схема берется из sqlite_master, поэтому колонки, добавленные прошлыми
+    миграциями, сохраняются; индексы и триггеры таблицы создаются заново,
+    счетчик AUTOINCREMENT переносится.
+    """
+    create_sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()[0]
+    dependents = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+        (table,)
+    )]
+    sequence = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+
+    foreign_key = f'FOREIGN KEY ({column}) REFERENCES {parent} (id) ON DELETE CASCADE'
+    create_sql, found = re.subn(
+        rf'FOREIGN KEY\s*\(\s*{column}\s*\)\s*REFERENCES\s+{parent}\s*\(\s*id\s*\)', foreign_key, create_sql
+    )
+    if not found:
+        create_sql = f'{create_sql.rstrip()[:-1].rstrip()},\n            {foreign_key}\n        )'
+    rebuilt = f'{table}_rebuilt'
+    create_sql = re.sub(rf'^CREATE TABLE\s+(IF NOT EXISTS\s+)?"?{table}"?', f'CREATE TABLE {rebuilt}', create_sql)
+
+    conn.execute(create_sql)
+    conn.execute(f'INSERT INTO {rebuilt} SELECT * FROM {table}')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {rebuilt} RENAME TO {table}')
+    for sql in dependents:
+        conn.execute(sql)
+    if sequence:
+        conn.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (sequence[0], table))
+
+
+def _migrate_cascade_deletes(conn):
+    """Каскадное удаление ролей и заявок вместе со спектаклем: разовая чистка сирот и перестройка таблиц"""
+    removed = sweep_orphans(conn)
+    if any(removed.values()):
+        print(f"Orphan sweep: {removed}")
+
+    for table, (column, parent) in CASCADE_FOREIGN_KEYS.items():
+        _rebuild_with_cascade(conn, table, column, parent)
+
+    violations = conn.execute('PRAGMA foreign_key_check').fetchall()
+    if violations:
+        raise sqlite3.IntegrityError(f'Foreign key violations after rebuild: {len(violations)}')
+
+
+def _migrate_maintenance_state(conn):
+    """Время последнего обслуживания БД - общее для всех процессов сервера"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_state (
+            task TEXT PRIMARY KEY,
+            last_run INTEGER NOT NULL,
+            duration REAL,
+            result TEXT
+        ) WITHOUT ROWID
+    ''')
+
+
+# Источники полнотекстового поиска: таблица -> (код в rowid индекса, индексируемые
+# столбцы, текст заголовка, текст описания). {row} - строка триггера (NEW/OLD)
+# или имя таблицы при перестройке
+SEARCH_SOURCES = {
+    'performances': (1, ('title', 'description'), '{row}.title', '{row}.description'),
+    'roles': (2, ('role_name', 'description'), '{row}.role_name', '{row}.description'),
+    'lessons': (
+        3, ('title', 'location', 'description'), '{row}.title',
+        "COALESCE({row}.location, '') || ' ' || COALESCE({row}.description, '')",
+    ),
+    'files': (4, ('file_name',), '{row}.file_name', "''"),
+    'additional_files': (5, ('file_name',), '{row}.file_name', "''"),
+}
+# rowid записи индекса = id строки * SEARCH_ROWID_STRIDE + код таблицы: триггер
+# находит свою запись по rowid, а таблица результата - остаток от деления
+SEARCH_ROWID_STRIDE = 8
+
+
+def _search_text(expr):
+    """SQL-выражение текста для индекса: unicode61 не снимает диакритику с кириллицы,
+    поэтому ё приводится к е здесь и в запросе"""
+    return f"REPLACE(REPLACE({expr}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def rebuild_search_index(conn):
+    """Заполнение индекса поиска заново по всем таблицам-источникам"""
+    conn.execute('DELETE FROM search_index')
+    for table, (code, _, title, body) in SEARCH_SOURCES.items():
+        conn.execute(
+            f'''INSERT INTO search_index (rowid, title, body)
+                SELECT id * {SEARCH_ROWID_STRIDE} + {code},
+                       {_search_text(title.format(row=table))}, {_search_text(body.format(row=table))}
+                FROM {table}'''
+        )
+
+
+def _migrate_search_index(conn):
+    """Полнотекстовый индекс FTS5 по спектаклям, ролям, занятиям и материалам"""
+    # prefix - быстрый поиск по началу слова
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5 (
+            title, body,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+
+    for table, (code, columns, title, body) in SEARCH_SOURCES.items():
+        new_rowid = f'NEW.id * {SEARCH_ROWID_STRIDE} + {code}'
+        old_rowid = f'OLD.id * {SEARCH_ROWID_STRIDE} + {code}'
+        insert = (f'INSERT INTO search_index (rowid, title, body) '
+                  f'VALUES ({new_rowid}, {_search_text(title.format(row="NEW"))}, '
+                  f'{_search_text(body.format(row="NEW"))});')
+        delete = f'DELETE FROM search_index WHERE rowid = {old_rowid};'
+        # Обновление статуса роли и прочих полей вне индекса запись индекса не трогает
+        events = (
+            ('insert', 'INSERT', insert),
+            ('update', f"UPDATE OF {', '.join(columns)}", delete + insert),
+            ('delete', 'DELETE', delete),
+        )
+        for name, event, statements in events:
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_search_{name}
+                AFTER {event} ON {table}
+                BEGIN
+                    {statements}
+                END
+            ''')
+
+    rebuild_search_index(conn)
+
+
+# Упорядоченный список миграций: номер версии = позиция в списке (с 1).
+# Уже примененные миграции не меняем - только добавляем новые в конец.
+MIGRATIONS = [
+    _migrate_secondary_indexes,
+    _migrate_images_to_blob_store,
+    _migrate_table_versions,
+    _migrate_iso_dates,
+    _migrate_change_log,
+    _migrate_sessions,
+    _migrate_material_storage,
+    _migrate_cascade_deletes,
+    _migrate_maintenance_state,
+    _migrate_search_index,
+]
+
+
+def run_migrations(conn):
+    """Применение недостающих миграций схемы"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Перестройка таблиц возможна только с выключенными внешними ключами;
+    # PRAGMA действует лишь вне транзакции, поэтому переключаем вокруг цикла
+    conn.commit()
+    conn.execute('PRAGMA foreign_keys = OFF')
+    try:
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            # IMMEDIATE - чтобы параллельно стартующие воркеры не применили миграцию дважды
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                current = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+                if version <= current:
+                    conn.rollback()
+                    continue
+
+                migration(conn)
+                conn.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+                conn.commit()
+            except (sqlite3.Error, OSError):
+                conn.rollback()
+                raise
+    finally:
+        conn.execute('PRAGMA foreign_keys = ON')
+
+
+# ==================== ОБСЛУЖИВАНИЕ БД ====================
+
+# Фоновый поток раз в MAINTENANCE_INTERVAL обновляет статистику планировщика,
+# возвращает свободные страницы и переносит WAL в основной файл - вне
+# обработки запросов. Запуск захватывается через maintenance_state, поэтому
+# из нескольких процессов сервера за интервал работает только один
+MAINTENANCE_INTERVAL = 6 * 60 * 60      # Секунды между запусками
+MAINTENANCE_CHECK_INTERVAL = 10 * 60    # Как часто поток проверяет, не пора ли (переживает перезапуски)
+MAINTENANCE_ANALYSIS_LIMIT = 1000       # Строк на индекс для ANALYZE (ограничивает время)
+MAINTENANCE_VACUUM_PAGES = 10000        # Сколько свободных страниц возвращать за запуск
+
+_maintenance_worker = None
+_maintenance_wakeup = threading.Event()
+_maintenance_lock = threading.Lock()
+
+
+def check_incremental_vacuum(conn):
+    """Предупреждение, если БД создана без auto_vacuum=INCREMENTAL.
+
+    Перевод существующего файла - полный VACUUM под блокировкой записи, поэтому
+    сервер его не делает: это разовая команда python backup.py vacuum.
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        app.logger.warning(
+            "Database is not in auto_vacuum=INCREMENTAL mode, free pages are not returned; "
+            "run 'python backup.py vacuum' once while the server is idle"
+        )
+
+
+def run_maintenance(conn):
+    """Обслуживание БД: чистка устаревших записей, слияние индекса поиска, ANALYZE, optimize,
+    incremental vacuum, checkpoint.
+
+    Возвращает сводку по шагам (для maintenance_state и /api/admin/maintenance).
+    """
+    result = {}
+
+    prune_change_log(conn)
+    prune_sessions(conn)
+    prune_upload_sessions(conn)
+
+    # Сегменты индекса поиска, накопленные вставками, сливаются в одно дерево
+    started = time.perf_counter()
+    conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+    conn.commit()
+    result['search_optimize_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    started = time.perf_counter()
+    conn.execute(f'PRAGMA analysis_limit = {MAINTENANCE_ANALYSIS_LIMIT}')
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.execute('PRAGMA optimize')
+    result['analyze_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    # incremental_vacuum освобождает по странице за шаг выражения - execute сделал бы только
+    # один шаг, executescript выполняет до конца
+    result['free_pages'] = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        conn.executescript(f'PRAGMA incremental_vacuum({MAINTENANCE_VACUUM_PAGES});')
+    result['free_pages_left'] = conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    # PASSIVE не ждет читателей и не блокирует писателей
+    busy, wal_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+    result['checkpoint'] = {"busy": busy, "wal_pages": wal_pages, "checkpointed": checkpointed}
+    return result
+
+
+def _claim_maintenance(conn, force=False):
+    """Захват запуска: True, если с прошлого (любого процесса) прошел интервал"""
+    now = int(time.time())
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute("SELECT last_run FROM maintenance_state WHERE task = 'db'").fetchone()
+        if row and not force and row['last_run'] > now - MAINTENANCE_INTERVAL:
+            conn.rollback()
+            return False
+        conn.execute(
+            "INSERT OR REPLACE INTO maintenance_state (task, last_run, duration, result) "
+            "VALUES ('db', ?, NULL, NULL)", (now,)
+        )
+        conn.commit()
+        return True
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+def _maintenance_worker_loop(wakeup):
+    """Фоновый поток: обслуживание БД по расписанию или по запросу"""
+    while True:
+        force = wakeup.wait(MAINTENANCE_CHECK_INTERVAL)
+        wakeup.clear()
+        conn = _open_db_connection()
+        try:
+            if _claim_maintenance(conn, force):
+                started = time.perf_counter()
+                result = run_maintenance(conn)
+                conn.execute(
+                    "UPDATE maintenance_state SET duration = ?, result = ? WHERE task = 'db'",
+                    (round(time.perf_counter() - started, 3), json.dumps(result))
+                )
+                conn.commit()
+        except Exception as e:
+            print(f"Maintenance error: {e}")
+        finally:
+            conn.close()
+
+
+def ensure_maintenance_worker():
+    """Запуск фонового потока обслуживания (поток не переживает fork - в каждом воркере свой)"""
+    global _maintenance_worker, _maintenance_wakeup
+
+    if _maintenance_worker is not None and _maintenance_worker.is_alive():
+        return
+    with _maintenance_lock:
+        if _maintenance_worker is None or not _maintenance_worker.is_alive():
+            _maintenance_wakeup = threading.Event()
+            _maintenance_worker = threading.Thread(
+                target=_maintenance_worker_loop, args=(_maintenance_wakeup,),
+                name='maintenance-worker', daemon=True
+            )
+            _maintenance_worker.start()
+
+
+@app.before_request
+def start_maintenance_worker():
+    ensure_maintenance_worker()
+
+
+@app.route('/api/admin/maintenance', methods=['GET', 'POST'])
+def maintenance_status():
+    """Состояние обслуживания БД; POST - запустить внеочередное (только организатор)"""
+    user = session_user()
+    if not user:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+    if user['role'] != 'organizer':
+        return jsonify({"success": False, "error": "Organizer role required"}), 403
+
+    if request.method == 'POST':
+        _maintenance_wakeup.set()
+        return jsonify({"success": True, "message": "Maintenance scheduled"}), 202
+
+    conn = get_db_connection()
+
+    try:
+        row = conn.execute("SELECT last_run, duration, result FROM maintenance_state WHERE task = 'db'").fetchone()
+        return jsonify({
+            "success": True,
+            "interval": MAINTENANCE_INTERVAL,
+            "last_run": row['last_run'] if row else None,
+            "duration": row['duration'] if row else None,
+            "result": json.loads(row['result']) if row and row['result'] else None,
+            "auto_vacuum": conn.execute('PRAGMA auto_vacuum').fetchone()[0],
+        })
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 500
+
+
+# ==================== КЭШ ОТВЕТОВ ====================
+
+RESPONSE_CACHE_SIZE = 256           # Ответов в кэше процесса (LRU)
+RESPONSE_CACHE_TTL = 5.0            # Секунды; ограничивает устаревание при записи из других процессов
+
+CachedResponse = collections.namedtuple('CachedResponse', 'expires_at tables etag body mimetype')
+
+_response_cache = collections.OrderedDict()
+_response_cache_lock = threading.Lock()
+# Поколение таблицы растет при каждом сбросе: ответ, построенный до записи, не попадет в кэш
+_table_generations = collections.Counter()
+response_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+
+def response_cache_key(per_session=False):
+    """Ключ кэша: маршрут, аргументы запроса, формат ответа, дата для upcoming=1 и, если нужно, владелец сессии"""
+    key = request.path, tuple(sorted(request.args.items(multi=True))), response_format(), request_today()
+    if per_session:
+        user = session_user()
+        key += (user['username'] if user else None,)
+    return key
+
+
+def response_cache_get(key):
+    """Закэшированный ответ или None"""
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry is not None and entry.expires_at < time.monotonic():
+            del _response_cache[key]
+            response_cache_stats['expirations'] += 1
+            entry = None
+
+        if entry is None:
+            response_cache_stats['misses'] += 1
+            return None
+
+        _response_cache.move_to_end(key)
+        response_cache_stats['hits'] += 1
+        return entry
+
+
+def table_generations(tables):
+    """Текущие поколения таблиц (снимается до построения ответа)"""
+    with _response_cache_lock:
+        return tuple(_table_generations[table] for table in tables)
+
+
+def response_cache_put(key, tables, generations, etag, response):
+    """Сохранение ответа, если его таблицы не сбрасывались, пока он строился"""
+    with _response_cache_lock:
+        if tuple(_table_generations[table] for table in tables) != generations:
+            return
+
+        _response_cache[key] = CachedResponse(
+            time.monotonic() + RESPONSE_CACHE_TTL, tables, etag, response.get_data(), response.mimetype
+        )
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+            response_cache_stats['evictions'] += 1
+
+
+def invalidate_cache(*tables):
+    """Сброс закэшированных ответов, зависящих от таблиц"""
+    tables = set(tables)
+    with _response_cache_lock:
+        for table in tables:
+            _table_generations[table] += 1
+        stale = [key for key, entry in _response_cache.items() if tables.intersection(entry.tables)]
+        for key in stale:
+            del _response_cache[key]
+        response_cache_stats['invalidations'] += len(stale)
+
+
+def invalidates(*tables):
+    """Записывающий маршрут: после успешного ответа сбрасывает кэш по его таблицам"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code < 400:
+                conn = g.get('db')
+                if conn is not None and conn.commit_deferred:
+                    # Внутри пакета данные фиксируются позже - кэш сбросит сам пакет после COMMIT
+                    g.setdefault('deferred_invalidations', set()).update(tables)
+                else:
+                    invalidate_cache(*tables)
+            return response
+        return wrapper
+    return decorator
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Счетчики кэша ответов этого процесса"""
+    with _response_cache_lock:
+        stats = dict(response_cache_stats, size=len(_response_cache))
+    return jsonify(dict(stats, capacity=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, pid=os.getpid()))
+
+
+# ==================== ВЕРСИИ ТАБЛИЦ ====================
+
+def tables_etag(tables):
+    """ETag по текущим версиям таблиц (поиск по первичному ключу)"""
+    conn = get_db_connection()
+    placeholders = ', '.join('?' * len(tables))
+    versions = dict(conn.execute(
+        f'SELECT table_name, version FROM table_versions WHERE table_name IN ({placeholders})',
+        tables
+    ).fetchall())
+
+    # Версия схемы тоже входит в ETag: после миграции формат ответа может измениться
+    state = f'{len(MIGRATIONS)}|' + '|'.join(f'{table}:{versions.get(table, 0)}' for table in tables)
+    # Колоночный JSON и MessagePack - другие представления тех же данных
+    fmt = response_format()
+    if fmt != JSON_MIMETYPE:
+        state += f'|{fmt}'
+    today = request_today()
+    if today:
+        state += f'|{today}'
+    return hashlib.sha1(state.encode()).hexdigest()
+
+
+def versioned(*tables, per_session=False):
+    """Условный GET для списков: при совпадении If-None-Match отвечаем 304, не выполняя запрос.
+
+    Готовые ответы 200 хранятся в кэше процесса: повторное чтение не обращается
+    к SQLite и не сериализует JSON, пока запись в таблицы не сбросит кэш.
+    per_session - ответ зависит от пользователя сессии (кэшируется для каждого отдельно).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = response_cache_key(per_session)
+            cached = response_cache_get(key)
+
+            if cached is not None:
+                etag = cached.etag
+                if request.if_none_match.contains_weak(etag):
+                    response = app.response_class(status=304)
+                else:
+                    response = app.response_class(cached.body, mimetype=cached.mimetype)
+            else:
+                generations = table_generations(tables)
+                # Версии читаем до запроса: если запись вклинится, ETag окажется старше данных, а не наоборот
+                etag = tables_etag(tables)
+
+                if request.if_none_match.contains_weak(etag):
+                    response = app.response_class(status=304)
+                else:
+                    response = app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    # Потоковый ответ в память не собираем - он и так большой
+                    if not response.is_streamed:
+                        response_cache_put(key, tables, generations, etag, response)
+
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+            response.vary.add('Accept')
+            if per_session:
+                response.vary.add('Authorization')
+            return response
+        return wrapper
+    return decorator
+
+
+# ==================== ПАГИНАЦИЯ ====================
+
+PAGE_SIZE_MAX = 500
+
+
+def encode_cursor(values):
+    """Непрозрачный курсор из значений ключа сортировки последней строки"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, key_count):
+    """Разбор курсора; ValueError если курсор поврежден"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list) or len(values) != key_count:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _collection_sql(from_sql, columns, order_keys, where='', params=(), descending=False,
+                    default_fields=None):
+    """SQL выборки коллекции по fields/after/limit запроса: (поля, sql, параметры, limit или None)"""
+    fields = request.args.get('fields')
+    if fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in columns]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    else:
+        names = list(default_fields or columns)
+
+    select = [f'{columns[name]} AS "{name}"' for name in names]
+    select += [f'{expr} AS _key{i}' for i, expr in enumerate(order_keys)]
+    conditions = [where] if where else []
+    params = list(params)
+
+    after = request.args.get('after')
+    if after:
+        # Сравнение кортежей идет по индексу сортировки, без OFFSET
+        operator = '<' if descending else '>'
+        conditions.append(
+            f"({', '.join(order_keys)}) {operator} ({', '.join('?' * len(order_keys))})"
+        )
+        params.extend(decode_cursor(after, len(order_keys)))
+
+    direction = ' DESC' if descending else ''
+    sql = f"SELECT {', '.join(select)} FROM {from_sql}"
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(f'({condition})' for condition in conditions)
+    sql += ' ORDER BY ' + ', '.join(key + direction for key in order_keys)
+
+    limit = request.args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError("limit must be a positive integer")
+        limit = min(int(limit), PAGE_SIZE_MAX)
+        sql += ' LIMIT ?'
+        params.append(limit + 1)  # Лишняя строка показывает, есть ли следующая страница
+
+    return names, sql, params, limit
+
+
+def collection_rows(conn, from_sql, columns, order_keys, **options):
+    """Вся коллекция (без limit) как RowStream - для вложения в ответ.
+
+    columns - допустимые поля {имя: SQL-выражение}; order_keys - выражения
+    ключа сортировки, последним идет уникальный id; options - where, params,
+    descending и default_fields (поля без fields=, по умолчанию все).
+    ValueError - неверные параметры запроса.
+    """
+    names, sql, params, _ = _collection_sql(from_sql, columns, order_keys, **options)
+    return RowStream(conn.execute(sql, params), names)
+
+
+def collection_result(conn, from_sql, columns, order_keys, **options):
+    """Ответ маршрута списка: при limit - страница и курсор следующей, иначе вся коллекция"""
+    names, sql, params, limit = _collection_sql(from_sql, columns, order_keys, **options)
+    cursor = conn.execute(sql, params)
+    if limit is None:
+        return json_stream_response(RowStream(cursor, names))
+
+    rows = cursor.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][f'_key{i}'] for i in range(len(order_keys))])
+    return json_stream_response({"items": RowStream(None, names, rows=rows), "next_cursor": next_cursor})
+
+
+# ==================== ПОТОКОВЫЕ ОТВЕТЫ ====================
+
+STREAM_BATCH_ROWS = 500             # Строк за один fetchmany
+STREAM_CHUNK_BYTES = 64 * 1024      # Размер отправляемых кусков ответа
+
+# Форматы списков строк (выбираются заголовком Accept):
+# JSON - массив объектов; колоночный JSON и MessagePack - {"columns": [...], "rows": [[...]]}
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.theatre.columnar+json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+def encode_json(value):
+    """JSON в байтах: orjson, если установлен, иначе стандартный json.
+
+    Единственный кодировщик ответов json_stream_response: большой и маленький
+    ответ одного маршрута кодируются одинаково, с какой бы стороны порога они ни были.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=app.json.default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=app.json.default).encode()
+
+
+def response_format():
+    """Формат ответа по Accept; без заголовка или с */* - обычный JSON"""
+    offered = [JSON_MIMETYPE, COLUMNAR_MIMETYPE]
+    if msgpack is not None:
+        offered.append(MSGPACK_MIMETYPE)
+    return request.accept_mimetypes.best_match(offered, default=JSON_MIMETYPE)
+
+
+class RowStream:
+    """Массив строк курсора, который кодируется по мере выборки.
+
+    columns - имена полей, значения берутся из первых len(columns) колонок
+    строки; convert - необязательное преобразование кортежа значений.
+    Первая пачка читается сразу: если в нее поместились все строки,
+    массив небольшой и ответ строится целиком (и кэшируется).
+    rows - уже выбранные строки вместо курсора.
+    """
+
+    def __init__(self, cursor, columns, convert=None, rows=None):
+        self.cursor = cursor
+        self.columns = list(columns)
+        width = len(self.columns)
+        self.values = (lambda row: convert(row[:width])) if convert else (lambda row: row[:width])
+        if rows is None:
+            rows = cursor.fetchmany(STREAM_BATCH_ROWS)
+            self.complete = len(rows) < STREAM_BATCH_ROWS
+        else:
+            self.complete = True
+        self.first = [self.values(row) for row in rows]
+
+    def _batches(self):
+        """Пачки кортежей значений: первая и остальные из курсора"""
+        batch = self.first
+        try:
+            while batch:
+                yield batch
+                if self.complete:
+                    return
+                batch = [self.values(row) for row in self.cursor.fetchmany(STREAM_BATCH_ROWS)]
+        finally:
+            if self.cursor is not None:
+                self.cursor.close()
+
+    def materialize(self, fmt):
+        """Все строки в виде для формата (читает курсор до конца)"""
+        rows = [values for batch in self._batches() for values in batch]
+        if fmt == JSON_MIMETYPE:
+            return [dict(zip(self.columns, values)) for values in rows]
+        return {"columns": self.columns, "rows": rows}
+
+    def chunks(self, fmt):
+        """Куски JSON: массив объектов или колоночный объект, по одному на пачку"""
+        columns = self.columns
+        if fmt == JSON_MIMETYPE:
+            yield b'['
+        else:
+            yield b'{"columns":' + encode_json(columns) + b',"rows":['
+
+        separator = b''
+        for batch in self._batches():
+            if fmt == JSON_MIMETYPE:
+                batch = [dict(zip(columns, values)) for values in batch]
+            yield separator + encode_json(batch)[1:-1]
+            separator = b','
+
+        yield b']' if fmt == JSON_MIMETYPE else b']}'
+
+
+def _has_streams(value):
+    """Есть ли в документе незавершенные RowStream"""
+    if isinstance(value, RowStream):
+        return not value.complete
+    if isinstance(value, dict):
+        return any(_has_streams(item) for item in value.values())
+    return False
+
+
+def _materialize(value, fmt):
+    """Документ с RowStream, замененными строками в виде для формата"""
+    if isinstance(value, RowStream):
+        return value.materialize(fmt)
+    if isinstance(value, dict):
+        return {key: _materialize(item, fmt) for key, item in value.items()}
+    return value
+
+
+def _json_chunks(value, fmt):
+    """Куски JSON документа; массивы RowStream выбираются по ходу отправки"""
+    if isinstance(value, RowStream):
+        yield from value.chunks(fmt)
+    elif isinstance(value, dict) and _has_streams(value):
+        yield b'{'
+        for index, (key, item) in enumerate(value.items()):
+            yield (b',' if index else b'') + encode_json(key) + b':'
+            yield from _json_chunks(item, fmt)
+        yield b'}'
+    else:
+        yield encode_json(_materialize(value, fmt))
+
+
+def json_stream_response(document, on_close=None):
+    """Ответ с документом, в котором могут быть RowStream, в формате из Accept.
+
+    Если все массивы уместились в первую пачку - ответ строится целиком.
+    Иначе JSON-ответ потоковый: память сервера не зависит от числа строк,
+    клиент начинает разбор раньше. MessagePack требует длину массива
+    заранее, поэтому собирается целиком. Соединение с БД остается за
+    запросом до конца отправки (stream_with_context); on_close вызывается
+    после последнего куска.
+    """
+    fmt = response_format()
+
+    if fmt == MSGPACK_MIMETYPE or not _has_streams(document):
+        try:
+            document = _materialize(document, fmt)
+        finally:
+            if on_close is not None:
+                on_close()
+        if fmt == MSGPACK_MIMETYPE:
+            body = msgpack.packb(document, use_bin_type=True)
+        else:
+            body = encode_json(document)
+        response = app.response_class(body, mimetype=fmt)
+        response.vary.add('Accept')
+        return response
+
+    def generate():
+        buffer = bytearray()
+        try:
+            for chunk in _json_chunks(document, fmt):
+                buffer += chunk
+                if len(buffer) >= STREAM_CHUNK_BYTES:
+                    yield bytes(buffer)
+                    buffer.clear()
+            yield bytes(buffer)
+        except sqlite3.Error as e:
+            # Статус уже отправлен - обрываем ответ, клиент получит невалидный JSON
+            print(f"Streaming error: {e}")
+            raise
+        finally:
+            if on_close is not None:
+                on_close()
+
+    response = app.response_class(stream_with_context(generate()), mimetype=fmt)
+    response.vary.add('Accept')
+    return response
+
+
+# ==================== СЖАТИЕ ОТВЕТОВ ====================
+
+COMPRESS_MIN_BYTES = 1024           # Меньшие ответы не сжимаем - выигрыш меньше заголовков
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_MIMETYPES = {JSON_MIMETYPE, COLUMNAR_MIMETYPE, MSGPACK_MIMETYPE}
+
+
+def _compress_stream(chunks, compressor):
+    """Сжатие потокового ответа по кускам; каждый кусок досылается сразу (Z_SYNC_FLUSH)"""
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Закрываем исходный поток сразу - он держит соединение с БД
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+@app.after_request
+def compress_response(response):
+    """gzip/deflate для JSON и MessagePack по Accept-Encoding клиента"""
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encodings = request.accept_encodings
+    if encodings['gzip']:
+        encoding, wbits = 'gzip', 16 + zlib.MAX_WBITS
+    elif encodings['deflate']:
+        encoding, wbits = 'deflate', zlib.MAX_WBITS
+    else:
+        return response
+
+    if response.is_streamed:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, wbits)
+        response.response = _compress_stream(response.response, compressor)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, wbits)
+        response.set_data(compressor.compress(body) + compressor.flush())
+
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое представление побайтно отличается - ETag становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# ==================== СЕССИИ ====================
+
+SESSION_TTL = 30 * 24 * 60 * 60     # Сессия живет 30 дней с последнего обращения
+SESSION_TOUCH_INTERVAL = 60         # last_seen копится в памяти и пишется пачкой раз в минуту
+
+_session_touches = {}
+_session_touches_lock = threading.Lock()
+_session_touches_flushed = time.monotonic()
+
+
+def _hash_token(token):
+    """В БД хранится только SHA-256 токена"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_session(conn, username):
+    """Новая сессия пользователя, возвращает токен для заголовка Authorization"""
+    token = secrets.token_urlsafe(32)
+    now = int(time.time())
+    conn.execute(
+        'INSERT INTO sessions (token_hash, username, created_at, last_seen, expires_at) VALUES (?, ?, ?, ?, ?)',
+        (_hash_token(token), username, now, now, now + SESSION_TTL)
+    )
+    return token
+
+
+def request_token():
+    """Токен из заголовка Authorization: Bearer <token>"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' and token.strip() else None
+
+
+def _touch_session(conn, token_hash, now):
+    """Продление сессии: обновления копятся и сбрасываются одним executemany"""
+    global _session_touches_flushed
+
+    with _session_touches_lock:
+        _session_touches[token_hash] = now
+        if time.monotonic() - _session_touches_flushed < SESSION_TOUCH_INTERVAL:
+            return
+        touches = list(_session_touches.items())
+        _session_touches.clear()
+        _session_touches_flushed = time.monotonic()
+
+    try:
+        conn.executemany(
+            'UPDATE sessions SET last_seen = ?, expires_at = ? WHERE token_hash = ?',
+            [(seen, seen + SESSION_TTL, touched_hash) for touched_hash, seen in touches]
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        # Продление не критично для запроса - возвращаем отметки в буфер, повторится при следующем сбросе
+        conn.rollback()
+        with _session_touches_lock:
+            for touched_hash, seen in touches:
+                # Более свежая отметка, пришедшая за время записи, важнее
+                if _session_touches.get(touched_hash, 0) < seen:
+                    _session_touches[touched_hash] = seen
+        print(f"Session touch failed: {e}")
+
+
+def session_user():
+    """Пользователь текущей сессии (поиск по первичному ключу) или None"""
+    if 'session_user' not in g:
+        user = None
+        token = request_token()
+        if token:
+            token_hash = _hash_token(token)
+            now = int(time.time())
+            conn = get_db_connection()
+            user = conn.execute(
+                '''SELECT u.username, u.role, u.isPart, u.avatar_hash
+                   FROM sessions s JOIN user u ON u.username = s.username
+                   WHERE s.token_hash = ? AND s.expires_at > ?''',
+                (token_hash, now)
+            ).fetchone()
+            if user:
+                _touch_session(conn, token_hash, now)
+        g.session_user = user
+    return g.session_user
 
 
 # Инициализируем БД при старте
-init_database()
+with app.app_context():
+    init_database()
 
 
 # API endpoints
@@ -120,6 +2195,7 @@ def home():
 
 
 @app.route('/api/login', methods=['POST'])
+@invalidates('user')
 def login():
     """Авторизация пользователя с проверкой пароля"""
     data = request.json
@@ -139,19 +2215,19 @@ def login():
         ).fetchone()
 
         if user:
-            # Устанавливаем пользователя как текущего
-            conn.execute('UPDATE user SET isCurrent = "no"')
-            conn.execute('UPDATE user SET isCurrent = "yes" WHERE username = ?', (username,))
-
             # Проверяем специальный пароль для организатора
             if password.endswith("20041889"):
                 conn.execute('UPDATE user SET role = "organizer" WHERE username = ?', (username,))
 
+            # Новая сессия - одна вставка, сессии других пользователей не затрагиваются
+            token = create_session(conn, username)
             conn.commit()
 
             return jsonify({
                 "success": True,
                 "message": "Login successful",
+                "token": token,
+                "expires_in": SESSION_TTL,
                 "user": {
                     "username": user['username'],
                     "role": user['role']
@@ -162,11 +2238,10 @@ def login():
 
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/auth/register', methods=['POST'])
+@invalidates('user')
 def register():
     """Регистрация нового пользователя"""
     data = request.json
@@ -201,8 +2276,23 @@ def register():
 
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
+
+
+@app.route('/api/auth/logout', methods=['POST'])
+def logout():
+    """Завершение текущей сессии"""
+    token = request_token()
+    if not token:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    conn = get_db_connection()
+
+    try:
+        conn.execute('DELETE FROM sessions WHERE token_hash = ?', (_hash_token(token),))
+        conn.commit()
+        return jsonify({"success": True, "message": "Logged out"})
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 500
 
 
 @app.route('/api/auth/me', methods=['GET'])
@@ -218,10 +2308,10 @@ def get_current_user_api():
                 'SELECT username, role FROM user WHERE username = ?', (username,)
             ).fetchone()
         else:
-            # Ищем текущего пользователя
-            user = conn.execute(
-                'SELECT username, role FROM user WHERE isCurrent = "yes"'
-            ).fetchone()
+            # Текущий пользователь - владелец сессии из заголовка Authorization
+            user = session_user()
+            if not user:
+                return jsonify({"success": False, "error": "Not authenticated"}), 401
 
         if user:
             return jsonify({
@@ -236,29 +2326,33 @@ def get_current_user_api():
 
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
 
 
 # ==================== УРОКИ ====================
 
+LESSON_FIELDS = {
+    name: name for name in
+    ('id', 'title', 'date', 'time', 'description', 'location', 'created_by', 'starts_at')
+}
+
+
 @app.route('/api/lessons', methods=['GET'])
+@versioned('lessons')
 def get_lessons():
     """Получение списка уроков"""
     conn = get_db_connection()
 
     try:
-        lessons = conn.execute(
-            'SELECT id, title, date, time, description, location, created_by FROM lessons ORDER BY date, time'
-        ).fetchall()
-        return jsonify([dict(lesson) for lesson in lessons])
+        where, params = date_range_filter('starts_at')
+        return collection_result(conn, 'lessons', LESSON_FIELDS, ['starts_at', 'id'], where=where, params=params)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except sqlite3.Error as e:
         return jsonify({"error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/lessons', methods=['POST'])
+@invalidates('lessons')
 def create_lesson():
     """Создание урока"""
     data = request.json
@@ -276,8 +2370,9 @@ def create_lesson():
 
     try:
         conn.execute(
-            'INSERT INTO lessons (title, date, time, description, location, created_by) VALUES (?, ?, ?, ?, ?, ?)',
-            (title, date, time, description, location, created_by)
+            '''INSERT INTO lessons (title, date, time, description, location, created_by, starts_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (title, date, time, description, location, created_by, normalize_lesson_start(date, time))
         )
         conn.commit()
 
@@ -285,11 +2380,10 @@ def create_lesson():
 
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/lessons/<int:lesson_id>', methods=['DELETE'])
+@invalidates('lessons')
 def delete_lesson(lesson_id):
     """Удаление урока"""
     conn = get_db_connection()
@@ -302,60 +2396,111 @@ def delete_lesson(lesson_id):
 
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
 
 
 # ==================== СПЕКТАКЛИ ====================
 
+# Поля списка спектаклей (обложка - только ссылкой в деталях)
+PERFORMANCE_LIST_FIELDS = {
+    name: name for name in ('id', 'title', 'performance_date', 'performance_on', 'description')
+}
+PERFORMANCE_LIST_DEFAULT = ['id', 'title', 'performance_date', 'performance_on']
+
+
 @app.route('/api/performances', methods=['GET'])
+@versioned('performances')
 def get_performances():
     """Получение списка спектаклей"""
     conn = get_db_connection()
-    performances = conn.execute(
-        'SELECT id, title, performance_date FROM performances ORDER BY performance_date'
-    ).fetchall()
-    conn.close()
 
-    return jsonify([dict(perf) for perf in performances])
+    try:
+        where, params = date_range_filter('performance_on')
+        return collection_result(
+            conn, 'performances', PERFORMANCE_LIST_FIELDS, ['performance_on', 'id'],
+            where=where, params=params, default_fields=PERFORMANCE_LIST_DEFAULT
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Database error: {e}"}), 500
 
 
 @app.route('/api/performances/<int:perf_id>', methods=['GET'])
+@versioned('performances')
 def get_performance(perf_id):
     """Получение деталей спектакля"""
     conn = get_db_connection()
     performance = conn.execute(
-        'SELECT * FROM performances WHERE id = ?', (perf_id,)
+        '''SELECT id, title, description, performance_date, performance_on, cover_hash, cover_size, cover_mime
+           FROM performances WHERE id = ?''', (perf_id,)
     ).fetchone()
-    conn.close()
 
     if performance:
-        return jsonify(dict(performance))
+        result = dict(performance)
+        result['cover_url'] = image_url(performance['cover_hash'])
+        return jsonify(result)
     else:
         return jsonify({"error": "Performance not found"}), 404
 
 
 @app.route('/api/performances', methods=['POST'])
+@invalidates('performances')
 def add_performance():
     """Добавление спектакля"""
-    data = request.json
+    # Клиент присылает форму с файлом cover; старые клиенты - JSON с base64
+    cover_upload = None
+    if request.is_json:
+        data = request.json
+    else:
+        try:
+            data, cover_upload = receive_image_upload('cover')
+        except UploadRejected as e:
+            return jsonify({"success": False, "error": e.message}), e.status
+
     title = data.get('title')
     description = data.get('description', '')
     performance_date = data.get('performance_date', '')
+    # Новый клиент присылает ISO-дату явно, старый - только текст в своем формате
+    performance_on = data.get('performance_on')
     cover_image = data.get('cover_image')  # base64 encoded image
 
     if not title:
         return jsonify({"success": False, "error": "Title is required"}), 400
 
+    if performance_on:
+        # По этой колонке идут фильтры дат и upcoming - принимаем только YYYY-MM-DD
+        try:
+            if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', performance_on):
+                raise ValueError
+            performance_on = date_cls.fromisoformat(performance_on).isoformat()
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "performance_on must be a date in YYYY-MM-DD format"}), 400
+    else:
+        performance_on = normalize_performance_date(performance_date)
+
+    cover_hash = cover_size = cover_mime = None
+    if cover_upload:
+        cover_hash, cover_size = store_blob_upload(cover_upload)
+        cover_mime = cover_upload.mime
+        schedule_renditions(cover_hash, 'cover')
+    elif cover_image:
+        cover_bytes = decode_image_payload(cover_image)
+        cover_mime = detect_image_mime(cover_bytes) if cover_bytes else None
+        if not cover_mime:
+            return jsonify({"success": False, "error": "Invalid cover image"}), 400
+        cover_hash, cover_size = store_blob(cover_bytes)
+        schedule_renditions(cover_hash, 'cover')
+
     conn = get_db_connection()
 
     try:
         conn.execute(
-            'INSERT INTO performances (title, description, performance_date, cover_image) VALUES (?, ?, ?, ?)',
-            (title, description, performance_date, cover_image)
+            '''INSERT INTO performances
+                   (title, description, performance_date, performance_on, cover_hash, cover_size, cover_mime)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (title, description, performance_date, performance_on, cover_hash, cover_size, cover_mime)
         )
         conn.commit()
-        conn.close()
 
         return jsonify({"success": True, "message": "Спектакль добавлен!"})
     except sqlite3.Error as e:
@@ -363,6 +2508,7 @@ def add_performance():
 
 
 @app.route('/api/performances/<int:perf_id>', methods=['DELETE'])
+@invalidates('performances', 'roles', 'role_applications')
 def delete_performance(perf_id):
     """Удаление спектакля с подтверждением если есть назначенные роли"""
     conn = get_db_connection()
@@ -384,10 +2530,9 @@ def delete_performance(perf_id):
 
         perf_title = perf_info['title']
 
-        # УДАЛЯЕМ спектакль даже если есть назначенные роли (каскадное удаление)
+        # УДАЛЯЕМ спектакль даже если есть назначенные роли (роли и заявки удалит ON DELETE CASCADE)
         conn.execute('DELETE FROM performances WHERE id = ?', (perf_id,))
         conn.commit()
-        conn.close()
 
         # Возвращаем предупреждение если были назначенные роли
         if assigned_roles > 0:
@@ -409,6 +2554,7 @@ def delete_performance(perf_id):
 # ==================== РОЛИ ====================
 
 @app.route('/api/performances/<int:perf_id>/roles', methods=['GET'])
+@versioned('roles')
 def get_roles(perf_id):
     """Получение ролей для спектакля"""
     conn = get_db_connection()
@@ -416,12 +2562,12 @@ def get_roles(perf_id):
         'SELECT id, role_name, description, status, assigned_user FROM roles WHERE performance_id = ? ORDER BY role_name',
         (perf_id,)
     ).fetchall()
-    conn.close()
 
     return jsonify([dict(role) for role in roles])
 
 
 @app.route('/api/roles', methods=['POST'])
+@invalidates('roles')
 def add_role():
     """Добавление роли"""
     data = request.json
@@ -440,14 +2586,17 @@ def add_role():
             (performance_id, role_name, description)
         )
         conn.commit()
-        conn.close()
 
         return jsonify({"success": True, "message": "Роль добавлена!"})
+    except sqlite3.IntegrityError:
+        # Внешний ключ: спектакля с таким id нет
+        return jsonify({"success": False, "error": "Спектакль не найден"}), 404
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
 
 
 @app.route('/api/roles/<int:role_id>', methods=['DELETE'])
+@invalidates('roles', 'role_applications')
 def delete_role(role_id):
     """Удаление роли с подтверждением если она назначена"""
     conn = get_db_connection()
@@ -469,7 +2618,6 @@ def delete_role(role_id):
             # УДАЛЯЕМ роль даже если она назначена (каскадное удаление заявок)
             conn.execute('DELETE FROM roles WHERE id = ?', (role_id,))
             conn.commit()
-            conn.close()
 
             return jsonify({
                 "success": True,
@@ -480,7 +2628,6 @@ def delete_role(role_id):
             # Роль не назначена - просто удаляем
             conn.execute('DELETE FROM roles WHERE id = ?', (role_id,))
             conn.commit()
-            conn.close()
 
             return jsonify({
                 "success": True,
@@ -493,7 +2640,19 @@ def delete_role(role_id):
 
 # ==================== ЗАЯВКИ ====================
 
+APPLICATIONS_FROM = '''role_applications ra
+    JOIN roles r ON ra.role_id = r.id
+    JOIN performances p ON r.performance_id = p.id'''
+APPLICATION_FIELDS = {
+    'id': 'ra.id', 'role_name': 'r.role_name', 'title': 'p.title',
+    'status': 'ra.status', 'applied_at': 'ra.applied_at',
+}
+# Организатор видит заявки всех пользователей
+ORGANIZER_APPLICATION_FIELDS = dict(APPLICATION_FIELDS, username='ra.username')
+
+
 @app.route('/api/applications', methods=['GET'])
+@versioned('role_applications', 'roles', 'performances')
 def get_applications():
     """Получение заявок"""
     username = request.args.get('username')
@@ -503,29 +2662,21 @@ def get_applications():
 
     try:
         if user_role == 'organizer':
-            applications = conn.execute('''
-                SELECT ra.id, r.role_name, p.title, ra.username, ra.applied_at, ra.status
-                FROM role_applications ra
-                JOIN roles r ON ra.role_id = r.id
-                JOIN performances p ON r.performance_id = p.id
-                ORDER BY ra.applied_at
-            ''').fetchall()
-        else:
-            applications = conn.execute('''
-                SELECT ra.id, r.role_name, p.title, ra.status, ra.applied_at
-                FROM role_applications ra
-                JOIN roles r ON ra.role_id = r.id
-                JOIN performances p ON r.performance_id = p.id
-                WHERE ra.username = ? ORDER BY ra.applied_at
-            ''', (username,)).fetchall()
-
-        conn.close()
-        return jsonify([dict(app) for app in applications])
+            return collection_result(
+                conn, APPLICATIONS_FROM, ORGANIZER_APPLICATION_FIELDS, ['ra.applied_at', 'ra.id']
+            )
+        return collection_result(
+            conn, APPLICATIONS_FROM, APPLICATION_FIELDS, ['ra.applied_at', 'ra.id'],
+            where='ra.username = ?', params=(username,)
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except sqlite3.Error as e:
         return jsonify({"error": f"Database error: {e}"}), 500
 
 
 @app.route('/api/apply', methods=['POST'])
+@invalidates('role_applications')
 def apply_for_role():
     """Подача заявки на роль"""
     data = request.json
@@ -538,29 +2689,27 @@ def apply_for_role():
     conn = get_db_connection()
 
     try:
-        # Проверка существующей заявки
-        existing = conn.execute(
-            'SELECT 1 FROM role_applications WHERE role_id = ? AND username = ?',
-            (role_id, username)
-        ).fetchone()
-
-        if existing:
-            return jsonify({"success": False, "error": "Вы уже подавали заявку на эту роль"}), 400
-
-        # Создание заявки
-        conn.execute(
-            'INSERT INTO role_applications (role_id, username) VALUES (?, ?)',
+        # Создание заявки; повторная заявка отсекается уникальным индексом
+        cursor = conn.execute(
+            '''INSERT INTO role_applications (role_id, username) VALUES (?, ?)
+               ON CONFLICT (role_id, username) DO NOTHING''',
             (role_id, username)
         )
         conn.commit()
-        conn.close()
+
+        if cursor.rowcount == 0:
+            return jsonify({"success": False, "error": "Вы уже подавали заявку на эту роль"}), 400
 
         return jsonify({"success": True, "message": "Заявка подана!"})
+    except sqlite3.IntegrityError:
+        # Внешний ключ: роли с таким id нет
+        return jsonify({"success": False, "error": "Роль не найдена"}), 404
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
 
 
 @app.route('/api/applications/<int:app_id>/approve', methods=['POST'])
+@invalidates('roles', 'role_applications')
 def approve_application(app_id):
     """Одобрение заявки с последующим удалением"""
     data = request.json
@@ -587,7 +2736,6 @@ def approve_application(app_id):
         conn.execute('DELETE FROM role_applications WHERE id = ?', (app_id,))
 
         conn.commit()
-        conn.close()
 
         return jsonify({"success": True, "message": "Заявка одобрена и удалена!"})
     except sqlite3.Error as e:
@@ -598,7 +2746,6 @@ def approve_application(app_id):
 def get_user_avatar():
     """Получение аватара пользователя"""
     username = request.args.get('username')
-    print(f"GET AVATAR - Username: {username}")
 
     if not username:
         return jsonify({"success": False, "error": "Username is required"}), 400
@@ -607,50 +2754,22 @@ def get_user_avatar():
 
     try:
         result = conn.execute(
-            'SELECT avatar FROM user WHERE username = ?', (username,)
+            'SELECT avatar_hash FROM user WHERE username = ?', (username,)
         ).fetchone()
 
-        print(f"Database result type: {type(result['avatar']) if result and result['avatar'] else 'None'}")
-        print(f"Database result length: {len(result['avatar']) if result and result['avatar'] else 0}")
-
-        conn.close()
-
-        if result and result['avatar']:
-            avatar_data = result['avatar']
-
-            # Проверяем тип данных
-            if isinstance(avatar_data, bytes):
-                # Если это байты - кодируем в base64
-                print("Avatar is bytes, encoding to base64...")
-                avatar_base64 = base64.b64encode(avatar_data).decode('utf-8')
-            elif isinstance(avatar_data, str):
-                # Если это уже строка (возможно уже base64) - возвращаем как есть
-                print("Avatar is string, returning as is...")
-                avatar_base64 = avatar_data
-            else:
-                print(f"Unknown avatar type: {type(avatar_data)}")
-                return jsonify({"success": True, "avatar": None})
-
-            print("Avatar processed successfully")
-            return jsonify({
-                "success": True,
-                "avatar": avatar_base64
-            })
-        else:
-            print("No avatar found")
-            return jsonify({"success": True, "avatar": None})
+        avatar_hash = result['avatar_hash'] if result else None
+        return jsonify({
+            "success": True,
+            "avatar_hash": avatar_hash,
+            "avatar_url": image_url(avatar_hash)
+        })
 
     except sqlite3.Error as e:
-        print(f"Database error: {e}")
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        return jsonify({"success": False, "error": f"Unexpected error: {e}"}), 500
-
-
 
 
 @app.route('/api/applications/<int:app_id>/reject', methods=['POST'])
+@invalidates('role_applications')
 def reject_application(app_id):
     """Отклонение заявки"""
     conn = get_db_connection()
@@ -659,32 +2778,99 @@ def reject_application(app_id):
         # ПРОСТО УДАЛЯЕМ заявку при отклонении
         conn.execute('DELETE FROM role_applications WHERE id = ?', (app_id,))
         conn.commit()
-        conn.close()
 
         return jsonify({"success": True, "message": "Заявка отклонена"})
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
 
 
+# ==================== ИЗОБРАЖЕНИЯ ====================
+
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@app.route('/api/images/<blob_hash>', methods=['GET'])
+def get_image(blob_hash):
+    """Отдача изображения из хранилища сырыми байтами.
+
+    Содержимое по хешу никогда не меняется, поэтому ETag строгий и равен
+    хешу, а кэш бессрочный. If-None-Match (304) и Range (206) обрабатывает
+    send_file. Параметр size=WxH запрашивает уменьшенную копию; пока она
+    не построена, отдается оригинал без долгого кэширования.
+    """
+    if not is_blob_hash(blob_hash):
+        return jsonify({"success": False, "error": "Invalid image id"}), 400
+
+    size = request.args.get('size')
+    if size and size not in RENDITION_SIZES:
+        return jsonify({"success": False, "error": f"Unsupported size: {size}"}), 400
+
+    path = _blob_path(blob_hash)
+    if not os.path.exists(path):
+        return jsonify({"success": False, "error": "Image not found"}), 404
+
+    etag = blob_hash
+    immutable = True
+    if size:
+        rendition_path = _rendition_path(blob_hash, size)
+        if os.path.exists(rendition_path):
+            path, etag = rendition_path, f'{blob_hash}-{size}'
+        else:
+            if Image is not None:
+                _enqueue_rendition(blob_hash, size)
+            immutable = False
+
+    try:
+        with open(path, 'rb') as image_file:
+            mime = detect_image_mime(image_file.read(16)) or 'application/octet-stream'
+    except OSError:
+        return jsonify({"success": False, "error": "Image not found"}), 404
+
+    response = send_file(path, mimetype=mime, etag=etag, conditional=True,
+                         max_age=IMAGE_CACHE_MAX_AGE if immutable else 0)
+    response.cache_control.public = True
+    response.cache_control.immutable = immutable
+    return response
+
+
 # ==================== ФАЙЛЫ ====================
 
+FILE_FIELDS = {
+    name: name for name in
+    ('id', 'file_name', 'file_path', 'file_size', 'file_extension', 'uploaded_by', 'uploaded_at',
+     'content_hash', 'content_size', 'content_mime')
+}
+
+
+def material_content(content_hash, file_name):
+    """Колонки content_* записи о файле: (hash, size, mime); ValueError - содержимого нет на сервере"""
+    if not content_hash:
+        return None, None, None
+    if not is_blob_hash(content_hash):
+        raise ValueError("Invalid content_hash")
+    try:
+        size = os.path.getsize(_blob_path(content_hash))
+    except OSError:
+        raise ValueError("Content is not uploaded")
+    return content_hash, size, mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+
+
 @app.route('/api/files', methods=['GET'])
+@versioned('files')
 def get_files():
     """Получение списка файлов"""
     conn = get_db_connection()
 
     try:
-        files = conn.execute(
-            'SELECT id, file_name, file_path, file_size, file_extension, uploaded_by, uploaded_at FROM files ORDER BY uploaded_at DESC'
-        ).fetchall()
-        return jsonify([dict(file) for file in files])
+        return collection_result(conn, 'files', FILE_FIELDS, ['uploaded_at', 'id'], descending=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except sqlite3.Error as e:
         return jsonify({"error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/files', methods=['POST'])
+@invalidates('files')
 def create_file():
     """Создание записи о файле"""
     data = request.json
@@ -697,12 +2883,20 @@ def create_file():
     if not file_name:
         return jsonify({"success": False, "error": "File name is required"}), 400
 
+    # Содержимое загружается заранее через /api/uploads; без него запись - только путь у загрузившего
+    try:
+        content_hash, content_size, content_mime = material_content(data.get('content_hash'), file_name)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
     conn = get_db_connection()
 
     try:
         conn.execute(
-            'INSERT INTO files (file_name, file_path, file_size, file_extension, uploaded_by) VALUES (?, ?, ?, ?, ?)',
-            (file_name, file_path, file_size, file_extension, uploaded_by)
+            '''INSERT INTO files (file_name, file_path, file_size, file_extension, uploaded_by,
+                                  content_hash, content_size, content_mime)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (file_name, file_path, file_size, file_extension, uploaded_by, content_hash, content_size, content_mime)
         )
         conn.commit()
 
@@ -710,11 +2904,10 @@ def create_file():
 
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/files/<int:file_id>', methods=['DELETE'])
+@invalidates('files')
 def delete_file(file_id):
     """Удаление записи о файле"""
     conn = get_db_connection()
@@ -727,31 +2920,310 @@ def delete_file(file_id):
 
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
+
+
+# ==================== МАТЕРИАЛЫ ====================
+
+# Партитуры, записи репетиций и прочие материалы хранятся на сервере в общем
+# хранилище по SHA-256 и видны всем участникам. Загрузка идет сессией по
+# кускам: после обрыва клиент досылает только недостающие, а содержимое,
+# которое уже есть на сервере, не передается вовсе
+MATERIAL_MAX_BYTES = 4 * 1024 * 1024 * 1024     # Предел размера одного файла
+MATERIAL_CHUNK_BYTES = 4 * 1024 * 1024          # Размер куска по умолчанию
+MATERIAL_CHUNK_MAX_BYTES = 32 * 1024 * 1024     # Наибольший кусок, который можно запросить
+UPLOAD_SESSION_TTL = 24 * 60 * 60               # Срок незавершенной загрузки с последнего куска
+MATERIAL_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def _chunk_path(upload_id, index):
+    return os.path.join(UPLOAD_STAGING_PATH, upload_id, f'{index:06d}.part')
+
+
+def _chunk_count(upload):
+    return -(-upload['size'] // upload['chunk_size'])
+
+
+def _received_chunks(upload_id):
+    """Номера уже принятых кусков сессии загрузки"""
+    try:
+        names = os.listdir(os.path.join(UPLOAD_STAGING_PATH, upload_id))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-5]) for name in names if name.endswith('.part'))
+
+
+def _upload_status(upload):
+    return {
+        "success": True,
+        "complete": False,
+        "upload_id": upload['id'],
+        "chunk_size": upload['chunk_size'],
+        "chunk_count": _chunk_count(upload),
+        "received": _received_chunks(upload['id']),
+    }
+
+
+def _session_upload(conn, upload_id):
+    """Сессия загрузки текущего пользователя: (строка, None) или (None, ответ с ошибкой)"""
+    user = session_user()
+    if not user:
+        return None, (jsonify({"success": False, "error": "Not authenticated"}), 401)
+    upload = conn.execute(
+        'SELECT * FROM upload_sessions WHERE id = ? AND username = ? AND expires_at > ?',
+        (upload_id, user['username'], int(time.time()))
+    ).fetchone()
+    if not upload:
+        return None, (jsonify({"success": False, "error": "Upload not found"}), 404)
+    return upload, None
+
+
+def _drop_upload(conn, upload_id):
+    """Удаление сессии загрузки и принятых кусков"""
+    conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+    conn.commit()
+    shutil.rmtree(os.path.join(UPLOAD_STAGING_PATH, upload_id), ignore_errors=True)
+
+
+@app.route('/api/uploads', methods=['POST'])
+def start_upload():
+    """Начало загрузки материала по кускам.
+
+    Если content_hash указан и такое содержимое уже есть на сервере, сразу
+    возвращается complete=True. Незавершенная сессия того же пользователя
+    для того же содержимого продолжается: received - уже принятые куски.
+    """
+    user = session_user()
+    if not user:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    data = request.json or {}
+    size = data.get('size')
+    chunk_size = data.get('chunk_size') or MATERIAL_CHUNK_BYTES
+    content_hash = data.get('content_hash') or None
+
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        return jsonify({"success": False, "error": "Size is required"}), 400
+    if size > MATERIAL_MAX_BYTES:
+        return jsonify({"success": False, "error": f"File is too large (max {MATERIAL_MAX_BYTES} bytes)"}), 413
+    if not isinstance(chunk_size, int) or not 0 < chunk_size <= MATERIAL_CHUNK_MAX_BYTES:
+        return jsonify({"success": False, "error": f"chunk_size must be 1..{MATERIAL_CHUNK_MAX_BYTES}"}), 400
+    if content_hash is not None and not is_blob_hash(content_hash):
+        return jsonify({"success": False, "error": "Invalid content_hash"}), 400
+
+    # Дедупликация: то же содержимое уже загружено кем-то раньше
+    if content_hash and os.path.exists(_blob_path(content_hash)):
+        return jsonify({"success": True, "complete": True, "content_hash": content_hash, "size": size})
+
+    conn = get_db_connection()
+
+    try:
+        now = int(time.time())
+        if content_hash:
+            upload = conn.execute(
+                '''SELECT * FROM upload_sessions
+                   WHERE username = ? AND content_hash = ? AND size = ? AND expires_at > ?''',
+                (user['username'], content_hash, size, now)
+            ).fetchone()
+            if upload:
+                return jsonify(_upload_status(upload))
+
+        upload_id = secrets.token_urlsafe(16)
+        conn.execute(
+            '''INSERT INTO upload_sessions
+                   (id, username, file_name, content_hash, size, chunk_size, created_at, expires_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (upload_id, user['username'], data.get('file_name'), content_hash, size, chunk_size,
+             now, now + UPLOAD_SESSION_TTL)
+        )
+        conn.commit()
+
+        upload = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+        return jsonify(_upload_status(upload))
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 500
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Состояние загрузки: какие куски уже приняты (для продолжения после обрыва)"""
+    conn = get_db_connection()
+
+    try:
+        upload, error = _session_upload(conn, upload_id)
+        return error or jsonify(_upload_status(upload))
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 500
+
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_upload_chunk(upload_id, index):
+    """Прием одного куска сырым телом запроса.
+
+    Кусок пишется во временный файл и переименовывается на место только
+    целиком, поэтому повторная отправка после обрыва безопасна. Заголовок
+    X-Content-SHA256 (необязательный) - контрольная сумма куска.
+    """
+    conn = get_db_connection()
+
+    try:
+        upload, error = _session_upload(conn, upload_id)
+        if error:
+            return error
+        if index >= _chunk_count(upload):
+            return jsonify({"success": False, "error": "Chunk index out of range"}), 400
+
+        expected = min(upload['chunk_size'], upload['size'] - index * upload['chunk_size'])
+        if request.content_length is not None and request.content_length != expected:
+            return jsonify({"success": False, "error": f"Chunk {index} must be {expected} bytes"}), 400
+
+        chunk = UploadSpool(expected, sniff=False)
+        try:
+            for piece in iter(lambda: request.stream.read(UPLOAD_CHUNK_BYTES), b''):
+                chunk.write(piece)
+        except UploadRejected as e:
+            return jsonify({"success": False, "error": e.message}), e.status
+
+        if chunk.size != expected:
+            return jsonify({"success": False, "error": f"Chunk {index} must be {expected} bytes"}), 400
+        checksum = request.headers.get('X-Content-SHA256')
+        if checksum and checksum.lower() != chunk.digest.hexdigest():
+            return jsonify({"success": False, "error": "Chunk checksum mismatch"}), 400
+
+        chunk.move_to(_chunk_path(upload_id, index))
+        conn.execute(
+            'UPDATE upload_sessions SET expires_at = ? WHERE id = ?',
+            (int(time.time()) + UPLOAD_SESSION_TTL, upload_id)
+        )
+        conn.commit()
+
+        return jsonify({"success": True, "index": index, "size": expected})
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 500
+
+
+@app.route('/api/uploads/<upload_id>/commit', methods=['POST'])
+def commit_upload(upload_id):
+    """Сборка принятых кусков в файл хранилища и закрытие сессии.
+
+    409 со списком missing - приняты не все куски. Если собранное
+    содержимое не совпало с заявленным content_hash, сессия сбрасывается.
+    """
+    conn = get_db_connection()
+
+    try:
+        upload, error = _session_upload(conn, upload_id)
+        if error:
+            return error
+
+        received = set(_received_chunks(upload_id))
+        missing = [index for index in range(_chunk_count(upload)) if index not in received]
+        if missing:
+            return jsonify({"success": False, "error": "Missing chunks", "missing": missing}), 409
+
+        content = UploadSpool(upload['size'], sniff=False)
+        for index in range(_chunk_count(upload)):
+            with open(_chunk_path(upload_id, index), 'rb') as part:
+                for piece in iter(lambda: part.read(UPLOAD_CHUNK_BYTES), b''):
+                    content.write(piece)
+
+        if upload['content_hash'] and upload['content_hash'] != content.digest.hexdigest():
+            _drop_upload(conn, upload_id)
+            return jsonify({"success": False, "error": "Content hash mismatch, upload restarted"}), 422
+
+        content_hash, size = store_blob_upload(content)
+        _drop_upload(conn, upload_id)
+
+        return jsonify({"success": True, "complete": True, "content_hash": content_hash, "size": size})
+    except UploadRejected as e:
+        return jsonify({"success": False, "error": e.message}), e.status
+    except OSError as e:
+        return jsonify({"success": False, "error": f"Storage error: {e}"}), 500
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 500
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """Отмена загрузки с удалением принятых кусков"""
+    conn = get_db_connection()
+
+    try:
+        upload, error = _session_upload(conn, upload_id)
+        if error:
+            return error
+        _drop_upload(conn, upload_id)
+        return jsonify({"success": True, "message": "Upload cancelled"})
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 500
+
+
+@app.route('/api/materials/<content_hash>', methods=['GET'])
+def get_material(content_hash):
+    """Скачивание материала по хешу содержимого.
+
+    Содержимое неизменно: ETag строгий и равен хешу, поэтому докачка
+    (Range + If-Range, ответ 206) и If-None-Match обрабатываются send_file.
+    name - имя файла для Content-Disposition и определения типа.
+    """
+    if not is_blob_hash(content_hash):
+        return jsonify({"success": False, "error": "Invalid content id"}), 400
+
+    path = _blob_path(content_hash)
+    if not os.path.exists(path):
+        return jsonify({"success": False, "error": "Material not found"}), 404
+
+    name = request.args.get('name')
+    mime = (mimetypes.guess_type(name)[0] if name else None) or 'application/octet-stream'
+    response = send_file(path, mimetype=mime, as_attachment=bool(name), download_name=name,
+                         etag=content_hash, conditional=True, max_age=MATERIAL_CACHE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 # ==================== ДОПОЛНИТЕЛЬНЫЕ ФУНКЦИИ ====================
 
 @app.route('/api/user/avatar', methods=['POST'])
+@invalidates('user')
 def update_avatar():
     """Обновление аватара пользователя"""
-    data = request.json
+    # Клиент присылает изображение сырым телом (?username=...); старые клиенты - JSON с base64
+    avatar_upload = None
+    if request.is_json:
+        data = request.json
+    else:
+        try:
+            data, avatar_upload = receive_image_upload('avatar')
+        except UploadRejected as e:
+            return jsonify({"success": False, "error": e.message}), e.status
+
     username = data.get('username')
     avatar_data = data.get('avatar')  # base64 encoded image
 
     if not username:
         return jsonify({"success": False, "error": "Username is required"}), 400
 
+    avatar_hash = avatar_size = avatar_mime = None
+    if avatar_upload:
+        avatar_hash, avatar_size = store_blob_upload(avatar_upload)
+        avatar_mime = avatar_upload.mime
+        schedule_renditions(avatar_hash, 'avatar')
+    elif avatar_data:
+        avatar_bytes = decode_image_payload(avatar_data)
+        avatar_mime = detect_image_mime(avatar_bytes) if avatar_bytes else None
+        if not avatar_mime:
+            return jsonify({"success": False, "error": "Invalid avatar image"}), 400
+        avatar_hash, avatar_size = store_blob(avatar_bytes)
+        schedule_renditions(avatar_hash, 'avatar')
+
     conn = get_db_connection()
 
     try:
         conn.execute(
-            'UPDATE user SET avatar = ? WHERE username = ?',
-            (avatar_data, username)
+            'UPDATE user SET avatar_hash = ?, avatar_size = ?, avatar_mime = ? WHERE username = ?',
+            (avatar_hash, avatar_size, avatar_mime, username)
         )
         conn.commit()
-        conn.close()
 
         return jsonify({"success": True, "message": "Avatar updated successfully"})
     except sqlite3.Error as e:
@@ -761,15 +3233,9 @@ def update_avatar():
 @app.route('/api/user/participation', methods=['GET'])
 def get_participation():
     """Получение статуса участия текущего пользователя"""
-    conn = get_db_connection()
-
     try:
-        # Ищем текущего пользователя
-        result = conn.execute(
-            'SELECT username, isPart FROM user WHERE isCurrent = "yes"'
-        ).fetchone()
-
-        conn.close()
+        # Текущий пользователь - владелец сессии
+        result = session_user()
 
         if result:
             username = result['username']
@@ -784,14 +3250,15 @@ def get_participation():
             print("No current user found")
             return jsonify({
                 "success": False,
-                "error": "No current user found"
-            }), 404
+                "error": "Not authenticated"
+            }), 401
 
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
 
 @app.route('/api/user/participation', methods=['POST'])
+@invalidates('user')
 def update_participation():
     """Обновление статуса участия текущего пользователя"""
     data = request.json
@@ -800,13 +3267,11 @@ def update_participation():
     conn = get_db_connection()
 
     try:
-        # Ищем текущего пользователя
-        current_user = conn.execute(
-            'SELECT username FROM user WHERE isCurrent = "yes"'
-        ).fetchone()
+        # Текущий пользователь - владелец сессии
+        current_user = session_user()
 
         if not current_user:
-            return jsonify({"success": False, "error": "No current user found"}), 404
+            return jsonify({"success": False, "error": "Not authenticated"}), 401
 
         username = current_user['username']
 
@@ -815,7 +3280,6 @@ def update_participation():
             (is_part, username)
         )
         conn.commit()
-        conn.close()
 
         print(f"Updated participation to {is_part} for current user: {username}")
         return jsonify({
@@ -827,39 +3291,76 @@ def update_participation():
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
 
 
+def fetch_organizers(conn):
+    """Участвующие организаторы со ссылками на аватары"""
+    organizers = conn.execute(
+        'SELECT username, avatar_hash FROM user WHERE isPart = "Yes" AND role = "organizer"'
+    )
+    return RowStream(organizers, ['username', 'avatar_url'], lambda values: (values[0], image_url(values[1])))
+
+
+def fetch_participants(conn):
+    """Участвующие пользователи, не являющиеся организаторами"""
+    participants = conn.execute(
+        'SELECT username FROM user WHERE isPart = "Yes" AND (role IS NULL OR role != "organizer") '
+        'ORDER BY username'
+    )
+    return RowStream(participants, ['username'])
+
+
 @app.route('/api/user/organizers', methods=['GET'])
+@versioned('user')
 def get_organizers():
     """Получение списка организаторов"""
     conn = get_db_connection()
 
     try:
-        organizers = conn.execute(
-            'SELECT username, avatar FROM user WHERE isPart = "Yes" AND role = "organizer"'
-        ).fetchall()
-        conn.close()
+        return json_stream_response(fetch_organizers(conn))
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Database error: {e}"}), 500
+
 
-        return jsonify([dict(org) for org in organizers])
+@app.route('/api/user/participants', methods=['GET'])
+@versioned('user')
+def get_participants():
+    """Получение списка участников (не организаторов)"""
+    conn = get_db_connection()
+
+    try:
+        return json_stream_response(fetch_participants(conn))
     except sqlite3.Error as e:
         return jsonify({"error": f"Database error: {e}"}), 500
 
 
+ADDITIONAL_FILE_FIELDS = {
+    name: name for name in
+    ('id', 'file_name', 'file_path', 'file_size', 'file_extension', 'last_modified', 'created_date',
+     'content_hash', 'content_size', 'content_mime')
+}
+ADDITIONAL_FILE_DEFAULT = [
+    'file_name', 'file_path', 'file_size', 'file_extension', 'last_modified', 'content_hash', 'content_size'
+]
+
+
 @app.route('/api/additional-files', methods=['GET'])
+@versioned('additional_files')
 def get_additional_files():
     """Получение дополнительных файлов"""
     conn = get_db_connection()
 
     try:
-        files = conn.execute(
-            'SELECT file_name, file_path, file_size, file_extension, last_modified FROM additional_files ORDER BY created_date DESC'
-        ).fetchall()
-        return jsonify([dict(file) for file in files])
+        return collection_result(
+            conn, 'additional_files', ADDITIONAL_FILE_FIELDS, ['created_date', 'id'], descending=True,
+            default_fields=ADDITIONAL_FILE_DEFAULT
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except sqlite3.Error as e:
         return jsonify({"error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/additional-files', methods=['POST'])
+@invalidates('additional_files')
 def create_additional_file():
     """Создание записи о дополнительном файле"""
     data = request.json
@@ -872,12 +3373,19 @@ def create_additional_file():
     if not file_name:
         return jsonify({"success": False, "error": "File name is required"}), 400
 
+    try:
+        content_hash, content_size, content_mime = material_content(data.get('content_hash'), file_name)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
     conn = get_db_connection()
 
     try:
         conn.execute(
-            'INSERT INTO additional_files (file_name, file_path, file_size, file_extension, last_modified) VALUES (?, ?, ?, ?, ?)',
-            (file_name, file_path, file_size, file_extension, last_modified)
+            '''INSERT INTO additional_files (file_name, file_path, file_size, file_extension, last_modified,
+                                             content_hash, content_size, content_mime)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (file_name, file_path, file_size, file_extension, last_modified, content_hash, content_size, content_mime)
         )
         conn.commit()
 
@@ -885,11 +3393,10 @@ def create_additional_file():
 
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/additional-files/<path:file_path>', methods=['DELETE'])
+@invalidates('additional_files')
 def delete_additional_file(file_path):
     """Удаление записи о дополнительном файле"""
     conn = get_db_connection()
@@ -902,9 +3409,616 @@ def delete_additional_file(file_path):
 
     except sqlite3.Error as e:
         return jsonify({"success": False, "error": f"Database error: {e}"}), 500
+
+
+# ==================== ПОИСК ====================
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_SIZE_MAX = 100
+SEARCH_QUERY_MAX_TERMS = 16
+SEARCH_SNIPPET_TOKENS = 12
+SEARCH_TITLE_WEIGHT = 10.0          # Совпадение в заголовке весит больше, чем в описании
+SEARCH_TOKEN_RE = re.compile(r'\w+')
+# Метки совпадений внутри highlight()/snippet(): текст вокруг них экранируется,
+# затем метки становятся <b>...</b>
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+# Поля найденных строк для перехода к ним в клиенте
+SEARCH_RESULT_FIELDS = {
+    'performances': ('performance_date',),
+    'roles': ('performance_id', 'status'),
+    'lessons': ('date', 'time', 'location'),
+    'files': ('file_path', 'content_hash'),
+    'additional_files': ('file_path', 'content_hash'),
+}
+
+
+def search_match_query(text):
+    """Текст пользователя -> выражение MATCH: каждое слово - префикс, все слова обязательны.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 (OR, NEAR, *, :) в тексте
+    ищутся как обычные слова и не ломают запрос.
+    """
+    text = text.replace('ё', 'е').replace('Ё', 'Е')
+    terms = SEARCH_TOKEN_RE.findall(text)[:SEARCH_QUERY_MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _marked_html(text, original=None):
+    """Фрагмент с метками совпадений -> безопасный HTML с <b>.
+
+    original - исходный текст того же поля: в индексе ё заменена на е
+    посимвольно, поэтому метки переносятся на исходные символы.
+    """
+    if text is None:
+        return None
+    if original is not None:
+        chars = iter(original)
+        text = ''.join(char if char in (_MARK_START, _MARK_END) else next(chars, char) for char in text)
+    return html.escape(text).replace(_MARK_START, '<b>').replace(_MARK_END, '</b>')
+
+
+def _search_details(conn, ids_by_table):
+    """Исходный заголовок и поля для перехода к найденным строкам: {(таблица, id): (заголовок, {...})}"""
+    details = {}
+    for table, ids in ids_by_table.items():
+        title = SEARCH_SOURCES[table][2].format(row=table)
+        fields = ', '.join(SEARCH_RESULT_FIELDS[table])
+        placeholders = ', '.join('?' * len(ids))
+        rows = conn.execute(f'SELECT id, {title} AS _title, {fields} FROM {table} WHERE id IN ({placeholders})', ids)
+        for row in rows:
+            details[(table, row['id'])] = row['_title'], {name: row[name] for name in SEARCH_RESULT_FIELDS[table]}
+    return details
+
+
+@app.route('/api/search', methods=['GET'])
+@versioned(*SEARCH_SOURCES)
+def search():
+    """Полнотекстовый поиск по спектаклям, ролям, занятиям и материалам.
+
+    q - текст запроса (слова ищутся по началу); types - таблицы через запятую
+    (по умолчанию все); limit и after - страница и курсор следующей, как у
+    списков. Результаты упорядочены по bm25, title и snippet - HTML с
+    совпадениями в <b>.
+    """
+    match = search_match_query(request.args.get('q', ''))
+    if not match:
+        return jsonify({"error": "q must contain at least one word"}), 400
+
+    types = request.args.get('types')
+    tables = [name.strip() for name in types.split(',') if name.strip()] if types else list(SEARCH_SOURCES)
+    unknown = [name for name in tables if name not in SEARCH_SOURCES]
+    if unknown:
+        return jsonify({"error": f"Unknown types: {', '.join(unknown)}"}), 400
+
+    limit = request.args.get('limit', str(SEARCH_PAGE_SIZE))
+    if not limit.isdigit() or int(limit) < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    limit = min(int(limit), SEARCH_PAGE_SIZE_MAX)
+
+    # Порядок по релевантности не дает ключа для after - курсор хранит смещение
+    offset = 0
+    after = request.args.get('after')
+    if after:
+        try:
+            offset, = decode_cursor(after, 1)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not isinstance(offset, int) or offset < 0:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    conn = get_db_connection()
+
+    try:
+        codes = ', '.join(str(SEARCH_SOURCES[table][0]) for table in tables)
+        rows = conn.execute(
+            f'''SELECT rowid,
+                       highlight(search_index, 0, char(2), char(3)) AS title,
+                       snippet(search_index, 1, char(2), char(3), '…', {SEARCH_SNIPPET_TOKENS}) AS snippet,
+                       bm25(search_index, {SEARCH_TITLE_WEIGHT}, 1.0) AS score
+                FROM search_index
+                WHERE search_index MATCH ? AND rowid % {SEARCH_ROWID_STRIDE} IN ({codes})
+                ORDER BY score, rowid
+                LIMIT ? OFFSET ?''',
+            (match, limit + 1, offset)
+        ).fetchall()
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Database error: {e}"}), 500
+
+    next_cursor = encode_cursor([offset + limit]) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    table_by_code = {code: table for table, (code, *_) in SEARCH_SOURCES.items()}
+    hits = []
+    ids_by_table = collections.defaultdict(list)
+    for row in rows:
+        table = table_by_code[row['rowid'] % SEARCH_ROWID_STRIDE]
+        row_id = row['rowid'] // SEARCH_ROWID_STRIDE
+        ids_by_table[table].append(row_id)
+        hits.append((table, row_id, row))
+
+    try:
+        details = _search_details(conn, ids_by_table)
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Database error: {e}"}), 500
+
+    items = []
+    for table, row_id, row in hits:
+        title, fields = details.get((table, row_id), (None, {}))
+        snippet = row['snippet'] if _MARK_START in (row['snippet'] or '') else None
+        items.append({
+            "type": table,
+            "id": row_id,
+            "title": _marked_html(row['title'], title),
+            "snippet": _marked_html(snippet),
+            # bm25 тем меньше, чем лучше совпадение; в ответе - чем больше, тем лучше
+            "score": round(-row['score'], 4),
+            **fields,
+        })
+
+    return json_stream_response({"items": items, "next_cursor": next_cursor})
+
+
+# ==================== ПАКЕТНЫЕ ЗАПРОСЫ ====================
+
+BATCH_MAX_OPERATIONS = 100
+BATCH_METHODS = {'POST', 'DELETE'}
+# Маршруты, которые нельзя вкладывать в пакет
+BATCH_EXCLUDED_PREFIXES = ('/api/batch', '/api/bootstrap', '/api/images/', '/api/uploads', '/api/materials/')
+
+
+def _run_batch_operation(operation):
+    """Выполнение одной операции пакета через обычный маршрут, возвращает (status, body)"""
+    if not isinstance(operation, dict):
+        return 400, {"success": False, "error": "Operation must be an object"}
+
+    method = str(operation.get('method', '')).upper()
+    path = operation.get('path', '')
+    if method not in BATCH_METHODS:
+        return 400, {"success": False, "error": f"Method not allowed in batch: {method}"}
+    if not isinstance(path, str) or not path.startswith('/api/') or path.startswith(BATCH_EXCLUDED_PREFIXES):
+        return 400, {"success": False, "error": f"Path not allowed in batch: {path}"}
+
+    # Заголовки внешнего запроса (например, авторизация) передаем в каждую операцию
+    # Accept и Accept-Encoding не передаем: ответ операции разбирается как обычный JSON
+    headers = [(key, value) for key, value in request.headers
+               if key.lower() not in ('content-type', 'content-length', 'accept', 'accept-encoding')]
+    g.batch_operation = True
+    try:
+        with app.test_request_context(path, method=method, json=operation.get('body') or {},
+                                      headers=headers):
+            response = app.full_dispatch_request()
+    except Exception as e:
+        return 500, {"success": False, "error": f"Unexpected error: {e}"}
     finally:
-        conn.close()
+        g.batch_operation = False
+
+    return response.status_code, response.get_json(silent=True)
+
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """Пакет операций в одной транзакции.
+
+    Тело: {"operations": [{"method", "path", "body"}], "atomic": false}.
+    Каждая операция выполняется обычным маршрутом внутри своей точки
+    сохранения: неудачная откатывается, удачные фиксируются одним COMMIT.
+    С atomic=true первая ошибка откатывает весь пакет, остальные операции
+    не выполняются.
+    """
+    data = request.json or {}
+    operations = data.get('operations')
+    atomic = bool(data.get('atomic', False))
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"success": False, "error": "Operations list is required"}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({"success": False, "error": f"Too many operations (max {BATCH_MAX_OPERATIONS})"}), 400
+
+    conn = get_db_connection()
+    results = []
+
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.commit_deferred = True
+
+        for operation in operations:
+            conn.execute('SAVEPOINT batch_operation')
+            status, body = _run_batch_operation(operation)
+            ok = status < 400
+            if not ok:
+                conn.execute('ROLLBACK TO batch_operation')
+            conn.execute('RELEASE batch_operation')
+            results.append({"status": status, "body": body})
+
+            if not ok and atomic:
+                break
+
+        conn.commit_deferred = False
+        all_ok = all(result['status'] < 400 for result in results)
+        deferred_invalidations = g.pop('deferred_invalidations', set())
+        if atomic and not all_ok:
+            conn.rollback()
+            # Невыполненные операции тоже отмечаем в ответе
+            results += [{"status": 424, "body": {"success": False, "error": "Skipped: batch aborted"}}
+                        for _ in operations[len(results):]]
+        else:
+            conn.commit()
+            invalidate_cache(*deferred_invalidations)
+
+        return jsonify({"success": all_ok, "results": results})
+
+    except sqlite3.Error as e:
+        conn.commit_deferred = False
+        conn.rollback()
+        g.pop('deferred_invalidations', None)
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 500
+
+
+# ==================== ЖУРНАЛ ИЗМЕНЕНИЙ ====================
+
+CHANGES_PAGE_MAX = 1000             # Записей журнала за один ответ
+SQLITE_IN_CHUNK = 500               # Параметров в одном IN (...)
+
+# Что клиент получает о строке каждой таблицы (без BLOB-колонок)
+CHANGE_FEED_COLUMNS = {
+    'performances': ['id', 'title', 'description', 'performance_date', 'performance_on', 'cover_hash'],
+    'roles': ['id', 'performance_id', 'role_name', 'description', 'status', 'assigned_user'],
+    'role_applications': ['id', 'role_id', 'username', 'status', 'applied_at'],
+    'lessons': list(LESSON_FIELDS),
+    'files': list(FILE_FIELDS),
+    'additional_files': list(ADDITIONAL_FILE_FIELDS),
+}
+
+
+def _change_feed_stream(table, cursor=None, rows=None):
+    """Строки таблицы в виде для клиента (обложка - ссылкой, а не хешем)"""
+    columns = CHANGE_FEED_COLUMNS[table]
+    if 'cover_hash' not in columns:
+        return RowStream(cursor, columns, rows=rows)
+
+    position = columns.index('cover_hash')
+
+    def convert(values):
+        return values[:position] + (image_url(values[position]),) + values[position + 1:]
+
+    columns = columns[:position] + ['cover_url'] + columns[position + 1:]
+    return RowStream(cursor, columns, convert, rows=rows)
+
+
+def _fetch_change_feed_rows(conn, table, ids):
+    """Текущее состояние строк таблицы по списку id"""
+    columns = ', '.join(CHANGE_FEED_COLUMNS[table])
+    rows = []
+    for start in range(0, len(ids), SQLITE_IN_CHUNK):
+        chunk = ids[start:start + SQLITE_IN_CHUNK]
+        rows += conn.execute(
+            f'SELECT {columns} FROM {table} WHERE id IN ({", ".join("?" * len(chunk))})', chunk
+        ).fetchall()
+    return rows
+
+
+def _change_feed_owner(table, user):
+    """Чьи строки таблицы видит пользователь: None - все, иначе имя владельца.
+
+    Актер видит только свои заявки - как в /api/applications.
+    """
+    if table == 'role_applications' and user['role'] != 'organizer':
+        return user['username']
+    return None
+
+
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """Изменения после номера since: измененные строки и id удаленных.
+
+    since=head - только текущий номер журнала, без данных: с него клиент,
+    уже загрузивший списки, начинает следить за изменениями. При since=0
+    или если нужные записи журнала уже удалены, вместо дельты возвращается
+    полный снимок таблиц с флагом reset. Номер next клиент передает в
+    следующий запрос; has_more - журнал отдан не до конца. tables - нужные
+    таблицы через запятую (по умолчанию все).
+    """
+    user = session_user()
+    if not user:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    tables = request.args.get('tables')
+    tables = [name.strip() for name in tables.split(',') if name.strip()] if tables else CHANGE_FEED_TABLES
+    unknown = [name for name in tables if name not in CHANGE_FEED_TABLES]
+    if unknown:
+        return jsonify({"success": False, "error": f"Unknown tables: {', '.join(unknown)}"}), 400
+
+    head_only = request.args.get('since') == 'head'
+    try:
+        since = 0 if head_only else int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', CHANGES_PAGE_MAX)), CHANGES_PAGE_MAX)
+    except ValueError:
+        return jsonify({"success": False, "error": "since and limit must be integers"}), 400
+    if since < 0 or limit < 1:
+        return jsonify({"success": False, "error": "since must be >= 0 and limit >= 1"}), 400
+
+    conn = get_db_connection()
+    streaming = False
+
+    try:
+        # Журнал и строки читаем из одного снимка
+        conn.execute('BEGIN')
+        oldest, head = conn.execute('SELECT MIN(seq), COALESCE(MAX(seq), 0) FROM change_log').fetchone()
+        changes = {table: {"upserted": [], "deleted": []} for table in tables}
+
+        if head_only:
+            return jsonify({"success": True, "reset": False, "next": head, "has_more": False, "changes": changes})
+
+        if since == 0 or since > head or (oldest is not None and since < oldest - 1):
+            # Полный снимок бывает очень большим - таблицы досылаются потоком
+            for table in tables:
+                sql = f'SELECT {", ".join(CHANGE_FEED_COLUMNS[table])} FROM {table}'
+                owner = _change_feed_owner(table, user)
+                params = ()
+                if owner is not None:
+                    sql += ' WHERE username = ?'
+                    params = (owner,)
+                changes[table]["upserted"] = _change_feed_stream(table, conn.execute(sql + ' ORDER BY id', params))
+            streaming = True
+            return json_stream_response({
+                "success": True, "reset": True, "next": head, "has_more": False, "changes": changes
+            }, on_close=conn.rollback)
+
+        upto = conn.execute(
+            'SELECT COALESCE(MAX(seq), ?) FROM '
+            '(SELECT seq FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?)',
+            (since, since, limit)
+        ).fetchone()[0]
+
+        # Для каждой строки важна только последняя операция (op берется из записи с MAX(seq))
+        entries = conn.execute(
+            '''SELECT table_name, row_id, op, MAX(seq) FROM change_log
+               WHERE seq > ? AND seq <= ? GROUP BY table_name, row_id''',
+            (since, upto)
+        ).fetchall()
+
+        upserted = {table: [] for table in tables}
+        for entry in entries:
+            if entry['table_name'] not in changes:
+                continue
+            if entry['op'] == 'delete':
+                changes[entry['table_name']]["deleted"].append(entry['row_id'])
+            else:
+                upserted[entry['table_name']].append(entry['row_id'])
+
+        for table, ids in upserted.items():
+            if not ids:
+                continue
+            rows = _fetch_change_feed_rows(conn, table, ids)
+            # Строку успели удалить после upto - отдаем ее как удаленную
+            found = {row['id'] for row in rows}
+            changes[table]["deleted"] += [row_id for row_id in ids if row_id not in found]
+            owner = _change_feed_owner(table, user)
+            if owner is not None:
+                rows = [row for row in rows if row['username'] == owner]
+            changes[table]["upserted"] = _change_feed_stream(table, rows=rows)
+
+        return json_stream_response({
+            "success": True, "reset": False, "next": upto, "has_more": upto < head, "changes": changes
+        })
+
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 500
+    finally:
+        # Транзакция только читающая - просто завершаем ее
+        if not streaming:
+            conn.rollback()
+
+
+# ==================== СОБЫТИЯ (SSE) ====================
+
+SSE_POLL_INTERVAL = 2.0     # Проверка журнала (записи других процессов-воркеров)
+SSE_HEARTBEAT = 15.0        # Пульс в простое, чтобы прокси не закрыл соединение
+SSE_MAX_DURATION = 300.0    # Поток закрывается, клиент переподключается с Last-Event-ID
+SSE_RETRY_MS = 3000         # Пауза перед переподключением для EventSource
+SSE_BATCH = 500             # Записей журнала в одном событии
+# Каждый поток занимает поток-воркер сервера на время до SSE_MAX_DURATION
+SSE_MAX_STREAMS = 32        # Одновременных потоков на процесс
+SSE_MAX_STREAMS_PER_USER = 2
+
+_sse_streams = {}           # username -> число открытых потоков
+_sse_streams_lock = threading.Lock()
+
+
+def _sse_message(event, data, event_id):
+    """Одно событие в формате text/event-stream"""
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+def _open_sse_slot(username):
+    """Место для нового потока событий; False - лимит исчерпан"""
+    with _sse_streams_lock:
+        user_streams = _sse_streams.get(username, 0)
+        if sum(_sse_streams.values()) >= SSE_MAX_STREAMS or user_streams >= SSE_MAX_STREAMS_PER_USER:
+            return False
+        _sse_streams[username] = user_streams + 1
+        return True
+
+
+def _close_sse_slot(username):
+    with _sse_streams_lock:
+        _sse_streams[username] -= 1
+        if not _sse_streams[username]:
+            del _sse_streams[username]
+
+
+def _change_log_rows(sql, params=()):
+    """Чтение журнала на соединении, которое сразу возвращается в пул"""
+    conn = _acquire_db_connection()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        _release_db_connection(conn)
+
+
+def _event_stream(last_seq):
+    """Генератор событий об изменениях по журналу change_log.
+
+    Событие changes: {"tables": {таблица: {"upserted": [id], "deleted": [id]}}},
+    его id - номер последней записи журнала. Событие reset означает, что журнал
+    не покрывает пропущенное и клиенту нужна полная синхронизация.
+
+    Поток живет дольше запроса: соединение с БД берется из пула только на
+    время каждой проверки журнала и между ними не удерживается.
+    """
+    yield f'retry: {SSE_RETRY_MS}\n\n'
+
+    oldest, head = _change_log_rows('SELECT MIN(seq), COALESCE(MAX(seq), 0) FROM change_log')[0]
+    if last_seq is None:
+        last_seq = head
+    elif last_seq > head or (oldest is not None and last_seq < oldest - 1):
+        last_seq = head
+        yield _sse_message('reset', {"next": head}, head)
+
+    started = idle_since = time.monotonic()
+    while time.monotonic() - started < SSE_MAX_DURATION:
+        entries = _change_log_rows(
+            'SELECT seq, table_name, row_id, op FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?',
+            (last_seq, SSE_BATCH)
+        )
+
+        if entries:
+            # По каждой строке - только последняя операция
+            latest = {(entry['table_name'], entry['row_id']): entry['op'] for entry in entries}
+            tables = {}
+            for (table, row_id), op in latest.items():
+                ids = tables.setdefault(table, {"upserted": [], "deleted": []})
+                ids["deleted" if op == 'delete' else "upserted"].append(row_id)
+
+            last_seq = entries[-1]['seq']
+            yield _sse_message('changes', {"tables": tables}, last_seq)
+            idle_since = time.monotonic()
+            continue
+
+        if time.monotonic() - idle_since >= SSE_HEARTBEAT:
+            yield ': heartbeat\n\n'
+            idle_since = time.monotonic()
+
+        with _commit_condition:
+            _commit_condition.wait(SSE_POLL_INTERVAL)
+
+
+@app.route('/api/events', methods=['GET'])
+def events():
+    """Поток уведомлений об изменениях (Server-Sent Events).
+
+    Без Last-Event-ID поток начинается с текущего момента; с ним - продолжается
+    после указанного номера журнала. Нужна сессия. Поток держит поток-воркер
+    сервера до SSE_MAX_DURATION, поэтому их число ограничено (SSE_MAX_STREAMS
+    всего и SSE_MAX_STREAMS_PER_USER на пользователя); сверх лимита - 503 и
+    клиент переподключается позже.
+    """
+    user = session_user()
+    if not user:
+        return jsonify({"success": False, "error": "Not authenticated"}), 401
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_seq = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({"success": False, "error": "Last-Event-ID must be an integer"}), 400
+
+    username = user['username']
+    if not _open_sse_slot(username):
+        response = jsonify({"success": False, "error": "Too many event streams"})
+        response.headers['Retry-After'] = str(SSE_RETRY_MS // 1000)
+        return response, 503
+
+    response = app.response_class(
+        _event_stream(last_seq),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Место освобождается при закрытии ответа, даже если поток не успел начаться
+    response.call_on_close(lambda: _close_sse_slot(username))
+    return response
+
+
+# ==================== ЗАГРУЗКА ПРИЛОЖЕНИЯ ====================
+
+@app.route('/api/bootstrap', methods=['GET'])
+@versioned(*VERSIONED_TABLES, per_session=True)
+def bootstrap():
+    """Все данные для старта клиента одним ответом.
+
+    Выборки идут в одной читающей транзакции (один снимок WAL). Для каждого
+    списка возвращается ETag, совпадающий с ETag его собственного маршрута,
+    чтобы клиент мог дальше проверять их условными запросами.
+    """
+    conn = get_db_connection()
+    streaming = False
+
+    try:
+        # Пользователь - только из сессии; разбираем ее до читающей транзакции:
+        # продление last_seen может писать в БД
+        user = session_user()
+        if not user:
+            return jsonify({"success": False, "error": "Not authenticated"}), 401
+        conn.execute('BEGIN')
+
+        def section(tables, items):
+            return {"etag": tables_etag(tables), "items": items}
+
+        # Номер журнала в том же снимке: с него клиент следит за изменениями
+        change_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+
+        lessons = collection_rows(conn, 'lessons', LESSON_FIELDS, ['starts_at', 'id'])
+        performances = collection_rows(
+            conn, 'performances', PERFORMANCE_LIST_FIELDS, ['performance_on', 'id'],
+            default_fields=PERFORMANCE_LIST_DEFAULT
+        )
+        if user['role'] == 'organizer':
+            applications = collection_rows(
+                conn, APPLICATIONS_FROM, ORGANIZER_APPLICATION_FIELDS, ['ra.applied_at', 'ra.id']
+            )
+        else:
+            applications = collection_rows(
+                conn, APPLICATIONS_FROM, APPLICATION_FIELDS, ['ra.applied_at', 'ra.id'],
+                where='ra.username = ?', params=(user['username'],)
+            )
+        additional_files = collection_rows(
+            conn, 'additional_files', ADDITIONAL_FILE_FIELDS, ['created_date', 'id'], descending=True,
+            default_fields=ADDITIONAL_FILE_DEFAULT
+        )
+
+        document = {
+            "success": True,
+            "change_seq": change_seq,
+            "user": {
+                "username": user['username'],
+                "role": user['role'],
+                "isPart": user['isPart'],
+                "avatar_url": image_url(user['avatar_hash'])
+            },
+            "collections": {
+                "lessons": section(('lessons',), lessons),
+                "performances": section(('performances',), performances),
+                "applications": section(('role_applications', 'roles', 'performances'), applications),
+                "additional_files": section(('additional_files',), additional_files),
+                "organizers": section(('user',), fetch_organizers(conn)),
+                "participants": section(('user',), fetch_participants(conn)),
+            }
+        }
+
+        # Большие списки досылаются потоком - транзакцию завершает сам ответ
+        streaming = True
+        return json_stream_response(document, on_close=conn.rollback)
+
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 500
+    finally:
+        # Транзакция только читающая - просто завершаем ее
+        if not streaming:
+            conn.rollback()
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -1,19 +1,553 @@
 import requests
 import json
-from typing import Optional, Dict, Any
-import base64
+import os
+import hashlib
+import tempfile
+import time
+import functools
+import collections
+import threading
+from typing import Optional, Dict, Any, Tuple, Iterator, List
+from urllib.parse import urlencode, quote
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Изображения адресуются по хешу содержимого и не меняются - кэшируем по ссылке
+_image_cache: Dict[str, bytes] = {}
+
+# Ответы списков с ETag: запрос -> (etag, данные); общий для всех страниц, LRU
+RESPONSE_CACHE_SIZE = 64
+_response_cache: Dict[str, Tuple[str, Any]] = collections.OrderedDict()
+_response_cache_lock = threading.Lock()
+
+# Данные из /api/bootstrap: пока не истек срок и не было записи, страницы берут их без запросов
+BOOTSTRAP_TTL = 30.0
+_prefetched: Dict[str, Tuple[float, Any]] = {}
+_MISSING = object()
+
+# Токен сессии после входа; общий для всех экземпляров клиента (у каждой страницы свой)
+_session_token: Optional[str] = None
+
+# Компактные форматы списков: MessagePack (если установлен), колоночный JSON, обычный JSON
+MSGPACK_MIMETYPE = "application/msgpack"
+COLUMNAR_MIMETYPE = "application/vnd.theatre.columnar+json"
+ACCEPT_COMPACT = (
+    f"{MSGPACK_MIMETYPE}, {COLUMNAR_MIMETYPE};q=0.9, application/json;q=0.5"
+    if msgpack else f"{COLUMNAR_MIMETYPE}, application/json;q=0.5"
+)
+
+# Материалы: загрузка на сервер кусками, скачанные копии - в локальном кэше
+MATERIAL_READ_BYTES = 1024 * 1024
+MATERIALS_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'theatre_materials')
+
+
+def _cache_key(path: str, params: Dict = None) -> str:
+    return f"{path}?{urlencode(sorted(params.items()))}" if params else path
+
+
+def _expand_columnar(value: Any) -> Any:
+    """Колоночные списки {"columns", "rows"} -> список словарей, как в обычном JSON"""
+    if isinstance(value, dict):
+        if value.keys() == {"columns", "rows"}:
+            columns = value["columns"]
+            return [dict(zip(columns, row)) for row in value["rows"]]
+        return {key: _expand_columnar(item) for key, item in value.items()}
+    return value
+
+
+def _decode_response(response: requests.Response) -> Any:
+    """Тело ответа в любом согласованном формате -> те же структуры, что и у JSON"""
+    content_type = response.headers.get('Content-Type', '')
+    if msgpack and content_type.startswith(MSGPACK_MIMETYPE):
+        return _expand_columnar(msgpack.unpackb(response.content, raw=False))
+    if content_type.startswith(COLUMNAR_MIMETYPE):
+        return _expand_columnar(response.json())
+    return response.json()
+
+
+def _prefetched_value(cache_key: str) -> Any:
+    """Предзагруженный ответ или _MISSING"""
+    entry = _prefetched.get(cache_key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return _MISSING
+
+
+def _cached_response(cache_key: str) -> Optional[Tuple[str, Any]]:
+    """Сохраненный ответ (etag, данные) или None; отмечается как недавно использованный"""
+    with _response_cache_lock:
+        entry = _response_cache.get(cache_key)
+        if entry is not None:
+            _response_cache.move_to_end(cache_key)
+        return entry
+
+
+def _store_response(cache_key: str, etag: str, data: Any):
+    """Сохранение ответа с вытеснением давно не использованных"""
+    with _response_cache_lock:
+        _response_cache[cache_key] = (etag, data)
+        _response_cache.move_to_end(cache_key)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+
+def _bearer_auth(request):
+    """Подстановка токена сессии в заголовок Authorization"""
+    if _session_token:
+        request.headers['Authorization'] = f"Bearer {_session_token}"
+    return request
+
+
+def _mutation(method):
+    """Метод меняет данные на сервере - предзагруженные ответы больше не актуальны"""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        _prefetched.clear()
+        return method(*args, **kwargs)
+    return wrapper
+
+
+class BatchRequest:
+    """Накопитель операций: все вызовы уходят на сервер одним запросом /api/batch.
+
+    with client.batch() as batch:
+        batch.create_role(1, "Гамлет")
+        batch.delete_file(5)
+    результаты - в batch.results после выхода из блока
+    """
+
+    def __init__(self, client: 'SimpleTheatreClient', atomic: bool = False):
+        self.client = client
+        self.atomic = atomic
+        self.operations: List[Dict] = []
+        self.results: List[Dict] = []
+
+    def __enter__(self) -> 'BatchRequest':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, method: str, path: str, body: Dict = None) -> 'BatchRequest':
+        self.operations.append({"method": method, "path": path, "body": body or {}})
+        return self
+
+    def create_role(self, performance_id: int, role_name: str, description: str = "") -> 'BatchRequest':
+        return self.add("POST", "/api/roles", {
+            "performance_id": performance_id, "role_name": role_name, "description": description
+        })
+
+    def delete_role(self, role_id: int) -> 'BatchRequest':
+        return self.add("DELETE", f"/api/roles/{role_id}")
+
+    def approve_application(self, application_id: int, applicant_username: str) -> 'BatchRequest':
+        return self.add("POST", f"/api/applications/{application_id}/approve", {"username": applicant_username})
+
+    def reject_application(self, application_id: int) -> 'BatchRequest':
+        return self.add("POST", f"/api/applications/{application_id}/reject")
+
+    def create_lesson(self, title: str, date: str, time: str = "", description: str = "",
+                      location: str = "") -> 'BatchRequest':
+        return self.add("POST", "/api/lessons", {
+            "title": title, "date": date, "time": time, "description": description, "location": location,
+            "created_by": self.client.current_user['username'] if self.client.current_user else ""
+        })
+
+    def delete_lesson(self, lesson_id: int) -> 'BatchRequest':
+        return self.add("DELETE", f"/api/lessons/{lesson_id}")
+
+    def delete_file(self, file_id: int) -> 'BatchRequest':
+        return self.add("DELETE", f"/api/files/{file_id}")
+
+    def create_additional_file(self, file_name: str, file_path: str, file_size: str = "",
+                               file_extension: str = "", last_modified: str = "",
+                               content_hash: str = None) -> 'BatchRequest':
+        return self.add("POST", "/api/additional-files", {
+            "file_name": file_name, "file_path": file_path, "file_size": file_size,
+            "file_extension": file_extension, "last_modified": last_modified, "content_hash": content_hash
+        })
+
+    def delete_additional_file(self, file_path: str) -> 'BatchRequest':
+        return self.add("DELETE", f"/api/additional-files/{quote(file_path, safe='')}")
+
+    def flush(self) -> List[Dict]:
+        """Отправка накопленных операций; результаты по порядку: {"status", "body"}"""
+        if not self.operations:
+            return []
+
+        _prefetched.clear()
+        operations, self.operations = self.operations, []
+        try:
+            response = self.client.session.post(
+                f"{self.client.base_url}/api/batch",
+                json={"operations": operations, "atomic": self.atomic},
+                timeout=30
+            )
+            data = response.json()
+            self.results = data.get('results') or [
+                {"status": response.status_code, "body": data} for _ in operations
+            ]
+        except requests.exceptions.RequestException as e:
+            print(f"Batch request failed: {e}")
+            self.results = [{"status": 0, "body": {"success": False, "error": "Network error"}}
+                            for _ in operations]
+        return self.results
+
+
+class EventListener(threading.Thread):
+    """Фоновое чтение потока /api/events с переподключением по Last-Event-ID.
+
+    on_event(event, data) вызывается из фонового потока: GUI должен передавать
+    событие в свой поток сам (например, сигналом Qt).
+    """
+
+    def __init__(self, base_url: str, on_event, retry_delay: float = 3.0):
+        super().__init__(daemon=True)
+        self.url = f"{base_url}/api/events"
+        self.on_event = on_event
+        self.retry_delay = retry_delay
+        self.last_event_id = None
+        self._stopped = threading.Event()
+        self._response = None
+
+    def stop(self):
+        self._stopped.set()
+        if self._response is not None:
+            self._response.close()
+
+    def run(self):
+        while not self._stopped.is_set():
+            headers = {"Accept": "text/event-stream"}
+            if self.last_event_id:
+                headers["Last-Event-ID"] = self.last_event_id
+            try:
+                # Таймаут чтения больше интервала пульса сервера
+                with requests.get(self.url, headers=headers, auth=_bearer_auth, stream=True,
+                                  timeout=(10, 60)) as response:
+                    self._response = response
+                    if response.status_code == 200:
+                        self._read_events(response)
+            except (requests.exceptions.RequestException, AttributeError, ValueError):
+                pass  # Обрыв соединения (или stop) - переподключаемся ниже
+            finally:
+                self._response = None
+            self._stopped.wait(self.retry_delay)
+
+    def _read_events(self, response):
+        """Разбор text/event-stream и вызов on_event на каждое событие"""
+        event, data, event_id = "message", [], None
+        # chunk_size=1: события короткие, а иначе они ждали бы заполнения буфера
+        for raw_line in response.iter_lines(chunk_size=1):
+            if self._stopped.is_set():
+                return
+            line = raw_line.decode('utf-8')
+
+            if not line:
+                if event_id is not None:
+                    self.last_event_id = event_id
+                if data:
+                    # Данные на сервере изменились - предзагруженные ответы устарели
+                    _prefetched.clear()
+                    self.on_event(event, json.loads("\n".join(data)))
+                event, data, event_id = "message", [], None
+                continue
+            if line.startswith(":"):
+                continue
+
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+            elif field == "id":
+                event_id = value
+            elif field == "retry" and value.isdigit():
+                self.retry_delay = int(value) / 1000
+
+
+# Соединения поиска отдельно от основной сессии: запросы идут из фоновых потоков
+_search_session = requests.Session()
+_search_session.headers['Accept'] = ACCEPT_COMPACT
+_search_session.auth = _bearer_auth
+
+
+def _search_params(query: str, types: List[str] = None, limit: int = 20, after: str = None) -> Dict:
+    params = {'q': query, 'limit': limit}
+    if types:
+        params['types'] = ",".join(types)
+    if after:
+        params['after'] = after
+    return params
+
+
+class SearchRequest(threading.Thread):
+    """Фоновый запрос /api/search, который можно отменить.
+
+    on_result(query, data) вызывается из фонового потока, только если запрос
+    не отменен; data - {"items", "next_cursor"} или None при ошибке. cancel()
+    обрывает соединение, поэтому устаревший запрос не ждет ответа сервера.
+    """
+
+    def __init__(self, base_url: str, query: str, on_result, types: List[str] = None, limit: int = 20):
+        super().__init__(daemon=True)
+        self.url = f"{base_url}/api/search"
+        self.query = query
+        self.params = _search_params(query, types, limit)
+        self.on_result = on_result
+        self._cancelled = threading.Event()
+        self._response = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self._response is not None:
+            self._response.close()
+
+    def run(self):
+        data = None
+        try:
+            with _search_session.get(self.url, params=self.params, stream=True, timeout=10) as response:
+                self._response = response
+                if response.status_code == 200 and not self.cancelled:
+                    data = _decode_response(response)
+        except (requests.exceptions.RequestException, AttributeError, ValueError):
+            pass  # Сеть недоступна или запрос отменен
+        finally:
+            self._response = None
+        if not self.cancelled:
+            self.on_result(self.query, data)
 
 
 class SimpleTheatreClient:
     def __init__(self):
         self.base_url = "https://barialibasov.pythonanywhere.com"
         self.session = requests.Session()
-        # Добавляем заголовки для корректной работы с JSON
+        # Тела запросов - JSON; списки сервер отдает в компактном формате и сжатыми
         self.session.headers.update({
             'Content-Type': 'application/json',
-            'Accept': 'application/json'
+            'Accept': ACCEPT_COMPACT
         })
+        self.session.auth = _bearer_auth
         self.current_user = None
+        # Номер журнала изменений, с которого следим за сервером (None - еще не начали)
+        self.change_seq = None
+
+    def _get_json_cached(self, path: str, params: Dict = None, store: bool = True) -> Tuple[int, Any]:
+        """GET с If-None-Match: если данные не менялись (304), берем сохраненный ответ.
+
+        store=False - новый ответ не сохраняется (уже сохраненный используется).
+        """
+        cache_key = _cache_key(path, params)
+        prefetched = _prefetched_value(cache_key)
+        if prefetched is not _MISSING:
+            return 200, prefetched
+
+        cached = _cached_response(cache_key)
+        headers = {'If-None-Match': cached[0]} if cached else {}
+
+        response = self.session.get(f"{self.base_url}{path}", params=params, headers=headers, timeout=10)
+        if response.status_code == 304 and cached:
+            return 200, cached[1]
+
+        data = _decode_response(response)
+        etag = response.headers.get('ETag')
+        if response.status_code == 200 and etag and store:
+            _store_response(cache_key, etag, data)
+        return response.status_code, data
+
+    def _iter_collection(self, path: str, params: Dict = None, page_size: int = 100,
+                         fields: List[str] = None) -> Iterator[Dict]:
+        """Ленивый постраничный обход коллекции по курсору (следующая страница - по мере чтения)"""
+        params = dict(params or {}, limit=page_size)
+        if fields:
+            params['fields'] = ",".join(fields)
+
+        while True:
+            # Сохраняем только первую страницу: ее перечитывают при каждом обновлении,
+            # а ключи следующих зависят от курсора и при изменениях уже не повторяются
+            status, data = self._get_json_cached(path, params, store='after' not in params)
+            if status != 200:
+                print(f"Page request failed for {path}: {data}")
+                return
+            yield from data.get('items', [])
+            if not data.get('next_cursor'):
+                return
+            params['after'] = data['next_cursor']
+
+    def iter_performances(self, page_size: int = 100, fields: List[str] = None) -> Iterator[Dict]:
+        return self._iter_collection("/api/performances", page_size=page_size, fields=fields)
+
+    def iter_lessons(self, page_size: int = 100, fields: List[str] = None) -> Iterator[Dict]:
+        return self._iter_collection("/api/lessons", page_size=page_size, fields=fields)
+
+    def iter_applications(self, page_size: int = 100, fields: List[str] = None) -> Iterator[Dict]:
+        username = self.current_user['username'] if self.current_user else ""
+        role = self.current_user['role'] if self.current_user else "actor"
+        return self._iter_collection(
+            "/api/applications", params={"username": username, "role": role},
+            page_size=page_size, fields=fields
+        )
+
+    def iter_files(self, page_size: int = 100, fields: List[str] = None) -> Iterator[Dict]:
+        return self._iter_collection("/api/files", page_size=page_size, fields=fields)
+
+    def iter_additional_files(self, page_size: int = 100, fields: List[str] = None) -> Iterator[Dict]:
+        return self._iter_collection("/api/additional-files", page_size=page_size, fields=fields)
+
+    def batch(self, atomic: bool = False) -> BatchRequest:
+        """Пакет операций, отправляемый одним запросом"""
+        return BatchRequest(self, atomic)
+
+    def bootstrap(self) -> Optional[Dict]:
+        """Стартовые данные всех страниц одним запросом.
+
+        Заполняет общие кэши: первые обращения страниц к спискам, текущему
+        пользователю, участию и аватару обходятся без запросов к серверу,
+        а дальнейшие идут условными запросами с полученными ETag.
+        """
+        try:
+            response = self.session.get(f"{self.base_url}/api/bootstrap", timeout=15)
+            data = _decode_response(response)
+        except requests.exceptions.RequestException as e:
+            print(f"Bootstrap failed: {e}")
+            return None
+
+        if response.status_code != 200 or not data.get('success'):
+            print(f"Bootstrap error: {data.get('error')}")
+            return None
+
+        user = data['user']
+        self.current_user = {"username": user['username'], "role": user['role']}
+        expires_at = time.monotonic() + BOOTSTRAP_TTL
+
+        collection_routes = {
+            "lessons": ("/api/lessons", None),
+            "performances": ("/api/performances", None),
+            "applications": ("/api/applications", dict(self.current_user)),
+            "additional_files": ("/api/additional-files", None),
+            "organizers": ("/api/user/organizers", None),
+            "participants": ("/api/user/participants", None),
+        }
+        for name, (path, params) in collection_routes.items():
+            section = data['collections'].get(name)
+            if section is None:
+                continue
+            cache_key = _cache_key(path, params)
+            _store_response(cache_key, f'"{section["etag"]}"', section['items'])
+            _prefetched[cache_key] = (expires_at, section['items'])
+
+        _prefetched["/api/auth/me"] = (expires_at, self.current_user)
+        # Номер журнала на момент снимка: с него страницы начинают следить за изменениями
+        _prefetched["/api/changes"] = (expires_at, data.get('change_seq'))
+        _prefetched[_cache_key("/api/user/participation", {"username": user['username']})] = \
+            (expires_at, user['isPart'])
+        _prefetched[_cache_key("/api/user/avatar", {"username": user['username']})] = \
+            (expires_at, user['avatar_url'])
+
+        return self.current_user
+
+    @staticmethod
+    def set_session_token(token: Optional[str]):
+        """Токен сессии (после входа или сохраненный с прошлого запуска)"""
+        global _session_token
+        _session_token = token
+
+    @property
+    def session_token(self) -> Optional[str]:
+        return _session_token
+
+    def listen_events(self, on_event) -> EventListener:
+        """Запуск фонового слушателя push-уведомлений сервера"""
+        listener = EventListener(self.base_url, on_event)
+        listener.start()
+        return listener
+
+    def search(self, query: str, types: List[str] = None, limit: int = 20,
+               after: str = None) -> Optional[Dict]:
+        """Полнотекстовый поиск: {"items", "next_cursor"} или None при ошибке"""
+        try:
+            response = self.session.get(f"{self.base_url}/api/search",
+                                        params=_search_params(query, types, limit, after), timeout=10)
+            return _decode_response(response) if response.status_code == 200 else None
+        except requests.exceptions.RequestException:
+            return None
+
+    def search_async(self, query: str, on_result, types: List[str] = None, limit: int = 20) -> SearchRequest:
+        """Поиск в фоновом потоке; предыдущий запрос вызывающий отменяет сам (cancel)"""
+        request = SearchRequest(self.base_url, query, on_result, types, limit)
+        request.start()
+        return request
+
+    def start_changes(self) -> bool:
+        """Начало слежения за изменениями с текущего номера журнала.
+
+        Вызывается перед загрузкой списков: все, что изменится после,
+        покажет sync_changes, а снимок таблиц заново не скачивается.
+        """
+        prefetched = _prefetched_value("/api/changes")
+        if prefetched is not _MISSING and prefetched is not None:
+            # Списки возьмутся из снимка bootstrap - отсчитываем от него
+            self.change_seq = prefetched
+            return True
+
+        data = self._fetch_changes({"since": "head"})
+        if data is None:
+            return False
+        self.change_seq = data['next']
+        return True
+
+    def sync_changes(self, tables: List[str] = None) -> Optional[set]:
+        """Какие из таблиц tables изменились с прошлой проверки.
+
+        Возвращает множество изменившихся таблиц; None - состояние неизвестно
+        (ошибка сети или слежение еще не начато) и списки надо перезагрузить.
+        """
+        if self.change_seq is None:
+            self.start_changes()
+            return None
+        if self.change_seq == 0:
+            # Журнал был пуст: снимок не нужен, достаточно узнать, появились ли в нем записи
+            data = self._fetch_changes({"since": "head"})
+            if data is None:
+                return None
+            self.change_seq = data['next']
+            return set(tables or data['changes']) if data['next'] else set()
+
+        changed = set()
+        params = {"since": self.change_seq}
+        if tables:
+            params["tables"] = ",".join(tables)
+        while True:
+            data = self._fetch_changes(params)
+            if data is None:
+                return None
+            for table, diff in data['changes'].items():
+                if data['reset'] or diff['upserted'] or diff['deleted']:
+                    changed.add(table)
+
+            self.change_seq = params["since"] = data['next']
+            if not data['has_more']:
+                return changed
+
+    def _fetch_changes(self, params: Dict) -> Optional[Dict]:
+        try:
+            response = self.session.get(f"{self.base_url}/api/changes", params=params, timeout=15)
+            data = _decode_response(response)
+        except requests.exceptions.RequestException as e:
+            print(f"Sync failed: {e}")
+            return None
+        if response.status_code != 200 or not data.get('success'):
+            print(f"Sync error: {data.get('error')}")
+            return None
+        return data
 
     def test_connection(self):
         """Тестирование подключения к серверу"""
@@ -32,6 +566,7 @@ class SimpleTheatreClient:
         except json.JSONDecodeError as e:
             return {"error": f"Invalid JSON response: {str(e)}\nResponse: {response.text}"}
 
+    @_mutation
     def login(self, username, password):
         """Авторизация пользователя"""
         try:
@@ -52,6 +587,7 @@ class SimpleTheatreClient:
                 result = response.json()
                 if result.get('success'):
                     self.current_user = result.get('user')
+                    self.set_session_token(result.get('token'))
                     print(f"Current User: {self.current_user}")
                 return result
             else:
@@ -64,6 +600,7 @@ class SimpleTheatreClient:
         except json.JSONDecodeError as e:
             return {"error": f"Invalid response from server: {str(e)}\nResponse: {response.text}"}
 
+    @_mutation
     def register(self, username: str, password: str) -> bool:
         """Регистрация пользователя"""
         try:
@@ -79,16 +616,33 @@ class SimpleTheatreClient:
     def get_participants(self):
         """Получение списка участников (не организаторов)"""
         try:
-            response = requests.get(f"{self.base_url}/api/user/participants")
-            return response.json()
+            return self._get_json_cached("/api/user/participants")[1]
         except requests.exceptions.RequestException:
             return []
         
+    @_mutation
+    def logout(self) -> bool:
+        """Завершение сессии на сервере"""
+        try:
+            response = self.session.post(f"{self.base_url}/api/auth/logout", timeout=10)
+            return response.json().get('success', False)
+        except requests.exceptions.RequestException:
+            return False
+        finally:
+            self.set_session_token(None)
+            self.current_user = None
+
     def get_current_user(self) -> Optional[Dict]:
         """Получение текущего пользователя через API"""
+        prefetched = _prefetched_value("/api/auth/me")
+        if prefetched is not _MISSING:
+            if not self.current_user:
+                self.current_user = prefetched
+            return prefetched
+
         try:
-            # Делаем запрос к API без параметров - сервер сам определит текущего пользователя
-            response = requests.get(f"{self.base_url}/api/auth/me")
+            # Без параметров сервер определит пользователя по токену сессии
+            response = self.session.get(f"{self.base_url}/api/auth/me")
             data = response.json()
 
             if data.get('success'):
@@ -108,41 +662,41 @@ class SimpleTheatreClient:
     # Методы для спектаклей
     def get_performances(self) -> list:
         try:
-            response = requests.get(f"{self.base_url}/api/performances")
-            return response.json()
+            return self._get_json_cached("/api/performances")[1]
         except requests.exceptions.RequestException:
             return []
 
     def get_performance(self, perf_id: int) -> Optional[Dict]:
         try:
-            response = requests.get(f"{self.base_url}/api/performances/{perf_id}")
-            if response.status_code == 200:
-                return response.json()
+            status, data = self._get_json_cached(f"/api/performances/{perf_id}")
+            if status == 200:
+                return data
             return None
         except requests.exceptions.RequestException:
             return None
 
+    @_mutation
     def create_performance(self, title: str, description: str = "", performance_date: str = "",
                            cover_image: bytes = None) -> bool:
+        """Создание спектакля; обложка (байты или открытый файл) уходит частью формы, без base64"""
         try:
-            cover_data = None
-            if cover_image:
-                cover_data = base64.b64encode(cover_image).decode('utf-8')
-
+            files = {"cover": ("cover", cover_image, "application/octet-stream")} if cover_image else None
             response = requests.post(
                 f"{self.base_url}/api/performances",
-                json={
+                data={
                     "title": title,
                     "description": description,
                     "performance_date": performance_date,
-                    "cover_image": cover_data
-                }
+                    "performance_on": performance_date,  # дата в ISO (yyyy-MM-dd)
+                },
+                files=files
             )
             data = response.json()
             return data.get('success', False)
         except requests.exceptions.RequestException:
             return False
 
+    @_mutation
     def delete_performance(self, performance_id: int) -> Dict:
         """Удаление спектакля - возвращает полный ответ с предупреждениями"""
         try:
@@ -155,11 +709,11 @@ class SimpleTheatreClient:
     # Методы для ролей
     def get_roles(self, performance_id: int) -> list:
         try:
-            response = requests.get(f"{self.base_url}/api/performances/{performance_id}/roles")
-            return response.json()
+            return self._get_json_cached(f"/api/performances/{performance_id}/roles")[1]
         except requests.exceptions.RequestException:
             return []
 
+    @_mutation
     def create_role(self, performance_id: int, role_name: str, description: str = "") -> bool:
         try:
             response = requests.post(
@@ -175,6 +729,7 @@ class SimpleTheatreClient:
         except requests.exceptions.RequestException:
             return False
 
+    @_mutation
     def delete_role(self, role_id: int) -> Dict:
         """Удаление роли - возвращает полный ответ с предупреждениями"""
         try:
@@ -185,6 +740,7 @@ class SimpleTheatreClient:
             return {"success": False, "error": "Network error"}
 
     # Методы для заявок
+    @_mutation
     def apply_for_role(self, role_id: int) -> bool:
         try:
             response = requests.post(
@@ -203,14 +759,14 @@ class SimpleTheatreClient:
         try:
             username = self.current_user['username'] if self.current_user else ""
             role = self.current_user['role'] if self.current_user else "actor"
-            response = requests.get(
-                f"{self.base_url}/api/applications",
+            return self._get_json_cached(
+                "/api/applications",
                 params={"username": username, "role": role}
-            )
-            return response.json()
+            )[1]
         except requests.exceptions.RequestException:
             return []
 
+    @_mutation
     def approve_application(self, application_id: int, applicant_username: str) -> bool:
         """Одобрение заявки - передаем username заявителя"""
         try:
@@ -225,6 +781,7 @@ class SimpleTheatreClient:
         except requests.exceptions.RequestException:
             return False
 
+    @_mutation
     def reject_application(self, application_id: int) -> bool:
         try:
             response = requests.post(f"{self.base_url}/api/applications/{application_id}/reject")
@@ -234,14 +791,27 @@ class SimpleTheatreClient:
             return False
 
     # Методы для занятий
-    def get_lessons(self) -> list:
+    def get_lessons(self, date_from: str = None, date_to: str = None) -> list:
+        """Занятия, при необходимости за период (даты ISO, включительно)"""
+        params = {}
+        if date_from:
+            params['from'] = date_from
+        if date_to:
+            params['to'] = date_to
         try:
-            response = requests.get(f"{self.base_url}/api/lessons")
-            print(response.json())
-            return response.json()
+            return self._get_json_cached("/api/lessons", params or None)[1]
         except requests.exceptions.RequestException:
             return []
 
+    def get_upcoming_lessons(self, count: int = 1) -> list:
+        """Ближайшие занятия начиная с сегодняшнего дня (сортирует сервер)"""
+        try:
+            status, data = self._get_json_cached("/api/lessons", {"upcoming": 1, "limit": count})
+            return data.get('items', []) if status == 200 else []
+        except requests.exceptions.RequestException:
+            return []
+
+    @_mutation
     def create_lesson(self, title: str, date: str, time: str = "", description: str = "", location: str = "") -> bool:
         try:
             response = requests.post(
@@ -260,6 +830,7 @@ class SimpleTheatreClient:
         except requests.exceptions.RequestException:
             return False
 
+    @_mutation
     def delete_lesson(self, lesson_id: int) -> bool:
         try:
             response = requests.delete(f"{self.base_url}/api/lessons/{lesson_id}")
@@ -271,12 +842,13 @@ class SimpleTheatreClient:
     # Методы для файлов
     def get_files(self) -> list:
         try:
-            response = requests.get(f"{self.base_url}/api/files")
-            return response.json()
+            return self._get_json_cached("/api/files")[1]
         except requests.exceptions.RequestException:
             return []
 
-    def create_file(self, file_name: str, file_path: str, file_size: str = "", file_extension: str = "") -> bool:
+    @_mutation
+    def create_file(self, file_name: str, file_path: str, file_size: str = "", file_extension: str = "",
+                    content_hash: str = None) -> bool:
         try:
             response = requests.post(
                 f"{self.base_url}/api/files",
@@ -285,7 +857,8 @@ class SimpleTheatreClient:
                     "file_path": file_path,
                     "file_size": file_size,
                     "file_extension": file_extension,
-                    "uploaded_by": self.current_user['username'] if self.current_user else ""
+                    "uploaded_by": self.current_user['username'] if self.current_user else "",
+                    "content_hash": content_hash
                 }
             )
             data = response.json()
@@ -293,6 +866,7 @@ class SimpleTheatreClient:
         except requests.exceptions.RequestException:
             return False
 
+    @_mutation
     def delete_file(self, file_id: int) -> bool:
         try:
             response = requests.delete(f"{self.base_url}/api/files/{file_id}")
@@ -301,27 +875,140 @@ class SimpleTheatreClient:
         except requests.exceptions.RequestException:
             return False
 
+    # Методы для материалов (содержимое файлов на сервере)
+    def upload_material(self, file_path: str, progress=None) -> Optional[Dict]:
+        """Загрузка файла на сервер по кускам: {"content_hash", "size"} или None.
+
+        Повторный вызов после обрыва досылает только непринятые куски, а
+        содержимое, которое уже есть на сервере, не передается совсем.
+        progress(отправлено, всего) вызывается после каждого куска.
+        """
+        try:
+            size = os.path.getsize(file_path)
+            digest = hashlib.sha256()
+            with open(file_path, 'rb') as source:
+                for piece in iter(lambda: source.read(MATERIAL_READ_BYTES), b''):
+                    digest.update(piece)
+
+            response = self.session.post(
+                f"{self.base_url}/api/uploads",
+                json={"file_name": os.path.basename(file_path), "size": size, "content_hash": digest.hexdigest()},
+                timeout=30
+            )
+            data = response.json()
+            if not data.get('success'):
+                print(f"Upload error: {data.get('error')}")
+                return None
+
+            if not data['complete']:
+                upload_url = f"{self.base_url}/api/uploads/{data['upload_id']}"
+                chunk_size = data['chunk_size']
+                received = set(data['received'])
+                with open(file_path, 'rb') as source:
+                    for index in range(data['chunk_count']):
+                        if index not in received:
+                            source.seek(index * chunk_size)
+                            chunk = source.read(chunk_size)
+                            response = self.session.put(
+                                f"{upload_url}/chunks/{index}",
+                                data=chunk,
+                                headers={"Content-Type": "application/octet-stream",
+                                         "X-Content-SHA256": hashlib.sha256(chunk).hexdigest()},
+                                timeout=120
+                            )
+                            if response.status_code != 200:
+                                print(f"Chunk {index} upload failed: {response.text}")
+                                return None
+                        if progress:
+                            progress(min(size, (index + 1) * chunk_size), size)
+
+                response = self.session.post(f"{upload_url}/commit", timeout=300)
+                data = response.json()
+                if not data.get('success'):
+                    print(f"Upload commit error: {data.get('error')}")
+                    return None
+
+            return {"content_hash": data['content_hash'], "size": data['size']}
+        except (OSError, requests.exceptions.RequestException) as e:
+            print(f"Upload failed: {e}")
+            return None
+
+    def download_material(self, content_hash: str, target_path: str, progress=None) -> bool:
+        """Скачивание материала в файл с докачкой.
+
+        Недокачанное лежит в target_path + '.part' и продолжается запросом
+        Range; готовый файл проверяется по хешу и переименовывается.
+        """
+        partial_path = f"{target_path}.part"
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        # If-Range: если содержимое вдруг другое, сервер пришлет файл целиком (200)
+        headers = {"Range": f"bytes={offset}-", "If-Range": f'"{content_hash}"'} if offset else {}
+
+        try:
+            with self.session.get(f"{self.base_url}/api/materials/{content_hash}",
+                                  headers=headers, stream=True, timeout=30) as response:
+                if response.status_code == 416:
+                    # Часть уже не меньше файла - начинаем заново
+                    os.remove(partial_path)
+                    return self.download_material(content_hash, target_path, progress)
+                if response.status_code not in (200, 206):
+                    print(f"Download error: HTTP {response.status_code}")
+                    return False
+
+                if response.status_code == 200:
+                    offset = 0
+                total = offset + int(response.headers.get('Content-Length', 0))
+                with open(partial_path, 'ab' if offset else 'wb') as target:
+                    for piece in response.iter_content(MATERIAL_READ_BYTES):
+                        target.write(piece)
+                        offset += len(piece)
+                        if progress:
+                            progress(offset, total)
+
+            digest = hashlib.sha256()
+            with open(partial_path, 'rb') as downloaded:
+                for piece in iter(lambda: downloaded.read(MATERIAL_READ_BYTES), b''):
+                    digest.update(piece)
+            if digest.hexdigest() != content_hash:
+                print(f"Downloaded material {content_hash} is corrupted")
+                os.remove(partial_path)
+                return False
+
+            os.replace(partial_path, target_path)
+            return True
+        except (OSError, requests.exceptions.RequestException) as e:
+            print(f"Download failed: {e}")
+            return False
+
+    def fetch_material(self, content_hash: str, file_name: str, progress=None) -> Optional[str]:
+        """Путь к локальной копии материала (скачивается в кэш при первом обращении)"""
+        target_path = os.path.join(MATERIALS_CACHE_DIR, content_hash[:16], os.path.basename(file_name))
+        if os.path.exists(target_path):
+            return target_path
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        return target_path if self.download_material(content_hash, target_path, progress) else None
+
     # Дополнительные методы
+    @_mutation
     def update_avatar(self, avatar_data: bytes) -> bool:
-        """Обновление аватара пользователя"""
+        """Обновление аватара пользователя (байты или открытый файл - отправляются телом запроса как есть)"""
         try:
-            avatar_base64 = base64.b64encode(avatar_data).decode('utf-8')
             response = requests.post(
                 f"{self.base_url}/api/user/avatar",
-                json={
-                    "username": self.current_user['username'] if self.current_user else "",
-                    "avatar": avatar_base64
-                }
+                params={"username": self.current_user['username'] if self.current_user else ""},
+                data=avatar_data,
+                headers={"Content-Type": "application/octet-stream"}
             )
             data = response.json()
             return data.get('success', False)
         except requests.exceptions.RequestException:
             return False
 
+    @_mutation
     def update_participation(self, is_part: bool) -> bool:
         """Обновление статуса участия текущего пользователя"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/user/participation",
                 json={
                     "isPart": "Yes" if is_part else "No"
@@ -344,9 +1031,13 @@ class SimpleTheatreClient:
                     print("No username provided and no current user")
                     return None
 
+            prefetched = _prefetched_value(_cache_key("/api/user/participation", {"username": username}))
+            if prefetched is not _MISSING:
+                return prefetched == "Yes"
+
             print(f"Getting participation for username: {username}")
 
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/api/user/participation",
                 params={"username": username},
                 timeout=10
@@ -380,8 +1071,7 @@ class SimpleTheatreClient:
     def get_organizers(self) -> list:
         """Получение списка организаторов"""
         try:
-            response = requests.get(f"{self.base_url}/api/user/organizers")
-            return response.json()
+            return self._get_json_cached("/api/user/organizers")[1]
 
         except requests.exceptions.RequestException:
             return []
@@ -389,14 +1079,14 @@ class SimpleTheatreClient:
     def get_additional_files(self) -> list:
         """Получение дополнительных файлов"""
         try:
-            response = requests.get(f"{self.base_url}/api/additional-files")
-            return response.json()
+            return self._get_json_cached("/api/additional-files")[1]
         except requests.exceptions.RequestException:
             return []
 
+    @_mutation
     def create_additional_file(self, file_name: str, file_path: str, file_size: str = "", file_extension: str = "",
-                               last_modified: str = "") -> bool:
-        """Создание записи о дополнительном файле"""
+                               last_modified: str = "", content_hash: str = None) -> bool:
+        """Создание записи о дополнительном файле (content_hash - содержимое из upload_material)"""
         try:
             response = requests.post(
                 f"{self.base_url}/api/additional-files",
@@ -405,7 +1095,8 @@ class SimpleTheatreClient:
                     "file_path": file_path,
                     "file_size": file_size,
                     "file_extension": file_extension,
-                    "last_modified": last_modified
+                    "last_modified": last_modified,
+                    "content_hash": content_hash
                 }
             )
             data = response.json()
@@ -413,6 +1104,7 @@ class SimpleTheatreClient:
         except requests.exceptions.RequestException:
             return False
 
+    @_mutation
     def delete_additional_file(self, file_path: str) -> bool:
         """Удаление дополнительного файла"""
         try:
@@ -422,13 +1114,15 @@ class SimpleTheatreClient:
         except requests.exceptions.RequestException:
             return False
 
-    def get_user_avatar(self, username: str = None) -> Optional[bytes]:
-        """Получение аватара пользователя"""
+    def get_user_avatar(self, username: str = None, size: str = None) -> Optional[bytes]:
+        """Получение аватара пользователя (size - миниатюра, например "60x60")"""
         try:
             if not username:
                 username = self.current_user['username'] if self.current_user else ""
 
-            print(f"Requesting avatar for: {username}")
+            prefetched = _prefetched_value(_cache_key("/api/user/avatar", {"username": username}))
+            if prefetched is not _MISSING:
+                return self.get_image(prefetched, size)
 
             response = requests.get(
                 f"{self.base_url}/api/user/avatar",
@@ -436,43 +1130,51 @@ class SimpleTheatreClient:
                 timeout=10
             )
 
-            print(f"Avatar response status: {response.status_code}")
-            print(f"Avatar response headers: {response.headers}")
-
             if response.status_code == 200:
-                try:
-                    data = response.json()
-
-                    if data.get('success'):
-                        if data.get('avatar'):
-                            print("Avatar found, decoding...")
-                            return base64.b64decode(data['avatar'])
-                        else:
-                            print("No avatar in response")
-                            return None
-                    else:
-                        print(f"API error: {data.get('error')}")
-                        return None
-
-                except json.JSONDecodeError as e:
-                    print(f"JSON decode error: {e}")
-                    print(f"Response text: {response.text}")
-                    return None
-
-            elif response.status_code == 500:
-                print("Server error 500 - checking response...")
-                print(f"Error response: {response.text}")
+                data = response.json()
+                if data.get('success'):
+                    return self.get_image(data.get('avatar_url'), size)
+                print(f"API error: {data.get('error')}")
                 return None
             else:
                 print(f"Unexpected status code: {response.status_code}")
-                print(f"Response: {response.text}")
                 return None
 
         except requests.exceptions.RequestException as e:
             print(f"Request error: {e}")
             return None
-        except Exception as e:
-            print(f"Unexpected error in get_user_avatar: {e}")
+        except json.JSONDecodeError as e:
+            print(f"JSON decode error: {e}")
+            return None
+
+    def get_image(self, image_url: str, size: str = None) -> Optional[bytes]:
+        """Загрузка изображения по ссылке из ответа API (сырые байты).
+
+        size - готовая миниатюра с сервера ("60x60", "272x100" и т.д.)
+        """
+        if not image_url:
+            return None
+
+        cache_key = f"{image_url}?size={size}" if size else image_url
+        cached = _image_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            response = self.session.get(
+                f"{self.base_url}{image_url}",
+                params={"size": size} if size else None,
+                timeout=10
+            )
+            if response.status_code == 200:
+                # Пока миниатюра не готова, сервер отдает оригинал без immutable - не кэшируем
+                if 'immutable' in response.headers.get('Cache-Control', ''):
+                    _image_cache[cache_key] = response.content
+                return response.content
+            print(f"Image request failed: {response.status_code}")
+            return None
+        except requests.exceptions.RequestException as e:
+            print(f"Request error: {e}")
             return None
 
 
@@ -0,0 +1,73 @@
+"""Общие фикстуры тестов сервера: временная база и вход пользователей"""
+import io
+import os
+import sys
+import tempfile
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+# server.py читает путь к базе при импорте и сразу создает схему
+os.environ['THEATRE_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='theatre-test-'), 'theatre.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+import simple_api_client  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+class FlaskAdapter(BaseAdapter):
+    """Транспорт requests, отправляющий запросы клиента в тестовый клиент Flask"""
+
+    def __init__(self, test_client):
+        super().__init__()
+        self.test_client = test_client
+        self.urls = []
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        self.urls.append(request.url)
+        # Сжатие разбирает urllib3, которого здесь нет - просим ответ без него
+        headers = {name: value for name, value in request.headers.items() if name != 'Accept-Encoding'}
+        result = self.test_client.open(
+            url.path, query_string=url.query, method=request.method, headers=headers, data=request.body
+        )
+        response = requests.Response()
+        response.status_code = result.status_code
+        response.headers = CaseInsensitiveDict(result.headers)
+        # Тело читается из raw, как у настоящего ответа: работают и content, и iter_content
+        response.raw = io.BytesIO(result.get_data())
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def api(client):
+    """SimpleTheatreClient, работающий с тестовым сервером; общие кэши модуля сбрасываются"""
+    api_client = simple_api_client.SimpleTheatreClient()
+    api_client.base_url = 'http://testserver'
+    api_client.adapter = FlaskAdapter(client)
+    api_client.session.mount('http://testserver', api_client.adapter)
+    yield api_client
+    simple_api_client.SimpleTheatreClient.set_session_token(None)
+    simple_api_client._response_cache.clear()
+    simple_api_client._prefetched.clear()
+
+
+def login(client, username, organizer=False):
+    """Регистрация (если нужно) и вход; возвращает заголовки с токеном сессии"""
+    password = 'secret20041889' if organizer else 'secret'
+    client.post('/api/auth/register', json={"username": username, "password": password})
+    response = client.post('/api/login', json={"username": username, "password": password})
+    return {"Authorization": f"Bearer {response.get_json()['token']}"}
@@ -0,0 +1,54 @@
+import sqlite3
+
+import backup
+import server
+
+
+def legacy_database(path):
+    """Файл в режиме WAL без auto_vacuum, со свободными страницами после удаления"""
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('CREATE TABLE materials (body BLOB)')
+    conn.executemany('INSERT INTO materials VALUES (?)', [(b'x' * 1000,)] * 2000)
+    conn.commit()
+    conn.execute('DELETE FROM materials')
+    conn.commit()
+    conn.close()
+
+
+def auto_vacuum(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_new_server_database_uses_incremental_vacuum():
+    assert auto_vacuum(server.DATABASE_PATH) == 2
+
+
+def test_server_startup_does_not_vacuum_existing_database(tmp_path, monkeypatch, caplog):
+    path = str(tmp_path / 'theatre.db')
+    legacy_database(path)
+    monkeypatch.setattr(server, 'DATABASE_PATH', path)
+
+    conn = server._open_db_connection()
+    try:
+        server.check_incremental_vacuum(conn)
+    finally:
+        conn.close()
+
+    assert auto_vacuum(path) == 0
+    assert 'backup.py vacuum' in caplog.text
+
+
+def test_vacuum_command_converts_once(tmp_path):
+    path = str(tmp_path / 'theatre.db')
+    legacy_database(path)
+
+    result = backup.enable_incremental_vacuum(path)
+
+    assert result['vacuumed_size'] < result['size']
+    assert auto_vacuum(path) == 2
+    assert backup.enable_incremental_vacuum(path) is None
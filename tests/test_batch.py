@@ -0,0 +1,73 @@
+import server
+from conftest import login
+
+
+def add(title):
+    return {"method": 'POST', "path": '/api/performances', "body": {"title": title}}
+
+
+def titles(client):
+    return {item['title'] for item in client.get('/api/performances?fields=title').get_json()}
+
+
+def fail_titles(monkeypatch, failing, status):
+    """Маршрут спектаклей для названий из failing пишет строку и затем возвращает ошибку"""
+    real_view = server.app.view_functions['add_performance']
+
+    def add_or_fail():
+        if server.request.json['title'] not in failing:
+            return real_view()
+        conn = server.get_db_connection()
+        conn.execute("INSERT INTO performances (title) VALUES (?)", (server.request.json['title'],))
+        return server.jsonify({"success": False, "error": "Database error: disk I/O error"}), status
+    monkeypatch.setitem(server.app.view_functions, 'add_performance', add_or_fail)
+
+
+def test_batch_rolls_back_only_the_failed_operation(client, monkeypatch):
+    headers = login(client, 'batch_organizer', organizer=True)
+    fail_titles(monkeypatch, {'Пакет: упавший'}, 500)
+
+    response = client.post('/api/batch', headers=headers, json={"operations": [
+        add('Пакет: первый'), add('Пакет: упавший'), add('Пакет: последний'),
+    ]})
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert not body['success']
+    assert [result['status'] for result in body['results']] == [200, 500, 200]
+    assert {'Пакет: первый', 'Пакет: последний'} <= titles(client)
+    assert 'Пакет: упавший' not in titles(client)
+
+
+def test_atomic_batch_rolls_back_everything_and_skips_the_rest(client, monkeypatch):
+    headers = login(client, 'batch_organizer', organizer=True)
+    fail_titles(monkeypatch, {'Атомарный: упавший'}, 400)
+
+    body = client.post('/api/batch', headers=headers, json={"operations": [
+        add('Атомарный: до'), add('Атомарный: упавший'), add('Атомарный: после'),
+    ], "atomic": True}).get_json()
+
+    assert [result['status'] for result in body['results']] == [200, 400, 424]
+    assert not body['success']
+    assert not {'Атомарный: до', 'Атомарный: упавший', 'Атомарный: после'} & titles(client)
+
+
+def test_batch_commits_successful_operations_together(client):
+    headers = login(client, 'batch_organizer', organizer=True)
+    before = client.get('/api/performances', headers=headers).headers['ETag']
+
+    body = client.post('/api/batch', headers=headers,
+                       json={"operations": [add('Вместе: 1'), add('Вместе: 2')]}).get_json()
+
+    assert body['success'] and [result['status'] for result in body['results']] == [200, 200]
+    assert {'Вместе: 1', 'Вместе: 2'} <= titles(client)
+    # Кэш ответов сброшен после COMMIT - ETag списка сменился
+    assert client.get('/api/performances', headers=headers).headers['ETag'] != before
+
+
+def test_batch_rejects_excluded_paths(client):
+    headers = login(client, 'batch_organizer', organizer=True)
+    body = client.post('/api/batch', headers=headers, json={"operations": [
+        {"method": 'POST', "path": '/api/batch', "body": {}},
+    ]}).get_json()
+    assert body['results'][0]['status'] == 400
@@ -0,0 +1,42 @@
+from conftest import login
+
+
+def create_role(client, headers):
+    client.post('/api/performances', headers=headers, data={"title": 'Журнал', "performance_on": '2030-02-01'})
+    items = client.get('/api/performances?fields=id,title').get_json()
+    performance_id = [item['id'] for item in items if item['title'] == 'Журнал'][-1]
+    client.post('/api/roles', headers=headers, json={"performance_id": performance_id, "role_name": 'Гамлет'})
+    roles = client.get(f'/api/performances/{performance_id}/roles').get_json()
+    return roles[-1]['id']
+
+
+def test_changes_requires_session(client):
+    assert client.get('/api/changes?since=head').status_code == 401
+
+
+def test_changes_from_head_without_snapshot(client):
+    headers = login(client, 'changes_organizer', organizer=True)
+    role_id = create_role(client, headers)
+
+    head = client.get('/api/changes?since=head', headers=headers).get_json()
+    assert head['changes'] == {table: {"upserted": [], "deleted": []} for table in head['changes']}
+    assert client.get('/api/changes?tables=users', headers=headers).status_code == 400
+
+    actor = login(client, 'changes_actor')
+    client.post('/api/apply', headers=actor, json={"role_id": role_id, "username": 'changes_actor'})
+    delta = client.get(f"/api/changes?since={head['next']}&tables=role_applications", headers=headers).get_json()
+    assert not delta['reset'] and list(delta['changes']) == ['role_applications']
+    assert [row['username'] for row in delta['changes']['role_applications']['upserted']] == ['changes_actor']
+
+
+def test_changes_actor_sees_only_own_applications(client):
+    role_id = create_role(client, login(client, 'changes_organizer', organizer=True))
+    own, other = login(client, 'changes_own'), login(client, 'changes_other')
+    head = client.get('/api/changes?since=head', headers=own).get_json()['next']
+    client.post('/api/apply', headers=own, json={"role_id": role_id, "username": 'changes_own'})
+    client.post('/api/apply', headers=other, json={"role_id": role_id, "username": 'changes_other'})
+
+    delta = client.get(f'/api/changes?since={head}', headers=own).get_json()
+    assert [row['username'] for row in delta['changes']['role_applications']['upserted']] == ['changes_own']
+    snapshot = client.get('/api/changes?since=0&tables=role_applications', headers=own).get_json()
+    assert {row['username'] for row in snapshot['changes']['role_applications']['upserted']} == {'changes_own'}
@@ -0,0 +1,56 @@
+import sqlite3
+
+import server
+import simple_api_client
+from conftest import login
+
+
+def use_session(api, headers):
+    api.set_session_token(headers['Authorization'].split()[1])
+
+
+def test_sync_changes_from_empty_log_without_snapshot(client, api):
+    headers = login(client, 'sync_organizer', organizer=True)
+    use_session(api, headers)
+    with sqlite3.connect(server.DATABASE_PATH) as conn:
+        conn.execute('DELETE FROM change_log')
+
+    assert api.sync_changes(['performances', 'roles']) is None
+    assert api.change_seq == 0
+    assert api.sync_changes(['performances', 'roles']) == set()
+
+    client.post('/api/performances', headers=headers, data={"title": 'Журнал клиента'})
+    assert api.sync_changes(['performances', 'roles']) == {'performances', 'roles'}
+    assert api.change_seq > 0
+    assert api.sync_changes(['performances', 'roles']) == set()
+
+    # Снимок (since=0) клиент не запрашивал ни разу
+    assert not [url for url in api.adapter.urls if 'since=0' in url]
+
+
+def test_iter_collection_walks_cursor_and_caches_first_page(client, api):
+    headers = login(client, 'pages_cache_organizer', organizer=True)
+    use_session(api, headers)
+    for day in range(1, 6):
+        client.post('/api/performances', headers=headers,
+                    data={"title": f'Страница {day}', "performance_on": f'2031-01-0{day}'})
+    expected = [item['id'] for item in client.get('/api/performances?fields=id&limit=500').get_json()['items']]
+
+    ids = [item['id'] for item in api.iter_performances(page_size=2, fields=['id'])]
+
+    assert ids == expected
+    assert sum('after=' in url for url in api.adapter.urls) == (len(expected) - 1) // 2
+    assert [key for key in simple_api_client._response_cache if '/api/performances' in key] == \
+        [simple_api_client._cache_key('/api/performances', {"limit": 2, "fields": 'id'})]
+
+
+def test_response_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(simple_api_client, 'RESPONSE_CACHE_SIZE', 2)
+    simple_api_client._store_response('/a', '"1"', [])
+    simple_api_client._store_response('/b', '"2"', [])
+    assert simple_api_client._cached_response('/a') == ('"1"', [])
+
+    simple_api_client._store_response('/c', '"3"', [])
+
+    assert list(simple_api_client._response_cache) == ['/a', '/c']
+    simple_api_client._response_cache.clear()
@@ -0,0 +1,28 @@
+import server
+from conftest import login
+
+
+def test_events_require_session(client):
+    assert client.get('/api/events').status_code == 401
+
+
+def test_events_limit_streams_per_user(client, monkeypatch):
+    monkeypatch.setattr(server, 'SSE_MAX_STREAMS_PER_USER', 1)
+    headers = login(client, 'events_listener')
+
+    stream = client.get('/api/events', headers=headers, buffered=False)
+    assert stream.status_code == 200
+    assert next(stream.response) == b'retry: 3000\n\n'
+
+    refused = client.get('/api/events', headers=headers, buffered=False)
+    assert refused.status_code == 503 and refused.headers['Retry-After'] == '3'
+    other = client.get('/api/events', headers=login(client, 'events_other'), buffered=False)
+    assert other.status_code == 200
+    other.close()
+
+    # Закрытый поток освобождает место
+    stream.close()
+    reopened = client.get('/api/events', headers=headers, buffered=False)
+    assert reopened.status_code == 200
+    reopened.close()
+    assert server._sse_streams == {}
@@ -0,0 +1,29 @@
+from datetime import date
+
+import server
+
+
+def _today(monkeypatch, value):
+    class FixedDate(date):
+        @classmethod
+        def today(cls):
+            return cls.fromisoformat(value)
+
+    monkeypatch.setattr(server, 'date_cls', FixedDate)
+
+
+def test_upcoming_lessons_change_at_midnight(client, monkeypatch):
+    """upcoming=1 зависит от даты: после полуночи нет ни 304, ни ответа из кэша"""
+    for day in ('01-03-2040', '03-03-2040'):
+        assert client.post('/api/lessons', json={"title": 'Репетиция', "date": day}).status_code == 200
+
+    _today(monkeypatch, '2040-03-01')
+    first = client.get('/api/lessons?upcoming=1&limit=1')
+    assert first.get_json()['items'][0]['date'] == '01-03-2040'
+    etag = first.headers['ETag']
+    assert client.get('/api/lessons?upcoming=1&limit=1', headers={"If-None-Match": etag}).status_code == 304
+
+    _today(monkeypatch, '2040-03-02')
+    next_day = client.get('/api/lessons?upcoming=1&limit=1', headers={"If-None-Match": etag})
+    assert next_day.status_code == 200
+    assert next_day.get_json()['items'][0]['date'] == '03-03-2040'
@@ -0,0 +1,65 @@
+import time
+
+import server
+from conftest import login
+
+
+def _route_metrics(method, route):
+    return server._metrics_snapshot().get((method, route), server._new_route_metrics())
+
+
+def test_batch_latency_covers_all_operations(client, monkeypatch):
+    """Время пакета - от начала до конца, операции не учитываются как отдельные запросы"""
+    create_lesson = server.app.view_functions['create_lesson']
+
+    def slow_create_lesson():
+        time.sleep(0.2)
+        return create_lesson()
+
+    monkeypatch.setitem(server.app.view_functions, 'create_lesson', slow_create_lesson)
+    batch_before = _route_metrics('POST', '/api/batch')
+    lessons_before = _route_metrics('POST', '/api/lessons')
+
+    operation = {"method": 'POST', "path": '/api/lessons', "body": {"title": 'Репетиция', "date": '01-02-2030'}}
+    response = client.post('/api/batch', json={"operations": [operation, operation]})
+    assert response.status_code == 200
+    assert [result['status'] for result in response.get_json()['results']] == [200, 200]
+
+    batch_after = _route_metrics('POST', '/api/batch')
+    assert batch_after['count'] == batch_before['count'] + 1
+    assert batch_after['latency_sum'] - batch_before['latency_sum'] >= 0.4
+    assert _route_metrics('POST', '/api/lessons')['count'] == lessons_before['count']
+
+
+def test_cursor_iteration_is_timed_per_batch(monkeypatch):
+    """Обход курсора учитывается пачками строк, а не на каждой строке"""
+    calls = []
+    record_statement_time = server.record_statement_time
+    monkeypatch.setattr(server, 'record_statement_time',
+                        lambda cursor, elapsed, new: calls.append(new) or record_statement_time(cursor, elapsed, new))
+    conn = server._open_db_connection()
+    conn.query_time = 0.0
+    calls.clear()  # PRAGMA при открытии соединения
+    try:
+        rows = conn.execute('WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 1000) '
+                            'SELECT x FROM n')
+        assert [row['x'] for row in rows] == list(range(1, 1001))
+    finally:
+        conn.close()
+
+    assert calls[0] is True and calls.count(True) == 1
+    assert len(calls) == 1 + 1000 // server.CURSOR_ITER_BATCH + 1
+    assert conn.query_time > 0
+
+
+def test_streamed_response_bytes_are_counted(client):
+    headers = login(client, 'metrics_listener')
+    before = _route_metrics('GET', '/api/events')
+
+    stream = client.get('/api/events', headers=headers, buffered=False)
+    first_chunk = next(stream.response)
+    stream.close()
+
+    after = _route_metrics('GET', '/api/events')
+    assert after['streamed'] == before['streamed'] + 1
+    assert after['bytes_sum'] - before['bytes_sum'] == len(first_chunk)
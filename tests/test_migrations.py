@@ -0,0 +1,40 @@
+import base64
+import sqlite3
+
+import server
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 32
+
+
+def legacy_performances(*covers):
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE performances (id INTEGER PRIMARY KEY, cover_image, '
+                 'cover_hash TEXT, cover_size INTEGER, cover_mime TEXT)')
+    conn.executemany('INSERT INTO performances (cover_image) VALUES (?)', [(cover,) for cover in covers])
+    return conn
+
+
+def stored_covers(conn):
+    rows = conn.execute('SELECT cover_image, cover_hash, cover_mime FROM performances ORDER BY id').fetchall()
+    assert all(row['cover_image'] is None for row in rows)
+    result = []
+    for row in rows:
+        if row['cover_hash'] is None:
+            result.append(None)
+            continue
+        with open(server._blob_path(row['cover_hash']), 'rb') as blob:
+            result.append((blob.read(), row['cover_mime']))
+    return result
+
+
+def test_blob_migration_keeps_undecodable_images():
+    conn = legacy_performances(base64.b64encode(PNG).decode(), 'обложка: не base64!', '')
+
+    server._move_images_to_blob_store(conn, 'performances', 'cover_image', 'cover')
+
+    assert stored_covers(conn) == [
+        (PNG, 'image/png'),
+        ('обложка: не base64!'.encode('utf-8'), 'application/octet-stream'),
+        None,
+    ]
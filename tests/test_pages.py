@@ -0,0 +1,90 @@
+"""Отрисовка списков страниц данными тестового сервера (нужны PyQt6 и Python 3.12)"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from conftest import login
+
+if sys.version_info < (3, 12):
+    pytest.skip("страницы используют синтаксис f-строк Python 3.12", allow_module_level=True)
+QtWidgets = pytest.importorskip('PyQt6.QtWidgets')
+from PyQt6.QtCore import Qt  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def qapp():
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def applications_page(current_user):
+    """Минимум PerfPage, нужный render_applications"""
+    from Pages.perf_page import PerfPage
+    page = SimpleNamespace(applicationsList=QtWidgets.QListWidget(), current_user=current_user)
+    return page, PerfPage.render_applications
+
+
+def apply_for_new_role(client, organizer, actor, username):
+    client.post('/api/performances', headers=organizer, data={"title": 'Страница', "performance_on": '2030-03-01'})
+    items = client.get('/api/performances?fields=id,title').get_json()
+    performance_id = max(item['id'] for item in items if item['title'] == 'Страница')
+    client.post('/api/roles', headers=organizer, json={"performance_id": performance_id, "role_name": 'Офелия'})
+    role_id = client.get(f'/api/performances/{performance_id}/roles').get_json()[-1]['id']
+    client.post('/api/apply', headers=actor, json={"role_id": role_id, "username": username})
+
+
+def test_render_actor_applications(client, api, qapp):
+    organizer = login(client, 'pages_organizer', organizer=True)
+    actor = login(client, 'pages_actor')
+    apply_for_new_role(client, organizer, actor, 'pages_actor')
+
+    api.set_session_token(actor['Authorization'].split()[1])
+    api.current_user = {"username": 'pages_actor', "role": 'actor'}
+    page, render_applications = applications_page('actor')
+    render_applications(page, api.get_applications())
+
+    item = page.applicationsList.item(page.applicationsList.count() - 1)
+    assert item.text().startswith('Офелия\nСтраница\nОжидает')
+    assert item.data(Qt.ItemDataRole.UserRole + 1) is None
+
+
+def test_render_organizer_applications_keeps_applicant(client, api, qapp):
+    organizer = login(client, 'pages_organizer', organizer=True)
+    apply_for_new_role(client, organizer, login(client, 'pages_applicant'), 'pages_applicant')
+
+    api.set_session_token(organizer['Authorization'].split()[1])
+    api.current_user = {"username": 'pages_organizer', "role": 'organizer'}
+    page, render_applications = applications_page('organizer')
+    render_applications(page, api.get_applications())
+
+    applicants = [page.applicationsList.item(i).data(Qt.ItemDataRole.UserRole + 1)
+                  for i in range(page.applicationsList.count())]
+    assert 'pages_applicant' in applicants
+
+
+def test_uploader_reports_file_only_after_record_saved(client, api, qapp, tmp_path, monkeypatch):
+    from Pages.addit_page import MaterialUploader
+    api.set_session_token(login(client, 'pages_organizer', organizer=True)['Authorization'].split()[1])
+    material = tmp_path / 'сцена.txt'
+    material.write_bytes('реплики'.encode('utf-8'))
+    file = {"file_path": str(material), "file_name": material.name, "file_size": '14 B',
+            "file_extension": '.txt', "last_modified": '2030-01-01T00:00:00'}
+
+    def run_uploader():
+        uploader = MaterialUploader([file])
+        uploader.client = api
+        events = []
+        uploader.uploaded.connect(lambda path, content_hash: events.append(('uploaded', path)))
+        uploader.failed.connect(lambda path, message: events.append(('failed', path)))
+        uploader.run()
+        return events
+
+    with monkeypatch.context() as patch:
+        patch.setitem(server.app.view_functions, 'create_additional_file',
+                      lambda: (server.jsonify({"success": False, "error": "Database error: locked"}), 500))
+        assert run_uploader() == [('failed', str(material))]
+
+    assert run_uploader() == [('uploaded', str(material))]
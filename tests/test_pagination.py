@@ -0,0 +1,65 @@
+import server
+from conftest import login
+
+FIELDS = 'fields=id,title,performance_on'
+
+
+def pages(client, limit, query=FIELDS):
+    """Все страницы коллекции спектаклей по курсору"""
+    result, after = [], None
+    while True:
+        url = f'/api/performances?{query}&limit={limit}' + (f'&after={after}' if after else '')
+        body = client.get(url).get_json()
+        result.append(body['items'])
+        after = body['next_cursor']
+        if not after:
+            return result
+
+
+def test_pages_cover_collection_in_order(client):
+    headers = login(client, 'page_organizer', organizer=True)
+    # Одинаковые даты: порядок внутри дня задает id - второй ключ курсора
+    for title, day in (('Курсор А', '2033-05-02'), ('Курсор Б', '2033-05-01'), ('Курсор В', '2033-05-02')):
+        client.post('/api/performances', headers=headers, data={"title": title, "performance_on": day})
+    whole = client.get(f'/api/performances?{FIELDS}').get_json()
+
+    for limit in (1, 2, 500):
+        result = pages(client, limit)
+        assert [item for page in result for item in page] == whole
+        assert all(len(page) == limit for page in result[:-1])
+        assert 0 < len(result[-1]) <= limit
+
+
+def test_cursor_is_stable_under_inserts_before_it(client):
+    headers = login(client, 'page_organizer', organizer=True)
+    for day in range(1, 5):
+        client.post('/api/performances', headers=headers,
+                    data={"title": f'Сдвиг {day}', "performance_on": f'2034-01-0{day}'})
+    query = FIELDS + '&from=2034-01-01&to=2034-01-31'
+    first = client.get(f'/api/performances?{query}&limit=2').get_json()
+
+    # Запись в начало списка не сдвигает следующую страницу (в отличие от OFFSET)
+    client.post('/api/performances', headers=headers, data={"title": 'Сдвиг 0', "performance_on": '2034-01-01'})
+    second = client.get(f'/api/performances?{query}&limit=2&after={first["next_cursor"]}').get_json()
+
+    assert [item['title'] for item in first['items'] + second['items']] == [f'Сдвиг {day}' for day in range(1, 5)]
+    assert second['next_cursor'] is None
+
+
+def test_limit_is_capped(client, monkeypatch):
+    headers = login(client, 'page_organizer', organizer=True)
+    for day in range(1, 4):
+        client.post('/api/performances', headers=headers, data={"title": f'Предел {day}'})
+    monkeypatch.setattr(server, 'PAGE_SIZE_MAX', 2)
+
+    body = client.get(f'/api/performances?{FIELDS}&limit=100').get_json()
+
+    assert len(body['items']) == 2
+    assert body['next_cursor']
+
+
+def test_bad_page_parameters_are_rejected(client):
+    for query in ('limit=0', 'limit=abc', 'limit=2&after=not-a-cursor', 'limit=2&after=WzFd', 'fields=password'):
+        response = client.get(f'/api/performances?{query}')
+        assert response.status_code == 400, query
+        assert response.get_json()['error']
@@ -0,0 +1,49 @@
+import io
+
+from conftest import login
+
+
+def test_create_performance_without_cover(client):
+    """Форма без файла (data= без files= у requests) создает спектакль"""
+    headers = login(client, 'perf_organizer', organizer=True)
+    response = client.post('/api/performances', headers=headers, data={
+        "title": 'Без обложки',
+        "description": 'Описание',
+        "performance_date": '2030-01-15',
+        "performance_on": '2030-01-15',
+    })
+    assert response.status_code == 200, response.get_json()
+
+    items = client.get('/api/performances?fields=title,performance_on,description').get_json()
+    created = [item for item in items if item['title'] == 'Без обложки']
+    assert created == [{"title": 'Без обложки', "performance_on": '2030-01-15', "description": 'Описание'}]
+
+
+def test_create_performance_with_cover(client):
+    headers = login(client, 'perf_organizer', organizer=True)
+    png = b'\x89PNG\r\n\x1a\n' + b'\0' * 64
+    response = client.post('/api/performances', headers=headers, data={
+        "title": 'С обложкой', "cover": (io.BytesIO(png), 'cover.png', 'image/png'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+
+
+def test_create_performance_rejects_malformed_iso_date(client):
+    headers = login(client, 'perf_organizer', organizer=True)
+    for value in ('15.01.2030', '2030-13-01', '2030-1-5', '2030-01-15; DROP', 20300115):
+        response = client.post('/api/performances', headers=headers,
+                               json={"title": 'Плохая дата', "performance_on": value})
+        assert response.status_code == 400, value
+
+    items = client.get('/api/performances?fields=title').get_json()
+    assert 'Плохая дата' not in [item['title'] for item in items]
+
+
+def test_create_performance_derives_iso_date_from_legacy_text(client):
+    headers = login(client, 'perf_organizer', organizer=True)
+    response = client.post('/api/performances', headers=headers,
+                           json={"title": 'Старый клиент', "performance_date": '2030-25-12'})
+    assert response.status_code == 200
+
+    items = client.get('/api/performances?fields=title,performance_on').get_json()
+    assert {"title": 'Старый клиент', "performance_on": '2030-12-25'} in items
@@ -0,0 +1,38 @@
+import sqlite3
+
+import server
+from conftest import login
+
+
+class FailingConnection:
+    """Соединение, на котором запись продления сессии падает"""
+
+    def executemany(self, sql, params):
+        raise sqlite3.OperationalError('database is locked')
+
+    def rollback(self):
+        pass
+
+
+def test_bootstrap_ignores_username_without_session(client):
+    login(client, 'bootstrap_victim')
+    response = client.get('/api/bootstrap?username=bootstrap_victim')
+    assert response.status_code == 401
+
+
+def test_bootstrap_uses_session_user(client):
+    headers = login(client, 'bootstrap_owner')
+    response = client.get('/api/bootstrap?username=someone_else', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['user']['username'] == 'bootstrap_owner'
+
+
+def test_failed_session_touches_are_kept(monkeypatch):
+    monkeypatch.setattr(server, 'SESSION_TOUCH_INTERVAL', 0)
+    monkeypatch.setitem(server._session_touches, 'other-token', 100)
+
+    server._touch_session(FailingConnection(), 'failed-token', 200)
+
+    assert server._session_touches['failed-token'] == 200
+    assert server._session_touches['other-token'] == 100
+    del server._session_touches['failed-token']
@@ -0,0 +1,71 @@
+import pytest
+
+import server
+from conftest import login
+
+
+def performances_body(client, accept='application/json'):
+    # Ответы списков кэшируются по версии таблиц - каждый раз строим заново
+    server._response_cache.clear()
+    response = client.get('/api/performances?fields=id,title,performance_on', headers={"Accept": accept})
+    assert response.status_code == 200
+    # Ответ тестового клиента всегда итератор - потоковый узнаем по отсутствию длины
+    return 'Content-Length' not in response.headers, response.get_data()
+
+
+@pytest.mark.parametrize('accept', ['application/json', server.COLUMNAR_MIMETYPE])
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_streamed_and_whole_responses_encode_the_same(client, monkeypatch, accept, use_orjson):
+    headers = login(client, 'stream_organizer', organizer=True)
+    for title in ('Чайка', 'Вишнёвый сад', 'Три сестры'):
+        client.post('/api/performances', headers=headers, data={"title": title, "performance_date": '2030-04-01'})
+    if not use_orjson:
+        monkeypatch.setattr(server, 'orjson', None)
+
+    streamed, whole = performances_body(client, accept)
+    assert not streamed
+
+    monkeypatch.setattr(server, 'STREAM_BATCH_ROWS', 1)
+    streamed, chunked = performances_body(client, accept)
+    assert streamed
+    assert chunked == whole
+    assert 'Вишнёвый сад'.encode('utf-8') in whole
+
+
+@pytest.fixture
+def performances(client):
+    headers = login(client, 'stream_organizer', organizer=True)
+    for day in range(1, 4):
+        client.post('/api/performances', headers=headers,
+                    data={"title": f'Формат {day}', "performance_on": f'2032-02-0{day}'})
+    server._response_cache.clear()
+    return client.get('/api/performances?fields=id,title').get_json()
+
+
+def test_accept_selects_list_format(client, performances):
+    columnar = client.get('/api/performances?fields=id,title', headers={"Accept": server.COLUMNAR_MIMETYPE})
+    assert columnar.mimetype == server.COLUMNAR_MIMETYPE
+    assert 'Accept' in columnar.headers['Vary']
+    body = columnar.get_json(force=True)
+    assert body['columns'] == ['id', 'title']
+    assert [dict(zip(body['columns'], row)) for row in body['rows']] == performances
+
+    # Без подходящего формата и с */* - обычный JSON
+    for accept in ('*/*', 'text/html'):
+        response = client.get('/api/performances?fields=id,title', headers={"Accept": accept})
+        assert response.mimetype == server.JSON_MIMETYPE
+        assert response.get_json() == performances
+
+
+def test_msgpack_is_built_whole_even_for_long_lists(client, monkeypatch, performances):
+    msgpack = pytest.importorskip('msgpack')
+    monkeypatch.setattr(server, 'STREAM_BATCH_ROWS', 1)
+    server._response_cache.clear()
+
+    response = client.get('/api/performances?fields=id,title', headers={"Accept": server.MSGPACK_MIMETYPE})
+
+    assert response.mimetype == server.MSGPACK_MIMETYPE
+    assert 'Content-Length' in response.headers
+    body = msgpack.unpackb(response.get_data(), raw=False)
+    assert [dict(zip(body['columns'], row)) for row in body['rows']] == performances
+